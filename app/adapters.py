@@ -1,42 +1,415 @@
+import asyncio
+import logging
+from contextlib import nullcontext
+import numpy as np
+import pymongo
+from langchain_core.documents import Document
+from langchain_core.runnables.config import run_in_executor
+from langchain_mongodb.pipelines import vector_search_stage
+from langchain_mongodb.utils import make_serializable
 from langchain_mongodb.vectorstores import MongoDBAtlasVectorSearch
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from langchain.chains.query_constructor.base import (
+    StructuredQueryOutputParser,
+    get_query_constructor_prompt,
+)
+from langchain.chains.query_constructor.schema import AttributeInfo
+from langchain_permit.retrievers import PermitSelfQueryRetriever
+
+from utils.document_storage import SPLIT
+from utils.embedding_backends import truncate_vector
+from utils.profiling import attach_thread
+from utils.rank_fusion import RRF_K, reciprocal_rank_fusion
+from utils.vector_index import PREFIX_INDEX_NAME
+
+from .permissions import allowed_ids_from_permissions
+from .resilience import remaining_budget
+from .utils import search_projection
+
+logger = logging.getLogger(__name__)
 
 
 class MongoDBAtlasVectorSearchWithQueryTransformer(MongoDBAtlasVectorSearch):
     """MongoDB Atlas Vector Search with added query transformer support for PermitSelfQueryRetriever."""
 
-    # Store the current retriever being used
-    _current_retriever = None
+    # Optional app.resilience.StageGuard for embedding and search calls
+    stages = None
 
-    def as_query_transformer(self):
-        """Create a query transformer compatible with PermitSelfQueryRetriever."""
+    # Model ID recorded on stored vectors; searches only match vectors from it
+    embedding_model = None
+
+    # With prefix_dimensions set, candidates are found on the prefix index and
+    # rerank_factor * k of them are re-scored with their full vectors
+    prefix_dimensions = 0
+    prefix_index_name = PREFIX_INDEX_NAME
+    prefix_key = "vector_prefix"
+    rerank_factor = 10
 
-        # Reference to the outer class from the inner function
-        vector_store = self
+    # Return snippets instead of bodies from searches; see afetch_contents()
+    projected = False
+
+    # utils.document_storage.DocumentStorage holding the full bodies
+    storage = None
+
+    # With hybrid set, a full-text search on the same pre-filter runs next to
+    # the vector search, each returning hybrid_factor * k candidates, and the
+    # two rankings are fused with reciprocal rank fusion
+    hybrid = False
+    hybrid_factor = 4
+    rrf_k = RRF_K
+
+    def as_query_transformer(self):
+        """
+        Create a query transformer compatible with PermitSelfQueryRetriever.
+        Only the permission clauses the retriever added to the structured
+        query's filter become the pre-filter; the LLM's own filters are not
+        applied.
+        """
 
         def transform_query(structured_query):
             """Transform a structured query to MongoDB filter format."""
+            query_filter = structured_query.filter
+            if not isinstance(query_filter, dict):
+                query_filter = {}
+            elif "$and" in query_filter:
+                clauses = [c for c in query_filter["$and"] if isinstance(c, dict)]
+                query_filter = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+            k = structured_query.limit if structured_query.limit else 4
+            return {"pre_filter": query_filter, "k": k}
+
+        return transform_query
+
+    def _stage(self, name: str):
+        if self.stages is None:
+            return nullcontext()
+        return self.stages.stage(name)
+
+    def _search_within_budget(self, *args: Any, **kwargs: Any):
+        # Runs in an executor thread; the request's deadline is carried over in
+        # the copied context and becomes the server-side timeout of the search.
+        with attach_thread(), pymongo.timeout(remaining_budget()):
+            if self.prefix_dimensions:
+                return self._two_stage_search_with_score(*args, **kwargs)
+            if self.projected:
+                keep = [self._embedding_key] if kwargs.get("include_embeddings") else []
+                kwargs["post_filter_pipeline"] = [
+                    *(kwargs.get("post_filter_pipeline") or []),
+                    search_projection(self._text_key, keep),
+                ]
+            return self._similarity_search_with_score(*args, **kwargs)
+
+    def _two_stage_search_with_score(
+        self,
+        query_vector: List[float],
+        k: int = 4,
+        pre_filter: Optional[Dict[str, Any]] = None,
+        post_filter_pipeline: Optional[List[Dict]] = None,
+        oversampling_factor: int = 10,
+        include_embeddings: bool = False,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Search the smaller prefix index for candidates, then rank them by
+        cosine similarity of their full vectors to the full query vector.
+        """
+        pipeline = [
+            vector_search_stage(
+                truncate_vector(query_vector, self.prefix_dimensions),
+                self.prefix_key,
+                self.prefix_index_name,
+                k * self.rerank_factor,
+                pre_filter,
+                oversampling_factor,
+                **kwargs,
+            ),
+        ]
+        if post_filter_pipeline is not None:
+            pipeline.extend(post_filter_pipeline)
+        if self.projected:
+            # The full vector is still needed here to re-score the candidates
+            pipeline.append(search_projection(self._text_key, [self._embedding_key]))
+        else:
+            pipeline.append({"$project": {self.prefix_key: 0}})
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        docs = []
+        for res in self._collection.aggregate(pipeline):
+            if self._text_key not in res or self._embedding_key not in res:
+                continue
+            vector = np.asarray(res[self._embedding_key], dtype=np.float32)
+            cosine = float(vector @ query) / (float(np.linalg.norm(vector)) or 1)
+            if not include_embeddings:
+                del res[self._embedding_key]
+            text = res.pop(self._text_key)
+            make_serializable(res)
+            # Same scale as Atlas' cosine vectorSearchScore
+            docs.append(
+                (
+                    Document(page_content=text, metadata=res, id=res["_id"]),
+                    (1 + cosine) / 2,
+                )
+            )
+        docs.sort(key=lambda doc: doc[1], reverse=True)
+        return docs[:k]
+
+    def _text_search_within_budget(
+        self, query: str, k: int, pre_filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        """Documents matching the query in the text index, by text score."""
+        with attach_thread(), pymongo.timeout(remaining_budget()):
+            if self.storage is not None and self.storage.layout == SPLIT:
+                return self._chunk_text_search(query, k, pre_filter)
+            pipeline = [
+                {"$match": {"$text": {"$search": query}, **(pre_filter or {})}},
+                {"$sort": {"score": {"$meta": "textScore"}}},
+                {"$limit": k},
+                {"$set": {"score": {"$meta": "textScore"}}},
+            ]
+            return self._text_search_results(pipeline)
+
+    def _chunk_text_search(
+        self, query: str, k: int, pre_filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Text search of the split layout, whose documents only hold a preview:
+        the bodies' chunks are searched, narrowed by the pre-filter's
+        document_id condition, and the pre-filter as a whole is then applied
+        to the matching documents.
+        """
+        pre_filter = pre_filter or {}
+        scores = dict(
+            self.storage.search_chunks(query, k, pre_filter.get("document_id"))
+        )
+        if not scores:
+            return []
+        pipeline = [
+            {"$match": pre_filter},
+            {"$match": {"document_id": {"$in": list(scores)}}},
+        ]
+        docs = [
+            (doc, scores[doc.metadata["document_id"]])
+            for doc, _ in self._text_search_results(pipeline)
+        ]
+        docs.sort(key=lambda doc: doc[1], reverse=True)
+        return docs
+
+    def _text_search_results(
+        self, pipeline: List[Dict[str, Any]]
+    ) -> List[Tuple[Document, float]]:
+        """Run a text search pipeline, with the text score in "score" if set."""
+        if self.projected:
+            pipeline.append(search_projection(self._text_key))
+        else:
+            pipeline.append({"$project": {self._embedding_key: 0, self.prefix_key: 0}})
+        docs = []
+        for res in self._collection.aggregate(pipeline):
+            if self._text_key not in res:
+                continue
+            text = res.pop(self._text_key)
+            score = res.pop("score", None)
+            make_serializable(res)
+            docs.append(
+                (Document(page_content=text, metadata=res, id=res["_id"]), score)
+            )
+        return docs
+
+    async def atext_search_with_score(
+        self, query: str, k: int = 4, pre_filter: Optional[Dict[str, Any]] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Full-text search on the text index, as a guarded stage. Returns no
+        documents, rather than failing the query, if the index is missing.
+        """
+        async with self._stage("vector_search"):
             try:
-                # Access the allowed_ids from the stored retriever
-                allowed_ids = []
-                if vector_store._current_retriever and hasattr(
-                    vector_store._current_retriever, "_allowed_ids"
-                ):
-                    allowed_ids = vector_store._current_retriever._allowed_ids
+                return await run_in_executor(
+                    None, self._text_search_within_budget, query, k, pre_filter
+                )
+            except pymongo.errors.OperationFailure as e:
+                logger.warning(f"Text search failed, using vector results only: {e}")
+                return []
 
-                # Create filter with document IDs
-                if allowed_ids:
-                    clean_filter = {"document_id": {"$in": allowed_ids}}
-                else:
-                    clean_filter = {}
+    async def _avector_search_with_score(
+        self,
+        query: str,
+        k: int,
+        pre_filter: Optional[Dict[str, Any]],
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """Embed the query and search, each as its own guarded stage."""
+        if self.embedding_model is not None:
+            pre_filter = {**(pre_filter or {}), "embedding_model": self.embedding_model}
 
-                # Set default k if not specified
-                k = structured_query.limit if structured_query.limit else 4
+        async with self._stage("embeddings"):
+            embedding = await self._embedding.aembed_query(query)
 
-                return {"pre_filter": clean_filter, "k": k}
+        async with self._stage("vector_search"):
+            return await run_in_executor(
+                None,
+                self._search_within_budget,
+                embedding,
+                k=k,
+                pre_filter=pre_filter,
+                **kwargs,
+            )
 
-            except Exception as e:
-                print(f"Error in transform_query: {str(e)}")
-                return {"pre_filter": {}, "k": 4}
+    async def asimilarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        pre_filter: Optional[Dict[str, Any]] = None,
+        post_filter_pipeline: Optional[List[Dict]] = None,
+        oversampling_factor: int = 10,
+        include_embeddings: bool = False,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Vector search or, with hybrid set, vector and full-text search fused
+        by rank. Hybrid scores are fused scores, not similarities.
+        """
+        search_kwargs = dict(
+            post_filter_pipeline=post_filter_pipeline,
+            oversampling_factor=oversampling_factor,
+            include_embeddings=include_embeddings,
+            **kwargs,
+        )
+        if not self.hybrid:
+            return await self._avector_search_with_score(
+                query, k, pre_filter, **search_kwargs
+            )
 
-        return transform_query
+        candidates = k * self.hybrid_factor
+        # The same tenant and document_id pre-filter bounds both searches
+        vector_docs, text_docs = await asyncio.gather(
+            self._avector_search_with_score(
+                query, candidates, pre_filter, **search_kwargs
+            ),
+            self.atext_search_with_score(query, candidates, pre_filter),
+        )
+        by_id: Dict[Any, Document] = {}
+        rankings = []
+        for docs in (vector_docs, text_docs):
+            ranking = []
+            for doc, _ in docs:
+                key = doc.metadata.get("document_id", doc.id)
+                by_id.setdefault(key, doc)
+                ranking.append(key)
+            rankings.append(ranking)
+        fused = reciprocal_rank_fusion(rankings, k=self.rrf_k)
+        return [(by_id[key], score) for key, score in fused[:k]]
+
+    def _fetch_contents_within_budget(self, document_ids: List[str]) -> Dict[str, str]:
+        with attach_thread(), pymongo.timeout(remaining_budget()):
+            if self.storage is not None:
+                return self.storage.get_contents(document_ids)
+            cursor = self._collection.find(
+                {"document_id": {"$in": document_ids}},
+                {"_id": 0, "document_id": 1, self._text_key: 1},
+            )
+            return {doc["document_id"]: doc.get(self._text_key, "") for doc in cursor}
+
+    async def afetch_contents(self, document_ids: List[str]) -> Dict[str, str]:
+        """Fetch the full bodies of documents, e.g. those going into a prompt."""
+        if not document_ids:
+            return {}
+        async with self._stage("vector_search"):
+            return await run_in_executor(
+                None, self._fetch_contents_within_budget, document_ids
+            )
+
+    async def asimilarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        include_scores: bool = False,
+        **kwargs: Any,
+    ) -> List[Document]:
+        docs_and_scores = await self.asimilarity_search_with_score(query, k=k, **kwargs)
+        if include_scores:
+            for doc, score in docs_and_scores:
+                doc.metadata["score"] = score
+        return [doc for doc, _ in docs_and_scores]
+
+
+class _PermittedQueryTranslator:
+    """
+    Turns the structured query of one retriever into search kwargs whose
+    pre-filter holds that retriever's tenant and allowed IDs. Nothing is read
+    from the shared vector store, so concurrent requests cannot see each
+    other's filters.
+    """
+
+    def __init__(self, retriever: "PermitSelfQueryRetrieverWithPermissions"):
+        self.retriever = retriever
+
+    def visit_structured_query(self, structured_query) -> Tuple[str, Dict[str, Any]]:
+        retriever = self.retriever
+        if not retriever._allowed_ids_initialized:
+            raise RuntimeError("Allowed IDs not initialized")
+        pre_filter: Dict[str, Any] = {}
+        if retriever.tenant:
+            pre_filter["metadata.tenant"] = retriever.tenant
+        # An empty list matches nothing, rather than lifting the filter
+        pre_filter[retriever.id_field] = {"$in": list(retriever._allowed_ids or [])}
+        k = structured_query.limit if structured_query.limit else 4
+        return structured_query.query, {"pre_filter": pre_filter, "k": k}
+
+
+class PermitSelfQueryRetrieverWithPermissions(PermitSelfQueryRetriever):
+    """PermitSelfQueryRetriever built from an already fetched permission snapshot."""
+
+    # Searches only match documents of this tenant
+    tenant: Optional[str] = None
+
+    def _create_translator(self):
+        return _PermittedQueryTranslator(self)
+
+    @classmethod
+    def from_permissions(
+        cls,
+        permit_client,
+        user: Dict[str, Any],
+        permissions: Dict[str, Any],
+        resource_type: str,
+        action: str,
+        llm,
+        vectorstore,
+        enable_limit: bool = False,
+        tenant: Optional[str] = None,
+    ) -> "PermitSelfQueryRetrieverWithPermissions":
+        """Same as from_permit_client, without asking the PDP again."""
+        instance = cls(
+            user=user,
+            tenant=tenant,
+            resource_type=resource_type,
+            action=action,
+            llm=llm,
+            vectorstore=vectorstore,
+            enable_limit=enable_limit,
+        )
+        instance._permit_client = permit_client
+        instance._allowed_ids = allowed_ids_from_permissions(
+            permissions, resource_type, action
+        )
+        instance._allowed_ids_initialized = True
+
+        metadata_field_info = [
+            AttributeInfo(
+                name=instance.id_field,
+                description="The document identifier that must be in the allowed list",
+                type="string",
+                enum=instance._allowed_ids,
+            ),
+            AttributeInfo(
+                name="resource_type", description="The type of resource", type="string"
+            ),
+        ]
+        prompt = get_query_constructor_prompt(
+            document_contents=f"Document of type {instance.resource_type}",
+            attribute_info=metadata_field_info,
+        )
+        output_parser = StructuredQueryOutputParser.from_components()
+        instance.query_constructor = prompt | instance.llm | output_parser
+        instance.structured_query_translator = instance._create_translator()
+        return instance
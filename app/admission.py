@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+from utils.tenants import DEFAULT_TENANT
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being admitted."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded admission queue for expensive requests.
+
+    At most max_active requests run at once. Up to max_queue more may wait for
+    a slot; waiters are granted slots round-robin across users so one busy user
+    cannot starve everyone else. A single user may hold at most max_per_user
+    active-or-queued requests, and a single tenant at most max_per_tenant, so
+    one tenant cannot take all the capacity. Anything beyond that is rejected
+    immediately.
+    """
+
+    def __init__(
+        self,
+        max_active: int,
+        max_queue: int,
+        max_per_user: int,
+        queue_timeout: float,
+        retry_after: int,
+        max_per_tenant: Optional[int] = None,
+    ):
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.max_per_tenant = max_per_tenant or max_active + max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._active = 0
+        self._queued = 0
+        self._per_user: Counter = Counter()
+        self._per_tenant: Counter = Counter()
+        # user_id -> waiters of that user; iteration order is the rotation
+        self._waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+        self.admitted = 0
+        self.rejected: Counter = Counter()
+
+    @asynccontextmanager
+    async def admit(self, user_id: str, tenant: str = DEFAULT_TENANT):
+        """Hold an admission slot for user_id for the duration of the block."""
+        if self._per_user[user_id] >= self.max_per_user:
+            self._reject("per_user_limit")
+            raise AdmissionRejected(
+                429, "Too many concurrent requests for this user", self.retry_after
+            )
+        if self._per_tenant[tenant] >= self.max_per_tenant:
+            self._reject("per_tenant_limit")
+            raise AdmissionRejected(
+                429, "Too many concurrent requests for this tenant", self.retry_after
+            )
+
+        if self._active < self.max_active and not self._queued:
+            self._active += 1
+        else:
+            if self._queued >= self.max_queue:
+                self._reject("queue_full")
+                raise AdmissionRejected(
+                    503, "Server is overloaded, please retry later", self.retry_after
+                )
+            # Queued requests count towards the tenant's limit as well
+            self._per_tenant[tenant] += 1
+            try:
+                await self._wait_for_slot(user_id)
+            finally:
+                self._per_tenant[tenant] -= 1
+
+        self._per_user[user_id] += 1
+        self._per_tenant[tenant] += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self._per_user[user_id] -= 1
+            if not self._per_user[user_id]:
+                del self._per_user[user_id]
+            self._per_tenant[tenant] -= 1
+            if not self._per_tenant[tenant]:
+                del self._per_tenant[tenant]
+            self._release()
+
+    async def _wait_for_slot(self, user_id: str) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        # Queued requests count towards the user's limit as well
+        self._per_user[user_id] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was granted just as we gave up; hand it on.
+                self._release()
+            else:
+                waiter.cancel()
+                self._discard_waiter(user_id, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject("queue_timeout")
+                raise AdmissionRejected(
+                    503, "Timed out waiting for capacity", self.retry_after
+                )
+            raise
+        finally:
+            self._per_user[user_id] -= 1
+
+    def _discard_waiter(self, user_id: str, waiter: asyncio.Future) -> None:
+        queue = self._waiters.get(user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._waiters[user_id]
+
+    def _release(self) -> None:
+        self._active -= 1
+        while self._waiters and self._active < self.max_active:
+            user_id, queue = next(iter(self._waiters.items()))
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                self._waiters.move_to_end(user_id)
+            else:
+                del self._waiters[user_id]
+            if waiter.done():
+                continue
+            waiter.set_result(None)
+            self._active += 1
+
+    def _reject(self, reason: str) -> None:
+        self.rejected[reason] += 1
+        logger.warning(f"Request rejected by admission control: {reason}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "queue_depth": self._queued,
+            "queued_users": len(self._waiters),
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "max_per_tenant": self.max_per_tenant,
+            "tenants": {t: n for t, n in self._per_tenant.items() if n},
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+class StageLimiter:
+    """Per-stage concurrency limits for calls to upstream dependencies."""
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = dict(limits)
+        self._semaphores = {
+            name: asyncio.Semaphore(limit) for name, limit in limits.items()
+        }
+        self._active: Counter = Counter()
+        self._waiting: Counter = Counter()
+        self.calls: Counter = Counter()
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        """Hold one of the concurrency slots of stage name."""
+        semaphore = self._semaphores[name]
+        self._waiting[name] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[name] -= 1
+        self._active[name] += 1
+        self.calls[name] += 1
+        try:
+            yield
+        finally:
+            self._active[name] -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "limit": limit,
+                "active": self._active[name],
+                "waiting": self._waiting[name],
+                "calls": self.calls[name],
+            }
+            for name, limit in self.limits.items()
+        }
@@ -0,0 +1,441 @@
+import argparse
+import asyncio
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import socket
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Unix socket path, or a loopback host:port; the server has no
+# authentication, so it never listens on other interfaces
+CACHE_ADDRESS = os.getenv("CACHE_ADDRESS", "/tmp/secure-rag-cache.sock")
+CACHE_SERVER_SIZE = int(os.getenv("CACHE_SERVER_SIZE", "100000"))
+
+
+class CacheBackend(ABC):
+    """
+    Where a cache keeps its entries. Values are returned as stored; None
+    means a miss, so None itself cannot be cached.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        """The value of key, or None on a miss."""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        """Store value under key for ttl seconds."""
+
+    @abstractmethod
+    async def delete(self, key: Optional[str] = None) -> None:
+        """Drop key, or every entry when key is None."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class LocalCache(CacheBackend):
+    """In-process LRU with per-entry expiry, private to one worker."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, key: str) -> Optional[Tuple[Any, float]]:
+        """The value of key and the seconds it has left, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        remaining = entry[0] - time.monotonic()
+        if remaining <= 0:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1], remaining
+
+    def store(self, key: str, value: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def remove(self, key: Optional[str] = None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self.lookup(key)
+        return entry[0] if entry is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self.store(key, value, ttl)
+
+    async def delete(self, key: Optional[str] = None) -> None:
+        self.remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self)}
+
+
+def _tcp_address(address: str) -> Optional[Tuple[str, int]]:
+    """Host and port of a host:port address, None for a Unix socket path."""
+    if ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        return host.strip("[]"), int(port)
+    return None
+
+
+async def _check_loopback(host: str, port: int) -> None:
+    """Raise ValueError unless every address host resolves to is loopback."""
+    infos = await asyncio.get_running_loop().getaddrinfo(
+        host or None, port, type=socket.SOCK_STREAM, flags=socket.AI_PASSIVE
+    )
+    for info in infos:
+        if not ipaddress.ip_address(info[4][0]).is_loopback:
+            raise ValueError(
+                f"Cache server refuses to listen on {host or '*'}:{port}: it has "
+                "no authentication, so only loopback addresses are allowed"
+            )
+
+
+async def _open_connection(address: str):
+    tcp = _tcp_address(address)
+    if tcp is not None:
+        return await asyncio.open_connection(*tcp)
+    return await asyncio.open_unix_connection(address)
+
+
+class CacheServer:
+    """
+    Cache shared by the workers of a host, served over a Unix socket or, on
+    a loopback address only, TCP.
+
+    Stands in for a remote cache such as Redis: entries live in one LocalCache
+    per namespace, each with the size limit its first writer asked for.
+    Messages are JSON lines; a delete is pushed to every connected client as
+    an invalidation, so each worker drops its near copy.
+    """
+
+    def __init__(self, address: str, max_entries: int):
+        self.address = address
+        self.max_entries = max_entries
+        self._spaces: Dict[str, LocalCache] = {}
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        tcp = _tcp_address(self.address)
+        if tcp is not None:
+            # Anyone who can connect may overwrite authorization snapshots
+            await _check_loopback(*tcp)
+            self._server = await asyncio.start_server(self._serve, *tcp)
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self._server = await asyncio.start_unix_server(self._serve, self.address)
+            # Workers of the same user only
+            os.chmod(self.address, 0o600)
+        logger.info(f"Cache server listening on {self.address}")
+
+    async def serve_forever(self) -> None:
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def _space(self, namespace: str, max_entries: Optional[int] = None) -> LocalCache:
+        space = self._spaces.get(namespace)
+        if space is None:
+            space = LocalCache(max_entries or self.max_entries)
+            self._spaces[namespace] = space
+        return space
+
+    def handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Reply to one request. Deletes are broadcast by the caller."""
+        op, namespace = message["op"], message.get("ns", "")
+        reply: Dict[str, Any] = {"id": message.get("id")}
+        if op == "get":
+            entry = self._space(namespace).lookup(message["key"])
+            if entry is not None:
+                reply.update(value=entry[0], ttl=entry[1])
+        elif op == "set":
+            space = self._space(namespace, message.get("max"))
+            space.store(message["key"], message["value"], message["ttl"])
+        elif op == "delete":
+            if message.get("prefix"):
+                spaces = [s for n, s in self._spaces.items() if n.startswith(namespace)]
+            else:
+                spaces = [self._space(namespace)]
+            for space in spaces:
+                space.remove(message.get("key"))
+        elif op == "stats":
+            reply["spaces"] = {name: len(s) for name, s in self._spaces.items()}
+        else:
+            reply["error"] = f"Unknown op {op}"
+        return reply
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._clients.add(writer)
+        try:
+            async for line in reader:
+                message: Dict[str, Any] = {}
+                try:
+                    message = json.loads(line)
+                    reply = self.handle(message)
+                except (ValueError, KeyError) as e:
+                    reply = {"id": message.get("id"), "error": f"Bad request: {e}"}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                if message.get("op") == "delete" and "error" not in reply:
+                    self._broadcast(message)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def _broadcast(self, delete: Dict[str, Any]) -> None:
+        push = json.dumps(
+            {
+                "op": "invalidate",
+                "ns": delete.get("ns", ""),
+                "key": delete.get("key"),
+                "prefix": bool(delete.get("prefix")),
+            }
+        )
+        for writer in list(self._clients):
+            if writer.is_closing():
+                self._clients.discard(writer)
+                continue
+            writer.write(push.encode() + b"\n")
+
+
+class SharedCacheClient:
+    """
+    One worker's connection to a CacheServer, shared by all its namespaces.
+
+    Requests are pipelined over a single connection and matched to replies
+    by ID. When the server cannot be reached, requests return None at once
+    and the connection is retried after reconnect_interval, so the caches
+    behave as if the shared tier were empty. Namespaces forget their near
+    copies on every disconnect, since invalidations may have been missed.
+    """
+
+    def __init__(self, address: str, timeout: float, reconnect_interval: float = 5):
+        self.address = address
+        self.timeout = timeout
+        self.reconnect_interval = reconnect_interval
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._listeners: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+        self._retry_at = 0.0
+        self._connecting: Optional[asyncio.Task] = None
+        self.errors = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def namespace(self, name: str, max_entries: int) -> "SharedCache":
+        cache = SharedCache(self, name, max_entries)
+        self._listeners.setdefault(name, []).append(cache.near.remove)
+        return cache
+
+    async def start(self) -> None:
+        await self._ensure_connected()
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._disconnect()
+
+    async def _ensure_connected(self) -> bool:
+        if self._writer is not None:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        try:
+            return await asyncio.shield(self._connecting)
+        finally:
+            self._connecting = None
+
+    async def _connect(self) -> bool:
+        try:
+            reader, writer = await asyncio.wait_for(
+                _open_connection(self.address), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            self._retry_at = time.monotonic() + self.reconnect_interval
+            logger.warning(f"Shared cache at {self.address} unavailable: {e}")
+            return False
+        self._writer = writer
+        self._reader_task = asyncio.create_task(self._read(reader))
+        logger.info(f"Connected to shared cache at {self.address}")
+        return True
+
+    def _disconnect(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result(None)
+        self._pending.clear()
+        self._notify_all(None)
+
+    def _notify_all(self, key: Optional[str]) -> None:
+        self._invalidate("", key, prefix=True)
+
+    def _invalidate(self, namespace: str, key: Optional[str], prefix: bool) -> None:
+        for name, listeners in self._listeners.items():
+            if name == namespace or (prefix and name.startswith(namespace)):
+                for listener in listeners:
+                    listener(key)
+
+    async def delete_prefix(self, prefix: str, key: Optional[str] = None) -> None:
+        """
+        Drop key, or every entry, in all namespaces starting with prefix,
+        including those this worker has not used.
+        """
+        self._invalidate(prefix, key, prefix=True)
+        await self.request({"op": "delete", "ns": prefix, "key": key, "prefix": True})
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        try:
+            async for line in reader:
+                message = json.loads(line)
+                if message.get("op") == "invalidate":
+                    self._invalidate(message["ns"], message["key"], message["prefix"])
+                    continue
+                future = self._pending.pop(message.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Shared cache connection lost: {e}")
+        self._retry_at = time.monotonic() + self.reconnect_interval
+        self._disconnect()
+
+    async def request(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Send a request and wait for its reply; None if the server is unavailable."""
+        if not await self._ensure_connected():
+            return None
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(
+                json.dumps({"id": request_id, **message}).encode() + b"\n"
+            )
+            reply = await asyncio.wait_for(future, self.timeout)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            logger.warning(f"Shared cache {message['op']} failed: {e!r}")
+            return None
+        finally:
+            self._pending.pop(request_id, None)
+        if reply is not None and "error" in reply:
+            self.errors += 1
+            logger.warning(f"Shared cache {message['op']} failed: {reply['error']}")
+            return None
+        return reply
+
+
+class SharedCache(CacheBackend):
+    """
+    A namespace of the shared cache, with a near copy in the worker.
+
+    Reads are served from the near LocalCache when they can, and from the
+    server otherwise, keeping the entry's remaining expiry. Writes go to
+    both. Deletes reach the near copies of every worker through the
+    server's invalidations. Values must be JSON-serializable.
+    """
+
+    def __init__(self, client: SharedCacheClient, namespace: str, max_entries: int):
+        self.client = client
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.near = LocalCache(max_entries)
+        self.near_hits = 0
+        self.shared_hits = 0
+
+    async def get(self, key: str) -> Optional[Any]:
+        entry = self.near.lookup(key)
+        if entry is not None:
+            self.near_hits += 1
+            return entry[0]
+        reply = await self.client.request(
+            {"op": "get", "ns": self.namespace, "key": key}
+        )
+        if reply is None or "value" not in reply:
+            return None
+        self.shared_hits += 1
+        self.near.store(key, reply["value"], reply["ttl"])
+        return reply["value"]
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        self.near.store(key, value, ttl)
+        await self.client.request(
+            {
+                "op": "set",
+                "ns": self.namespace,
+                "key": key,
+                "value": value,
+                "ttl": ttl,
+                "max": self.max_entries,
+            }
+        )
+
+    async def delete(self, key: Optional[str] = None) -> None:
+        self.near.remove(key)
+        await self.client.request({"op": "delete", "ns": self.namespace, "key": key})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.near),
+            "near_hits": self.near_hits,
+            "shared_hits": self.shared_hits,
+            "shared_connected": self.client.connected,
+        }
+
+
+def cache_backend(
+    client: Optional[SharedCacheClient], namespace: str, max_entries: int
+) -> CacheBackend:
+    """A namespace of the shared cache, or a LocalCache without one."""
+    if client is None:
+        return LocalCache(max_entries)
+    return client.namespace(namespace, max_entries)
+
+
+def main():
+    """
+    Run the cache server the workers of a host share, e.g.
+    python -m app.cache & uvicorn app.main:app --workers 4
+    """
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve the shared worker cache")
+    parser.add_argument("--address", default=CACHE_ADDRESS)
+    parser.add_argument("--max-entries", type=int, default=CACHE_SERVER_SIZE)
+    args = parser.parse_args()
+    asyncio.run(CacheServer(args.address, args.max_entries).serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from pymongo import MongoClient
+from permit import Permit
+from langchain_openai import ChatOpenAI
+
+from utils.collection_alias import resolve_alias
+from utils.document_storage import DocumentStorage
+from utils.embedding_backends import create_embedding_backend
+from utils.vector_index import VECTOR_INDEX_NAME, VectorIndexManager, desired_indexes
+
+from .adapters import MongoDBAtlasVectorSearchWithQueryTransformer
+
+logger = logging.getLogger(__name__)
+
+
+class Clients:
+    """
+    Upstream clients shared by all requests.
+
+    Clients are created in the FastAPI lifespan rather than at import time, so
+    importing the app is cheap and every startup step can be timed. The app is
+    ready once warmup has opened the connection pools.
+    """
+
+    def __init__(
+        self,
+        mongodb_uri: str,
+        permit_api_key: str,
+        permit_pdp_url: str,
+        pdp_backend: str = "permit",
+        local_pdp_path: Optional[str] = None,
+        two_stage_search: bool = False,
+        rerank_factor: int = 10,
+        retrieval_projection: bool = True,
+        storage_layout: str = "single",
+        hybrid_search: bool = False,
+        hybrid_factor: int = 4,
+        rrf_k: int = 60,
+    ):
+        self.mongodb_uri = mongodb_uri
+        self.permit_api_key = permit_api_key
+        self.permit_pdp_url = permit_pdp_url
+        self.pdp_backend = pdp_backend
+        self.local_pdp_path = local_pdp_path
+        self.two_stage_search = two_stage_search
+        self.rerank_factor = rerank_factor
+        self.retrieval_projection = retrieval_projection
+        self.storage_layout = storage_layout
+        self.hybrid_search = hybrid_search
+        self.hybrid_factor = hybrid_factor
+        self.rrf_k = rrf_k
+
+        self.mongo_client = None
+        self.db = None
+        self.collection = None
+        self.storage = None
+        self.permit_client = None
+        self.embedding_backend = None
+        self.embeddings = None
+        self.llm = None
+        self.vector_store = None
+        self.stages = None
+
+        self.ready = False
+        self.startup_timings: Dict[str, float] = {}
+        self.startup_errors: Dict[str, str] = {}
+        self._started_at = time.perf_counter()
+
+    @contextmanager
+    def step(self, name: str, required: bool = True):
+        """
+        Time a startup step and record its outcome.
+        Args:
+            name: Step name reported by /ready
+            required: Whether a failure should propagate instead of being recorded
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.startup_errors[name] = str(e)
+            logger.error(f"Startup step {name} failed: {str(e)}")
+            if required:
+                raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.startup_timings[name] = round(elapsed, 4)
+            logger.info(f"Startup step {name} took {elapsed:.3f}s")
+
+    def start(self, stages=None) -> None:
+        """Create all clients. Connections are opened lazily or during warmup."""
+        self.stages = stages
+        with self.step("mongo_client"):
+            self.mongo_client = MongoClient(self.mongodb_uri)
+            self.db = self.mongo_client.secure_rag
+            # The collection the documents alias points at, see scripts/reindex.py
+            pointer = resolve_alias(self.db)
+            self.collection = self.db[pointer["collection"]]
+            self.storage = self._create_storage(pointer)
+
+        with self.step("permit_client"):
+            if self.pdp_backend == "local":
+                # Tuples written by scripts/generate_fixtures.py
+                from utils.local_pdp import LocalPDP
+
+                self.permit_client = LocalPDP.load(self.local_pdp_path)
+                logger.info(f"Using local PDP from {self.local_pdp_path}")
+            else:
+                self.permit_client = Permit(
+                    token=self.permit_api_key, pdp=self.permit_pdp_url
+                )
+
+        with self.step("embeddings"):
+            self.embedding_backend = create_embedding_backend(
+                **pointer.get("settings", {}).get("embedding", {})
+            )
+            self.embeddings = self.embedding_backend.embeddings
+
+        with self.step("llm"):
+            self.llm = ChatOpenAI(temperature=0)
+
+        with self.step("vector_store"):
+            self.vector_store = self._create_vector_store(
+                self.collection, self.storage, self.embedding_backend
+            )
+
+    def _create_storage(self, pointer: Dict[str, Any]) -> DocumentStorage:
+        settings = pointer.get("settings", {})
+        return DocumentStorage(
+            self.mongo_client,
+            self.db,
+            settings.get("storage_layout", self.storage_layout),
+            collection=pointer["collection"],
+        )
+
+    def _create_vector_store(
+        self, collection, storage: DocumentStorage, embedding_backend
+    ) -> MongoDBAtlasVectorSearchWithQueryTransformer:
+        vector_store = MongoDBAtlasVectorSearchWithQueryTransformer(
+            collection=collection,
+            embedding=embedding_backend.embeddings,
+            index_name=VECTOR_INDEX_NAME,
+            text_key=storage.text_key,
+            embedding_key="vector_embedding",
+        )
+        vector_store.stages = self.stages
+        # Only compare query vectors with vectors from the same model
+        vector_store.embedding_model = embedding_backend.model_id
+        vector_store.prefix_dimensions = (
+            embedding_backend.prefix_dimensions if self.two_stage_search else 0
+        )
+        vector_store.rerank_factor = self.rerank_factor
+        vector_store.projected = self.retrieval_projection
+        vector_store.storage = storage
+        vector_store.hybrid = self.hybrid_search
+        vector_store.hybrid_factor = self.hybrid_factor
+        vector_store.rrf_k = self.rrf_k
+        return vector_store
+
+    def check_vector_indexes(self) -> None:
+        """
+        Raise if the deployed vector indexes differ from what searches need,
+        e.g. a missing filter field or other dimensions, which Atlas would
+        otherwise only report when a query runs.
+        """
+        desired = desired_indexes(
+            self.embedding_backend.dimensions, self.vector_store.prefix_dimensions
+        )
+        actions = VectorIndexManager(self.collection).plan(desired)
+        if actions:
+            raise ValueError(
+                "; ".join(
+                    f"{name} needs {action}: {', '.join(changes)}"
+                    for action, name, changes in actions
+                )
+            )
+
+    def switch_collection(self, pointer: Dict[str, Any]) -> None:
+        """
+        Serve searches from the collection a moved documents alias points at,
+        with the embedding backend and layout it was built with. Requests
+        already running finish on the previous vector store.
+        """
+        collection = self.db[pointer["collection"]]
+        storage = self._create_storage(pointer)
+        embedding_backend = create_embedding_backend(
+            **pointer.get("settings", {}).get("embedding", {})
+        )
+        vector_store = self._create_vector_store(collection, storage, embedding_backend)
+        self.collection = collection
+        self.storage = storage
+        self.embedding_backend = embedding_backend
+        self.embeddings = embedding_backend.embeddings
+        self.vector_store = vector_store
+        logger.info(f"Searching {pointer['collection']} ({embedding_backend.model_id})")
+
+    def mark_ready(self) -> None:
+        self.ready = True
+        total = time.perf_counter() - self._started_at
+        self.startup_timings["total"] = round(total, 4)
+        logger.info(f"App ready after {total:.3f}s")
+
+    def close(self) -> None:
+        if self.mongo_client is not None:
+            self.mongo_client.close()
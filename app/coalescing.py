@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescedWaitTimeout(Exception):
+    """Raised when a caller waited longer than allowed for a shared computation."""
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different spellings share one flight."""
+    return " ".join(query.casefold().split())
+
+
+def fingerprint_ids(ids: Iterable[str]) -> str:
+    """Build an order-independent fingerprint of a set of document IDs."""
+    digest = hashlib.sha256()
+    for document_id in sorted(set(ids)):
+        digest.update(document_id.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one in-flight computation.
+
+    The first caller for a key starts the computation as a separate task; every
+    caller (including the first) awaits it through a shield, so a cancelled or
+    timed-out waiter never cancels the work the others are waiting on. The task
+    is only cancelled once nobody is waiting for it any more.
+    """
+
+    def __init__(self, wait_timeout: float):
+        self.wait_timeout = wait_timeout
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    async def do(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Run factory() once for all concurrent callers with the same key.
+        Args:
+            key: Coalescing key
+            factory: Zero-argument callable returning the awaitable to share
+            timeout: This caller's own time budget, if shorter than wait_timeout
+        Returns:
+            The result of the shared computation
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(factory()))
+            flight.task.add_done_callback(lambda task: self._forget(key, flight))
+            self._flights[key] = flight
+            self.leaders += 1
+        else:
+            self.followers += 1
+            logger.info(f"Joining in-flight computation for key {key[:12]}")
+
+        wait_timeout = self.wait_timeout
+        if timeout is not None:
+            wait_timeout = min(wait_timeout, timeout)
+
+        flight.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), wait_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise CoalescedWaitTimeout(
+                f"Shared computation did not finish within {wait_timeout:.1f}s"
+            )
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Nobody is left to use the result; let new callers start fresh.
+                self._flights.pop(key, None)
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Mark the exception as retrieved; waiters have already seen it.
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "timeouts": self.timeouts,
+        }
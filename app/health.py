@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeResult:
+    """Latest outcome of one dependency probe."""
+
+    def __init__(self):
+        self.ok = False
+        self.latency: Optional[float] = None
+        self.last_checked: Optional[datetime] = None
+        self.last_success: Optional[datetime] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ok": self.ok,
+            "latency": self.latency,
+            "last_checked": (
+                self.last_checked.isoformat() if self.last_checked else None
+            ),
+            "last_success": (
+                self.last_success.isoformat() if self.last_success else None
+            ),
+            "error": self.error,
+        }
+
+
+class HealthMonitor:
+    """
+    Probe dependencies in the background and keep the latest results.
+
+    /health is served from these cached results, so a load balancer polling it
+    adds no load on the dependencies being monitored.
+    """
+
+    def __init__(self, interval: float, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self._probes: Dict[str, Callable[[], Awaitable[Any]]] = {}
+        self.results: Dict[str, ProbeResult] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add_probe(self, name: str, probe: Callable[[], Awaitable[Any]]) -> None:
+        self._probes[name] = probe
+        self.results[name] = ProbeResult()
+
+    async def run_probe(self, name: str) -> None:
+        result = self.results[name]
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._probes[name](), self.timeout)
+            result.ok = True
+            result.error = None
+            result.last_success = datetime.now(timezone.utc)
+        except Exception as e:
+            # Log state changes only, not every failed probe
+            if result.ok or result.last_checked is None:
+                logger.error(f"{name} health check failed: {str(e)}")
+            result.ok = False
+            result.error = str(e) or type(e).__name__
+        result.latency = round(time.perf_counter() - started, 4)
+        result.last_checked = datetime.now(timezone.utc)
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self.run_probe(name) for name in self._probes))
+
+    async def _run(self) -> None:
+        while True:
+            await self.probe_all()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def is_ok(self, name: str) -> bool:
+        return self.results[name].ok
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: result.to_dict() for name, result in self.results.items()}
@@ -1,12 +1,19 @@
 from typing import Dict, Any, List
 from pydantic import BaseModel, Field
 
+from utils.tenants import DEFAULT_TENANT, TENANT_KEY
+
 
 class QueryRequest(BaseModel):
     """Request model for RAG query endpoint."""
 
     query: str = Field(..., description="The user's query")
     user_id: str = Field(..., description="User ID for permission checking")
+    tenant: str = Field(
+        DEFAULT_TENANT,
+        pattern=TENANT_KEY.pattern,
+        description="Tenant whose documents are searched",
+    )
 
 
 class QueryResponse(BaseModel):
@@ -22,3 +29,10 @@ class HealthResponse(BaseModel):
     status: str = Field(..., description="Service status")
     mongodb: bool = Field(..., description="MongoDB connection status")
     permit: bool = Field(..., description="Permit.io connection status")
+    probes: Dict[str, Dict[str, Any]] = Field(
+        default_factory=dict,
+        description="Latest background probe result per dependency",
+    )
+    breakers: Dict[str, Dict[str, Any]] = Field(
+        default_factory=dict, description="Circuit breaker state per dependency"
+    )
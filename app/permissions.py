@@ -0,0 +1,344 @@
+import asyncio
+import base64
+import binascii
+import bisect
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.tenants import DEFAULT_TENANT
+
+from .cache import CacheBackend, LocalCache, SharedCacheClient, cache_backend
+from .coalescing import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def allowed_ids_from_permissions(
+    permissions: Dict[str, Any], resource_type: str, action: str
+) -> List[str]:
+    """Extract the IDs of resource_type instances the permissions allow action on."""
+    allowed_ids = []
+    required = f"{resource_type}:{action}"
+    for resource_key, grants in permissions.items():
+        if ":" not in resource_key:
+            continue
+        key_type, resource_id = resource_key.split(":", 1)
+        if key_type == resource_type and required in grants.get("permissions", []):
+            allowed_ids.append(resource_id)
+    return allowed_ids
+
+
+def user_key(user_id: str, tenant: str) -> str:
+    """Key of a user's activity in a tenant; a default-tenant user keeps their ID."""
+    return user_id if tenant == DEFAULT_TENANT else f"{tenant}:{user_id}"
+
+
+def encode_cursor(resource_key: str) -> str:
+    """Opaque pagination cursor resuming after resource_key."""
+    return base64.urlsafe_b64encode(resource_key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    """
+    Raises:
+        ValueError: If cursor was not made by encode_cursor()
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.b64decode(padded, altchars=b"-_", validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+class PermissionSnapshot:
+    """
+    A user's permissions with their "type:id" keys sorted once, so pages and
+    filtered ranges are found by bisection instead of scanning every entry.
+    """
+
+    def __init__(self, permissions: Dict[str, Any]):
+        self.permissions = permissions
+        self.keys = sorted(permissions)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of entries per resource type."""
+        counts: Dict[str, int] = {}
+        for key in self.keys:
+            resource_type = key.split(":", 1)[0]
+            counts[resource_type] = counts.get(resource_type, 0) + 1
+        return counts
+
+    def _range(self, start: str, after: Optional[str]) -> Iterator[str]:
+        """Keys starting with start, after the key after."""
+        index = bisect.bisect_left(self.keys, start)
+        if after is not None:
+            index = max(index, bisect.bisect_right(self.keys, after))
+        for index in range(index, len(self.keys)):
+            key = self.keys[index]
+            if not key.startswith(start):
+                return
+            yield key
+
+    def iter_keys(
+        self,
+        resource_types: Optional[List[str]] = None,
+        prefix: str = "",
+        after: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Keys in order, optionally only of resource_types, with instance keys
+        starting with prefix, and after a cursor key.
+        """
+        if resource_types:
+            return itertools.chain.from_iterable(
+                self._range(f"{resource_type}:{prefix}", after)
+                for resource_type in sorted(set(resource_types))
+            )
+        return (
+            key
+            for key in self._range("", after)
+            if key.split(":", 1)[-1].startswith(prefix)
+        )
+
+    def page(
+        self,
+        limit: int,
+        resource_types: Optional[List[str]] = None,
+        prefix: str = "",
+        cursor: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """
+        Returns:
+            Up to limit entries, and the cursor of the next page or None
+        Raises:
+            ValueError: If cursor is invalid
+        """
+        after = decode_cursor(cursor) if cursor else None
+        keys = list(
+            itertools.islice(self.iter_keys(resource_types, prefix, after), limit + 1)
+        )
+        next_cursor = encode_cursor(keys[limit - 1]) if len(keys) > limit else None
+        return {key: self.permissions[key] for key in keys[:limit]}, next_cursor
+
+
+class PermissionCache:
+    """
+    Short-lived per-user cache of permission snapshots from the PDP.
+
+    Concurrent misses for the same user share a single PDP lookup. Entries
+    expire after ttl seconds, so permission changes take effect within ttl.
+    Entries are kept in backend, the worker's own LRU unless a shared
+    backend is given.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int,
+        load_timeout: float,
+        backend: Optional[CacheBackend] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend if backend is not None else LocalCache(max_entries)
+        self._loads = SingleFlight(wait_timeout=load_timeout)
+        self.hits = 0
+        self.misses = 0
+
+    async def get(
+        self, user_id: str, loader: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """Return the user's permissions, calling loader() on a miss."""
+        permissions = await self.backend.get(user_id)
+        if permissions is not None:
+            self.hits += 1
+            return permissions
+
+        self.misses += 1
+        return await self._loads.do(user_id, lambda: self._load(user_id, loader))
+
+    async def _load(
+        self, user_id: str, loader: Callable[[], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        permissions = await loader()
+        await self.put(user_id, permissions)
+        return permissions
+
+    async def put(self, user_id: str, permissions: Dict[str, Any]) -> None:
+        await self.backend.set(user_id, permissions, self.ttl)
+
+    async def invalidate(self, user_id: Optional[str] = None) -> None:
+        """Drop a user's entry, or every entry; with a shared backend, in all workers."""
+        await self.backend.delete(user_id)
+
+    async def preload(
+        self,
+        user_ids: List[str],
+        loader: Callable[[str], Awaitable[Dict[str, Any]]],
+        concurrency: int,
+    ) -> int:
+        """
+        Load permissions for several users ahead of their first request.
+        Returns:
+            Number of users whose permissions were loaded
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def load(user_id: str) -> bool:
+            async with semaphore:
+                try:
+                    await self.get(user_id, lambda: loader(user_id))
+                    return True
+                except Exception as e:
+                    logger.warning(f"Could not preload permissions for {user_id}: {e}")
+                    return False
+
+        results = await asyncio.gather(*(load(user_id) for user_id in user_ids))
+        return sum(results)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, **self.backend.stats()}
+
+
+class TenantPermissionCaches:
+    """
+    A PermissionCache per tenant, each with its own size limit, so one busy
+    tenant cannot evict the permissions of everyone else. With a shared cache
+    client, each tenant is a namespace of the shared cache.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int,
+        load_timeout: float,
+        shared: Optional[SharedCacheClient] = None,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.load_timeout = load_timeout
+        self.shared = shared
+        self._caches: Dict[str, PermissionCache] = {}
+
+    def for_tenant(self, tenant: str) -> PermissionCache:
+        cache = self._caches.get(tenant)
+        if cache is None:
+            backend = cache_backend(
+                self.shared, f"permissions:{tenant}", self.max_entries
+            )
+            cache = PermissionCache(
+                self.ttl, self.max_entries, self.load_timeout, backend
+            )
+            self._caches[tenant] = cache
+        return cache
+
+    async def invalidate(
+        self, tenant: Optional[str] = None, user_id: Optional[str] = None
+    ) -> None:
+        """Drop cached permissions, of one tenant or all of them."""
+        if tenant is not None:
+            await self.for_tenant(tenant).invalidate(user_id)
+        elif self.shared is not None:
+            # Also reaches tenants only other workers have served
+            await self.shared.delete_prefix("permissions:", user_id)
+        else:
+            for cache in self._caches.values():
+                await cache.invalidate(user_id)
+
+    async def preload(
+        self,
+        users: List[Tuple[str, str]],
+        loader: Callable[[str, str], Awaitable[Dict[str, Any]]],
+        concurrency: int,
+    ) -> int:
+        """
+        Load permissions for (tenant, user ID) pairs ahead of their first
+        request, sharing one concurrency limit across tenants.
+        Returns:
+            Number of users whose permissions were loaded
+        """
+        by_tenant: Dict[str, List[str]] = {}
+        for tenant, user_id in users:
+            by_tenant.setdefault(tenant, []).append(user_id)
+        per_tenant = max(1, concurrency // max(1, len(by_tenant)))
+        results = await asyncio.gather(
+            *(
+                self.for_tenant(tenant).preload(
+                    user_ids,
+                    lambda user_id, t=tenant: loader(user_id, t),
+                    per_tenant,
+                )
+                for tenant, user_ids in by_tenant.items()
+            )
+        )
+        return sum(results)
+
+    def stats(self) -> Dict[str, Any]:
+        return {tenant: cache.stats() for tenant, cache in self._caches.items()}
+
+
+class RecentUsers:
+    """
+    Track recently active users in MongoDB so a fresh worker can warm their
+    permissions. Writes are throttled per user and run off the event loop.
+    Only users touched within the last touch_interval are remembered.
+    """
+
+    def __init__(self, touch_interval: float):
+        self.touch_interval = touch_interval
+        self.collection = None
+        # Oldest touch first
+        self._last_touch: "OrderedDict[str, float]" = OrderedDict()
+
+    def touch(self, user_id: str, tenant: str = DEFAULT_TENANT) -> None:
+        if self.collection is None:
+            return
+        now = time.monotonic()
+        while self._last_touch:
+            oldest = next(iter(self._last_touch.values()))
+            if now - oldest < self.touch_interval:
+                break
+            self._last_touch.popitem(last=False)
+        key = user_key(user_id, tenant)
+        if key in self._last_touch:
+            return
+        self._last_touch[key] = now
+        asyncio.get_running_loop().run_in_executor(
+            None, self._record, key, user_id, tenant
+        )
+
+    def _record(self, key: str, user_id: str, tenant: str) -> None:
+        try:
+            self.collection.update_one(
+                {"_id": key},
+                {
+                    "$set": {
+                        "user_id": user_id,
+                        "tenant": tenant,
+                        "last_seen": datetime.now(timezone.utc),
+                    }
+                },
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning(f"Could not record activity for {key}: {str(e)}")
+
+    def most_recent(self, limit: int) -> List[Tuple[str, str]]:
+        """The (tenant, user ID) pairs of the most recently active users."""
+        if self.collection is None or limit <= 0:
+            return []
+        cursor = self.collection.find({}, {"user_id": 1, "tenant": 1}).sort(
+            "last_seen", -1
+        )
+        # Users recorded before tenants have only their ID as _id
+        return [
+            (doc.get("tenant", DEFAULT_TENANT), doc.get("user_id", doc["_id"]))
+            for doc in cursor.limit(limit)
+        ]
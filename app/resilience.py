@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import aiohttp
+import httpx
+import openai
+from permit.exceptions import PermitConnectionError
+from pymongo.errors import ConnectionFailure
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of its time budget."""
+
+
+class CircuitOpenError(Exception):
+    """Raised when a dependency's circuit breaker is failing fast."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable (circuit open)")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class Deadline:
+    """Absolute point in time by which a request must be finished."""
+
+    def __init__(self, timeout: float):
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+
+# Deadline of the request being served; copied into tasks and executor threads
+current_deadline: ContextVar[Optional[Deadline]] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left for the current request, or None when there is no deadline."""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return remaining
+
+
+# Errors raised when a dependency could not be reached or did not answer
+TRANSPORT_ERRORS = (
+    ConnectionError,
+    aiohttp.ClientConnectionError,
+    httpx.TransportError,
+    openai.APIConnectionError,
+    ConnectionFailure,
+    PermitConnectionError,
+)
+
+# The PDP client only reports an unexpected response status in its message
+PDP_STATUS_PATTERN = re.compile(r"unexpected status code: (\d+)")
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    response = getattr(error, "response", None)
+    for status in (
+        getattr(error, "status_code", None),
+        getattr(error, "status", None),
+        getattr(response, "status_code", None),
+    ):
+        if isinstance(status, int):
+            return status
+    if isinstance(error, PermitConnectionError):
+        match = PDP_STATUS_PATTERN.search(str(error))
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def is_dependency_failure(error: BaseException) -> bool:
+    """
+    Whether an error from a stage call means the dependency is unhealthy:
+    a timeout, a transport error or a 5xx response, possibly wrapped by a
+    client library. Client errors, such as the PDP rejecting an unknown user
+    or tenant, are the caller's fault and say nothing about its health.
+    """
+    while error is not None:
+        if isinstance(error, TimeoutError):
+            return True
+        status = _status_code(error)
+        if status is not None:
+            return status >= 500
+        if isinstance(error, TRANSPORT_ERRORS):
+            return True
+        error = error.__cause__
+    return False
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After failure_threshold failures in a row the breaker opens and calls fail
+    fast for reset_timeout seconds. It then lets a single probe call through
+    (half-open); success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def before_call(self) -> bool:
+        """
+        Check whether a call may proceed.
+        Returns:
+            True if the call is the half-open probe
+        """
+        if self.state == "open":
+            retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+            if retry_after > 0:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, retry_after)
+            self.state = "half_open"
+            logger.info(f"Circuit breaker {self.name} half-open, probing")
+
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.reset_timeout)
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def after_call(self, is_probe: bool, succeeded: Optional[bool]) -> None:
+        """Record the outcome of a call; succeeded=None means it was abandoned."""
+        if is_probe:
+            self._probe_in_flight = False
+        if succeeded is None:
+            return
+        if succeeded:
+            if self.state != "closed":
+                logger.info(f"Circuit breaker {self.name} closed")
+            self.state = "closed"
+            self.failures = 0
+            return
+
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit breaker {self.name} opened")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+class StageGuard:
+    """
+    Guard every call to an upstream dependency.
+
+    Each stage call holds a slot of the stage's concurrency limit, goes through
+    the stage's circuit breaker and is bounded by whatever is left of the
+    current request's deadline.
+    """
+
+    def __init__(self, limiter, failure_threshold: int, reset_timeout: float):
+        self.limiter = limiter
+        self.breakers = {
+            name: CircuitBreaker(name, failure_threshold, reset_timeout)
+            for name in limiter.limits
+        }
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        """Hold a guarded call to stage name for the duration of the block."""
+        breaker = self.breakers[name]
+        timeout = remaining_budget()
+        is_probe = breaker.before_call()
+        started = False
+        succeeded = None
+        budget = asyncio.timeout(timeout)
+        try:
+            async with budget:
+                async with self.limiter.stage(name):
+                    started = True
+                    yield
+            succeeded = True
+        except TimeoutError as e:
+            if not budget.expired():
+                # A client's own timeout, e.g. OpenAI's or pymongo's, with
+                # request budget left: a plain dependency failure
+                succeeded = not is_dependency_failure(e)
+                raise
+            # Running out of budget while queued for a slot says nothing
+            # about the health of the dependency itself.
+            if started:
+                succeeded = False
+            raise DeadlineExceeded(f"Request deadline exceeded during {name}")
+        except Exception as e:
+            # A dependency that answered with a client error is still up
+            succeeded = not is_dependency_failure(e)
+            raise
+        finally:
+            breaker.after_call(is_probe, succeeded)
+
+    def breaker_states(self) -> Dict[str, Dict[str, Any]]:
+        return {name: breaker.stats() for name, breaker in self.breakers.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        limits = self.limiter.stats()
+        return {
+            name: {**limits[name], "breaker": breaker.stats()}
+            for name, breaker in self.breakers.items()
+        }
+
+
+class LatencyTracker:
+    """Sliding window of recent call latencies."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Hedger:
+    """
+    Send a duplicate request when the first one is slower than usual.
+
+    If a call has not finished after the tracked p95 latency, a second
+    identical call is started and whichever succeeds first wins; the other is
+    cancelled.
+    """
+
+    def __init__(self, enabled: bool, quantile: float = 0.95):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.latency = LatencyTracker()
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    async def call(self, factory: Callable[[], Awaitable[Any]]) -> Any:
+        started_at = time.monotonic()
+        primary = asyncio.ensure_future(factory())
+        tasks = [primary]
+        try:
+            delay = self.latency.percentile(self.quantile) if self.enabled else None
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.hedges_sent += 1
+                    tasks.append(asyncio.ensure_future(factory()))
+
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self.latency.record(time.monotonic() - started_at)
+                        if task is not primary:
+                            self.hedges_won += 1
+                        return task.result()
+                if not pending:
+                    raise next(iter(done)).exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # Swallow the losers' outcome so it is never reported as unhandled
+            for task in tasks:
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "p95_seconds": self.latency.percentile(self.quantile),
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+        }
@@ -1,9 +1,44 @@
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from langchain_core.documents import Document
 
 logger = logging.getLogger(__name__)
 
+SNIPPET_LENGTH = 200
+
+
+def search_projection(
+    text_key: str, keep: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    $project stage for search results that returns a snippet of text_key in
+    its place, with the full length, instead of the whole body or any vector.
+    Args:
+        text_key: Field holding the document body
+        keep: Additional fields to return, e.g. a vector still needed for scoring
+    """
+    projection = {
+        "document_id": 1,
+        "filename": 1,
+        "metadata": 1,
+        "score": 1,
+        text_key: {"$substrCP": [f"${text_key}", 0, SNIPPET_LENGTH]},
+        # Stored by the split layout, whose text_key only holds a preview
+        "content_length": {
+            "$ifNull": ["$content_length", {"$strLenCP": f"${text_key}"}]
+        },
+    }
+    for field in keep or []:
+        projection[field] = 1
+    return {"$project": projection}
+
+
+def document_snippet(doc: Document) -> str:
+    """The first SNIPPET_LENGTH characters of a document, marked if truncated."""
+    length = doc.metadata.get("content_length", len(doc.page_content))
+    snippet = doc.page_content[:SNIPPET_LENGTH]
+    return snippet + "..." if length > SNIPPET_LENGTH else snippet
+
 
 def format_documents_for_response(docs: List[Document]) -> List[Dict[str, Any]]:
     """Format documents for API response."""
@@ -15,11 +50,7 @@ def format_documents_for_response(docs: List[Document]) -> List[Dict[str, Any]]:
             "department": doc.metadata.get("metadata", {}).get("department", "unknown"),
             "author": doc.metadata.get("metadata", {}).get("author", "unknown"),
             "confidential": doc.metadata.get("metadata", {}).get("confidential", False),
-            "snippet": (
-                doc.page_content[:200] + "..."
-                if len(doc.page_content) > 200
-                else doc.page_content
-            ),
+            "snippet": document_snippet(doc),
         }
         formatted_docs.append(formatted_doc)
     return formatted_docs
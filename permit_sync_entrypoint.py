@@ -10,11 +10,14 @@ from scripts.setup_all import setup_all
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Reconcile by default so restarts of this container only apply missing changes
+PERMIT_SETUP_RECONCILE = os.getenv("PERMIT_SETUP_RECONCILE", "true").lower() == "true"
+
 
 async def main():
     try:
         logger.info("Starting Permit sync process...")
-        await setup_all()
+        await setup_all(reconcile_only=PERMIT_SETUP_RECONCILE)
         logger.info("Permit sync completed successfully")
     except Exception as e:
         logger.error(f"Permit sync failed: {str(e)}")
@@ -0,0 +1,331 @@
+import os
+import sys
+import json
+import random
+import argparse
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import frontmatter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.embedding_backends import create_embedding_backend
+from utils.local_text_index import LocalTextIndex, tokenize
+from utils.local_vector_index import LocalVectorIndex
+from utils.rank_fusion import RRF_K, reciprocal_rank_fusion
+from utils.snapshot import Snapshot
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_fixtures(fixtures_dir: str):
+    """Return the fixture summary, documents and vectors by document ID."""
+    with open(os.path.join(fixtures_dir, "fixtures.json")) as f:
+        summary = json.load(f)
+    if not summary.get("embedding_model"):
+        raise ValueError("Fixtures were generated with --no-embeddings")
+
+    vectors_by_hash = {}
+    with open(os.path.join(fixtures_dir, "embeddings.jsonl")) as f:
+        for line in f:
+            entry = json.loads(line)
+            vectors_by_hash[entry["content_hash"]] = entry["vector"]
+    with open(os.path.join(fixtures_dir, "documents.jsonl")) as f:
+        documents = [json.loads(line) for line in f]
+    vectors = [vectors_by_hash[d["content_hash"]] for d in documents]
+    return summary, documents, vectors
+
+
+def load_snapshot(path: str):
+    """Return a summary, documents with their text and vectors from a snapshot."""
+    snapshot = Snapshot(path)
+    if not snapshot.embedding_model:
+        raise ValueError("Snapshot has no vectors")
+    index = snapshot.local_index()
+    embedded = set(index.ids)
+    documents = [
+        {"document_id": document["document_id"], "content": document["content"]}
+        for document, vector in snapshot.documents()
+        if vector is not None and document["document_id"] in embedded
+    ]
+    order = {document_id: row for row, document_id in enumerate(index.ids)}
+    documents.sort(key=lambda d: order[d["document_id"]])
+    summary = {
+        "embedding_model": snapshot.embedding_model,
+        "parameters": {"snapshot": path, **snapshot.manifest},
+    }
+    return summary, documents, index.vectors
+
+
+def read_text(fixtures_dir: str, document: Dict[str, Any]) -> str:
+    if "content" in document:
+        return document["content"]
+    with open(os.path.join(fixtures_dir, document["path"]), encoding="utf-8") as f:
+        return frontmatter.load(f).content
+
+
+def make_queries(
+    fixtures_dir: str, documents: List[Dict[str, Any]], count: int, seed: int
+) -> Tuple[List[str], List[str]]:
+    """
+    Short word windows taken from random documents, like user questions,
+    and the ID of the document each was taken from.
+    """
+    rng = random.Random(f"{seed}:queries")
+    queries, sources = [], []
+    for document in rng.sample(documents, min(count, len(documents))):
+        words = read_text(fixtures_dir, document).split()
+        start = rng.randrange(max(1, len(words) - 12))
+        queries.append(" ".join(words[start : start + 12]))
+        sources.append(document["document_id"])
+    return queries, sources
+
+
+def identifier_queries(
+    text_index: LocalTextIndex, texts: Dict[str, str], sources: List[str], seed: int
+) -> List[str]:
+    """
+    The rarest term of each source document with a few common words around
+    it, like a question about an identifier or error code.
+    """
+    rng = random.Random(f"{seed}:identifiers")
+    queries = []
+    for source in sources:
+        terms = tokenize(texts[source])
+        rarest = min(dict.fromkeys(terms), key=lambda t: len(text_index.postings[t][0]))
+        context = rng.sample(terms, min(3, len(terms)))
+        queries.append(" ".join(["what", "is", rarest, *context]))
+    return queries
+
+
+def hybrid_search(
+    vector_index: LocalVectorIndex,
+    text_index: LocalTextIndex,
+    query: str,
+    query_vector,
+    k: int,
+    candidates: int,
+    rrf_k: int,
+) -> List[Tuple[str, float]]:
+    """What the app's hybrid mode does: fuse candidates of both searches by rank."""
+    rankings = [
+        [i for i, _ in vector_index.search(query_vector, candidates)],
+        [i for i, _ in text_index.search(query, candidates)],
+    ]
+    return reciprocal_rank_fusion(rankings, k=rrf_k)[:k]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(
+    search, queries, truth, k: int, sources: Optional[List[str]] = None
+) -> Dict[str, float]:
+    """
+    Recall against the exact vector search, the share of queries whose
+    source document is in the top k, and latency.
+    """
+    latencies, hits, found = [], 0, 0
+    for index, (query, expected) in enumerate(zip(queries, truth)):
+        started = time.perf_counter()
+        results = search(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+        returned = {document_id for document_id, _ in results[:k]}
+        hits += len(expected & returned)
+        found += bool(sources) and sources[index] in returned
+    return {
+        "recall": round(hits / (k * len(truth)), 4),
+        "source_hit": round(found / len(truth), 4),
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure recall and latency of full, two-stage prefix and hybrid search"
+    )
+    parser.add_argument("--fixtures", default="fixtures", help="Generated fixtures")
+    parser.add_argument(
+        "--snapshot", help="Benchmark a corpus snapshot instead of the fixtures"
+    )
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--prefix-dimensions",
+        default="32,64,128",
+        help="Comma-separated prefix lengths to compare",
+    )
+    parser.add_argument(
+        "--rerank-factors",
+        default="2,5,10,20",
+        help="Comma-separated candidate multiples of k to re-score",
+    )
+    parser.add_argument(
+        "--hybrid",
+        action="store_true",
+        help="Also compare full-text and hybrid search, on the word-window "
+        "queries and on queries for each document's rarest term",
+    )
+    parser.add_argument(
+        "--hybrid-factor",
+        type=int,
+        default=4,
+        help="Candidates taken from each search, as a multiple of k",
+    )
+    parser.add_argument("--rrf-k", type=int, default=RRF_K)
+    parser.add_argument("--output", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        summary, documents, vectors = load_snapshot(args.snapshot)
+    else:
+        summary, documents, vectors = load_fixtures(args.fixtures)
+    dimensions = len(vectors[0])
+    backend = create_embedding_backend(
+        "local", dimensions=dimensions, prefix_dimensions=0
+    )
+    if backend.model_id != summary["embedding_model"]:
+        raise ValueError(
+            f"Fixtures use {summary['embedding_model']}, cannot embed queries with it"
+        )
+    queries, sources = make_queries(args.fixtures, documents, args.queries, args.seed)
+    query_vectors = backend.embed_documents(queries)
+    ids = [d["document_id"] for d in documents]
+    logger.info(
+        f"Benchmarking {len(queries)} queries over {len(ids)} documents ({dimensions} dimensions)"
+    )
+
+    full = LocalVectorIndex(ids, vectors)
+    truth = [{i for i, _ in full.search(q, args.k)} for q in query_vectors]
+    results = [
+        {
+            "mode": "full",
+            "queries": "passage",
+            "dimensions": dimensions,
+            "candidates": args.k,
+            "index_mb": round(full.nbytes / 2**20, 2),
+            **measure(
+                lambda q: full.search(q, args.k),
+                query_vectors,
+                truth,
+                args.k,
+                sources,
+            ),
+        }
+    ]
+    for prefix in [int(p) for p in args.prefix_dimensions.split(",")]:
+        if prefix >= dimensions:
+            continue
+        index = LocalVectorIndex(ids, vectors, prefix_dimensions=prefix)
+        for factor in [int(f) for f in args.rerank_factors.split(",")]:
+            candidates = args.k * factor
+            results.append(
+                {
+                    "mode": "two_stage",
+                    "queries": "passage",
+                    "dimensions": prefix,
+                    "candidates": candidates,
+                    "index_mb": round(index.prefix_nbytes / 2**20, 2),
+                    **measure(
+                        lambda q: index.search_two_stage(q, args.k, candidates),
+                        query_vectors,
+                        truth,
+                        args.k,
+                        sources,
+                    ),
+                }
+            )
+
+    if args.hybrid:
+        texts = {d["document_id"]: read_text(args.fixtures, d) for d in documents}
+        text_index = LocalTextIndex(ids, [texts[i] for i in ids])
+        candidates = args.k * args.hybrid_factor
+        identifiers = identifier_queries(text_index, texts, sources, args.seed)
+        identifier_vectors = backend.embed_documents(identifiers)
+        identifier_truth = [
+            {i for i, _ in full.search(q, args.k)} for q in identifier_vectors
+        ]
+        query_sets = [
+            ("passage", queries, query_vectors, truth),
+            ("identifier", identifiers, identifier_vectors, identifier_truth),
+        ]
+        for name, set_queries, set_vectors, set_truth in query_sets:
+            if name != "passage":
+                results.append(
+                    {
+                        "mode": "full",
+                        "queries": name,
+                        "dimensions": dimensions,
+                        "candidates": args.k,
+                        "index_mb": round(full.nbytes / 2**20, 2),
+                        **measure(
+                            lambda q: full.search(q, args.k),
+                            set_vectors,
+                            set_truth,
+                            args.k,
+                            sources,
+                        ),
+                    }
+                )
+            results.append(
+                {
+                    "mode": "text",
+                    "queries": name,
+                    "dimensions": 0,
+                    "candidates": args.k,
+                    "index_mb": 0,
+                    **measure(
+                        lambda q: text_index.search(q, args.k),
+                        set_queries,
+                        set_truth,
+                        args.k,
+                        sources,
+                    ),
+                }
+            )
+            results.append(
+                {
+                    "mode": "hybrid",
+                    "queries": name,
+                    "dimensions": dimensions,
+                    "candidates": candidates,
+                    "index_mb": round(full.nbytes / 2**20, 2),
+                    **measure(
+                        lambda pair: hybrid_search(
+                            full, text_index, *pair, args.k, candidates, args.rrf_k
+                        ),
+                        list(zip(set_queries, set_vectors)),
+                        set_truth,
+                        args.k,
+                        sources,
+                    ),
+                }
+            )
+
+    print(
+        f"{'mode':<10}{'queries':<11}{'dims':>6}{'cands':>7}{'index MB':>10}{'recall':>8}{'source':>8}{'p50 ms':>9}{'p95 ms':>9}"
+    )
+    for row in results:
+        print(
+            f"{row['mode']:<10}{row['queries']:<11}{row['dimensions']:>6}{row['candidates']:>7}{row['index_mb']:>10}"
+            f"{row['recall']:>8}{row['source_hit']:>8}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {"fixtures": summary["parameters"], "k": args.k, "results": results},
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,16 @@
 import os
+import sys
 import argparse
 import logging
-from pymongo import MongoClient
-from langchain_openai import OpenAIEmbeddings
+from datetime import timedelta
+from pymongo import MongoClient, UpdateOne
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.collection_alias import resolve_alias
+from utils.document_storage import DocumentStorage
+from utils.embedding_backends import create_embedding_backend, truncate_vector
+from utils.embedding_store import EmbeddingStore
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -10,21 +18,33 @@ logger = logging.getLogger(__name__)
 
 # Retrieve environment variables
 MONGODB_URI = os.environ.get("MONGODB_URI")
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+STORAGE_LAYOUT = os.environ.get("STORAGE_LAYOUT", "single")
+DOCUMENT_CHUNK_SIZE = int(os.environ.get("DOCUMENT_CHUNK_SIZE", "2000"))
 
 # Validate environment variables
 if not MONGODB_URI:
     raise ValueError("MONGODB_URI environment variable is not set")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
 
 # Initialize MongoDB client
 mongo_client = MongoClient(MONGODB_URI)
 db = mongo_client.secure_rag
-collection = db.documents
+# The collection the documents alias points at, with the settings it was built with
+pointer = resolve_alias(db)
+settings = pointer.get("settings", {})
+collection = db[pointer["collection"]]
+storage = DocumentStorage(
+    mongo_client,
+    db,
+    settings.get("storage_layout", STORAGE_LAYOUT),
+    settings.get("chunk_size", DOCUMENT_CHUNK_SIZE),
+    collection=pointer["collection"],
+)
+
+# Initialize the configured embedding backend (EMBEDDING_BACKEND)
+embeddings = create_embedding_backend(**settings.get("embedding", {}))
 
-# Initialize OpenAI embeddings
-embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+# Embeddings already computed for identical content are reused
+embedding_store = EmbeddingStore(db.embedding_store, embeddings.model_id)
 
 
 def generate_embedding(content: str) -> list[float]:
@@ -35,24 +55,33 @@ def generate_embedding(content: str) -> list[float]:
 def generate_embeddings_for_document(document_id: str) -> bool:
     """Generate embeddings for a specific document and update it in MongoDB."""
     try:
-        document = collection.find_one({"document_id": document_id})
+        document = collection.find_one(
+            {"document_id": document_id}, {"content_hash": 1}
+        )
         if not document:
             logger.error(f"Document with ID {document_id} not found in MongoDB")
             return False
 
-        content = document.get("content", "")
+        content = storage.get_contents([document_id]).get(document_id, "")
         if not content:
             logger.error(f"No content found for document {document_id}")
             return False
 
-        vector_embedding = generate_embedding(content)
+        content_hash = document.get("content_hash")
+        if content_hash:
+            vector_embedding = embedding_store.get_or_embed(
+                content_hash, content, generate_embedding
+            )
+            embedding_store.acquire(content_hash, document_id)
+        else:
+            vector_embedding = generate_embedding(content)
         logger.info(
             f"Generated embedding for document {document_id} (length: {len(vector_embedding)})"
         )
 
         result = collection.update_one(
             {"document_id": document_id},
-            {"$set": {"vector_embedding": vector_embedding}},
+            {"$set": embeddings.vector_fields(vector_embedding)},
         )
         logger.info(
             f"MongoDB update result: acknowledged={result.acknowledged}, modified_count={result.modified_count}"
@@ -67,7 +96,7 @@ def generate_embeddings_for_document(document_id: str) -> bool:
 def generate_embeddings_for_all_documents() -> None:
     """Generate embeddings for all documents in the collection."""
     try:
-        documents = collection.find()
+        documents = collection.find({}, {"document_id": 1})
         total_docs = collection.count_documents({})
         logger.info(f"Found {total_docs} documents to process")
 
@@ -83,6 +112,36 @@ def generate_embeddings_for_all_documents() -> None:
         logger.error(f"Error generating embeddings for all documents: {str(e)}")
 
 
+def backfill_prefixes(batch_size: int = 500) -> None:
+    """Store prefix vectors for documents embedded before prefixes were enabled."""
+    dimensions = embeddings.prefix_dimensions
+    if not dimensions:
+        raise ValueError("EMBEDDING_PREFIX_DIMENSIONS is not set")
+
+    # Prefixes are cut from the stored vectors, no embeddings are requested
+    cursor = collection.find(
+        {
+            "embedding_model": embeddings.model_id,
+            "vector_embedding": {"$exists": True},
+            f"vector_prefix.{dimensions - 1}": {"$exists": False},
+        },
+        {"vector_embedding": 1},
+    )
+    updates = []
+    updated = 0
+    for doc in cursor:
+        prefix = truncate_vector(doc["vector_embedding"], dimensions)
+        updates.append(
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"vector_prefix": prefix}})
+        )
+        if len(updates) >= batch_size:
+            updated += collection.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        updated += collection.bulk_write(updates, ordered=False).modified_count
+    logger.info(f"Stored {dimensions}-dimension prefixes for {updated} documents")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Generate embeddings for documents in MongoDB"
@@ -97,10 +156,28 @@ def main():
         action="store_true",
         help="Generate embeddings for all documents in the collection",
     )
+    parser.add_argument(
+        "--backfill-prefix",
+        action="store_true",
+        help="Store EMBEDDING_PREFIX_DIMENSIONS prefixes of existing vectors",
+    )
+    parser.add_argument(
+        "--gc",
+        action="store_true",
+        help="Remove stored embeddings no document has referenced for --gc-grace-hours",
+    )
+    parser.add_argument(
+        "--gc-grace-hours",
+        type=float,
+        default=24,
+        help="How long an unreferenced embedding is kept for reuse (default: 24)",
+    )
     args = parser.parse_args()
 
-    if not args.document_id and not args.all:
-        parser.error("Must specify either --document-id or --all")
+    if not (args.document_id or args.all or args.gc or args.backfill_prefix):
+        parser.error(
+            "Must specify either --document-id, --all, --backfill-prefix or --gc"
+        )
 
     if args.document_id:
         logger.info(f"Generating embedding for document ID: {args.document_id}")
@@ -109,6 +186,12 @@ def main():
         logger.info("Generating embeddings for all documents")
         generate_embeddings_for_all_documents()
 
+    if args.backfill_prefix:
+        backfill_prefixes()
+
+    if args.gc:
+        embedding_store.collect_garbage(timedelta(hours=args.gc_grace_hours))
+
 
 if __name__ == "__main__":
     main()
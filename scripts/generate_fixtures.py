@@ -0,0 +1,355 @@
+import os
+import sys
+import json
+import math
+import random
+import shutil
+import hashlib
+import argparse
+import logging
+from contextlib import ExitStack
+from typing import Any, Dict, List
+
+import frontmatter
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.document_ids import generate_document_id
+from utils.embedding_backends import create_embedding_backend
+from utils.local_pdp import LocalPDP
+from utils.permit_resources import DEPARTMENTS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COMMON_WORDS = (
+    "the of and to in for on with as by at from that this is are be will we our "
+    "team plan project review process update report quarter goal result customer "
+    "product service system data risk cost budget target growth support design "
+    "release timeline owner status issue change policy metric decision summary "
+    "next step action item meeting schedule resource priority scope launch"
+).split()
+SYLLABLES = (
+    "ka lo mi ra ten vo sul dra pe xin ol bar que ti zen mor ha lin gu fe".split()
+)
+TOPIC_WORDS_PER_DEPARTMENT = 40
+
+
+def zipf_weights(n: int, skew: float) -> List[float]:
+    """Weights of n ranked items under Zipf's law; skew 0 is uniform."""
+    return [1 / (rank**skew) for rank in range(1, n + 1)]
+
+
+def pseudo_word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def department_names(count: int) -> List[str]:
+    """The real departments first, so fixtures line up with setup_departments."""
+    names = DEPARTMENTS[:count]
+    names += [f"department_{i:03d}" for i in range(len(names), count)]
+    return names
+
+
+def generate_users(
+    rng: random.Random,
+    departments: List[str],
+    count: int,
+    skew: float,
+    extra_membership_rate: float,
+    max_memberships: int,
+) -> List[Dict[str, Any]]:
+    """
+    Create users whose memberships follow a Zipf distribution over departments,
+    so a few departments are much larger than the rest.
+    """
+    weights = zipf_weights(len(departments), skew)
+    users = []
+    for i in range(count):
+        memberships = [rng.choices(departments, weights)[0]]
+        while (
+            len(memberships) < min(max_memberships, len(departments))
+            and rng.random() < extra_membership_rate
+        ):
+            department = rng.choices(departments, weights)[0]
+            if department not in memberships:
+                memberships.append(department)
+        users.append(
+            {"id": f"user_{i:06d}", "name": f"User {i}", "departments": memberships}
+        )
+    return users
+
+
+def word_count(rng: random.Random, median: int, sigma: float, low: int, high: int):
+    """Draw a document length from a log-normal distribution, like real corpora."""
+    return max(low, min(high, int(median * math.exp(rng.gauss(0, sigma)))))
+
+
+def generate_body(
+    rng: random.Random, title: str, words: int, topic_words: List[str]
+) -> str:
+    """Markdown with headings, paragraphs and lists mixing common and topic words."""
+    lines = [f"# {title}", ""]
+    written = 0
+    while written < words:
+        section = min(words - written, rng.randint(80, 300))
+        heading = " ".join(rng.choice(topic_words) for _ in range(2)).title()
+        lines += [f"## {heading}", ""]
+        remaining = section
+        while remaining > 0:
+            length = min(remaining, rng.randint(20, 90))
+            tokens = [
+                rng.choice(topic_words if rng.random() < 0.3 else COMMON_WORDS)
+                for _ in range(length)
+            ]
+            if rng.random() < 0.2:
+                lines += [
+                    f"- {' '.join(tokens[j : j + 8])}" for j in range(0, length, 8)
+                ]
+            else:
+                lines.append(" ".join(tokens).capitalize() + ".")
+            lines.append("")
+            remaining -= length
+        written += section
+    return "\n".join(lines)
+
+
+def render_document(metadata: Dict[str, Any], body: str) -> str:
+    return frontmatter.dumps(frontmatter.Post(body, **metadata)) + "\n"
+
+
+def generate(args) -> Dict[str, Any]:
+    """Write the fixture set described by args and return its summary."""
+    output = os.path.abspath(args.output)
+    docs_dir = os.path.join(output, "docs")
+    if os.path.isdir(docs_dir) and os.listdir(docs_dir):
+        if not args.clean:
+            raise ValueError(f"{docs_dir} is not empty, pass --clean to replace it")
+        shutil.rmtree(docs_dir)
+    os.makedirs(docs_dir, exist_ok=True)
+
+    # Each kind of entity draws from its own seeded stream, so changing one
+    # count does not reshuffle the others
+    departments = department_names(args.departments)
+    vocabulary_rng = random.Random(f"{args.seed}:vocabulary")
+    topics = {
+        department: [
+            pseudo_word(vocabulary_rng) for _ in range(TOPIC_WORDS_PER_DEPARTMENT)
+        ]
+        for department in departments
+    }
+    users = generate_users(
+        random.Random(f"{args.seed}:users"),
+        departments,
+        args.users,
+        args.membership_skew,
+        args.extra_membership_rate,
+        args.max_memberships,
+    )
+    members: Dict[str, List[str]] = {department: [] for department in departments}
+    pdp = LocalPDP()
+    for user in users:
+        for department in user["departments"]:
+            members[department].append(user["id"])
+            pdp.add_member(user["id"], department)
+
+    embeddings = (
+        None
+        if args.no_embeddings
+        else create_embedding_backend("local", dimensions=args.dimensions)
+    )
+    department_weights = zipf_weights(len(departments), args.document_skew)
+    sizes = []
+    embeddings_path = os.path.join(output, "embeddings.jsonl")
+    if embeddings is None and os.path.exists(embeddings_path):
+        os.remove(embeddings_path)
+    with ExitStack() as stack:
+        documents_file = stack.enter_context(
+            open(os.path.join(output, "documents.jsonl"), "w")
+        )
+        if embeddings is not None:
+            embeddings_file = stack.enter_context(open(embeddings_path, "w"))
+        for i in range(args.documents):
+            # Per-document streams keep document i identical whatever K is
+            rng = random.Random(f"{args.seed}:document:{i}")
+            department = rng.choices(departments, department_weights)[0]
+            topic_words = topics[department]
+            title = f"{rng.choice(topic_words).title()} {rng.choice(COMMON_WORDS).title()} {i}"
+            words = word_count(
+                rng, args.median_words, args.size_sigma, args.min_words, args.max_words
+            )
+            metadata = {
+                "title": title,
+                "department": department,
+                "author": (
+                    rng.choice(members[department])
+                    if members[department]
+                    else "unknown"
+                ),
+                "confidential": rng.random() < args.confidential_rate,
+            }
+            text = render_document(
+                metadata, generate_body(rng, title, words, topic_words)
+            )
+
+            relative_path = (
+                f"{department}/{topic_words[i % len(topic_words)]}_{i:07d}.md"
+            )
+            path = os.path.join(docs_dir, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+
+            # Same ID and hash the watcher computes when docs/ is mounted at /app/docs
+            content = frontmatter.loads(text).content
+            content_hash = hashlib.md5(content.encode()).hexdigest()
+            document_id = generate_document_id(f"docs/{relative_path}")
+            pdp.add_parent(document_id, department)
+            sizes.append(len(content.encode()))
+            documents_file.write(
+                json.dumps(
+                    {
+                        "document_id": document_id,
+                        "path": f"docs/{relative_path}",
+                        "department": department,
+                        "confidential": metadata["confidential"],
+                        "words": words,
+                        "bytes": sizes[-1],
+                        "content_hash": content_hash,
+                    }
+                )
+                + "\n"
+            )
+            if embeddings is not None:
+                vector = [round(v, 6) for v in embeddings.embed_query(content)]
+                embeddings_file.write(
+                    json.dumps({"content_hash": content_hash, "vector": vector}) + "\n"
+                )
+            if (i + 1) % 1000 == 0:
+                logger.info(f"Generated {i + 1}/{args.documents} documents")
+
+    pdp.save(os.path.join(output, "pdp.json"))
+    with open(os.path.join(output, "departments.json"), "w") as f:
+        json.dump(departments, f, indent=2)
+    with open(os.path.join(output, "users.json"), "w") as f:
+        json.dump(users, f)
+
+    sizes.sort()
+    summary = {
+        "seed": args.seed,
+        "parameters": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "clean", "seed_embedding_store")
+        },
+        "departments": len(departments),
+        "users": len(users),
+        "documents": args.documents,
+        "members_per_department": {d: len(members[d]) for d in departments},
+        "documents_per_department": {
+            d: len(pdp.documents.get(d, ())) for d in departments
+        },
+        "document_bytes": {
+            "p50": sizes[len(sizes) // 2] if sizes else 0,
+            "p95": sizes[int(len(sizes) * 0.95)] if sizes else 0,
+            "max": sizes[-1] if sizes else 0,
+            "total": sum(sizes),
+        },
+        "embedding_model": embeddings.model_id if embeddings else None,
+    }
+    with open(os.path.join(output, "fixtures.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def seed_embedding_store(output: str, dimensions: int) -> int:
+    """Load the precomputed vectors into the shared embedding store."""
+    from pymongo import MongoClient
+    from utils.embedding_store import EmbeddingStore
+
+    mongodb_uri = os.environ.get("MONGODB_URI")
+    if not mongodb_uri:
+        raise ValueError("MONGODB_URI environment variable is not set")
+    store = EmbeddingStore(
+        MongoClient(mongodb_uri).secure_rag.embedding_store,
+        create_embedding_backend("local", dimensions=dimensions).model_id,
+    )
+    seeded = 0
+    with open(os.path.join(output, "embeddings.jsonl")) as f:
+        for line in f:
+            entry = json.loads(line)
+            store.put(entry["content_hash"], entry["vector"])
+            seeded += 1
+    return seeded
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a reproducible synthetic corpus, users and permissions"
+    )
+    parser.add_argument("--output", default="fixtures", help="Output directory")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--departments", type=int, default=20)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument(
+        "--membership-skew",
+        type=float,
+        default=1.1,
+        help="Zipf exponent of department sizes (0 spreads users evenly)",
+    )
+    parser.add_argument(
+        "--extra-membership-rate",
+        type=float,
+        default=0.2,
+        help="Chance that a user joins each additional department",
+    )
+    parser.add_argument("--max-memberships", type=int, default=3)
+    parser.add_argument(
+        "--document-skew",
+        type=float,
+        default=1.0,
+        help="Zipf exponent of documents per department",
+    )
+    parser.add_argument(
+        "--median-words", type=int, default=600, help="Median document length"
+    )
+    parser.add_argument(
+        "--size-sigma",
+        type=float,
+        default=0.9,
+        help="Spread of the log-normal document length distribution",
+    )
+    parser.add_argument("--min-words", type=int, default=30)
+    parser.add_argument("--max-words", type=int, default=20000)
+    parser.add_argument("--confidential-rate", type=float, default=0.2)
+    parser.add_argument(
+        "--dimensions", type=int, default=256, help="Dimensions of local embeddings"
+    )
+    parser.add_argument(
+        "--no-embeddings", action="store_true", help="Skip precomputing embeddings"
+    )
+    parser.add_argument(
+        "--seed-embedding-store",
+        action="store_true",
+        help="Also load the embeddings into MongoDB (uses MONGODB_URI)",
+    )
+    parser.add_argument(
+        "--clean", action="store_true", help="Replace previously generated docs"
+    )
+    args = parser.parse_args()
+
+    summary = generate(args)
+    logger.info(
+        f"Generated {summary['departments']} departments, {summary['users']} users and "
+        f"{summary['documents']} documents ({summary['document_bytes']['total']} bytes) "
+        f"in {args.output}"
+    )
+    if args.seed_embedding_store and not args.no_embeddings:
+        seeded = seed_embedding_store(os.path.abspath(args.output), args.dimensions)
+        logger.info(f"Seeded {seeded} embeddings into the embedding store")
+
+
+if __name__ == "__main__":
+    main()
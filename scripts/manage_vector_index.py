@@ -0,0 +1,101 @@
+import os
+import sys
+import argparse
+import logging
+
+from pymongo import MongoClient
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.collection_alias import resolve_alias
+from utils.embedding_backends import resolve_settings
+from utils.vector_index import (
+    QUANTIZATIONS,
+    SIMILARITIES,
+    VectorIndexManager,
+    desired_indexes,
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retrieve environment variables
+MONGODB_URI = os.environ.get("MONGODB_URI")
+
+
+def configured_dimensions(settings) -> tuple[int, int]:
+    """Vector and prefix lengths of the collection's embedding backend."""
+    embedding = resolve_settings(**settings.get("embedding", {}))
+    return embedding["dimensions"], embedding["prefix_dimensions"]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Create or update the vector search indexes the app queries"
+    )
+    parser.add_argument(
+        "command",
+        choices=["plan", "apply", "status"],
+        help="plan shows differences, apply creates or updates indexes and waits",
+    )
+    parser.add_argument(
+        "--collection", help="Defaults to the collection the documents alias names"
+    )
+    parser.add_argument("--dimensions", type=int)
+    parser.add_argument("--prefix-dimensions", type=int)
+    parser.add_argument("--similarity", choices=SIMILARITIES)
+    parser.add_argument("--quantization", choices=QUANTIZATIONS)
+    parser.add_argument(
+        "--filter",
+        action="append",
+        dest="filters",
+        help="Filter path, repeatable; replaces the default filter fields",
+    )
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument(
+        "--no-wait", action="store_true", help="Return without waiting for builds"
+    )
+    args = parser.parse_args()
+
+    if not MONGODB_URI:
+        raise ValueError("MONGODB_URI environment variable is not set")
+    db = MongoClient(MONGODB_URI).secure_rag
+    pointer = resolve_alias(db)
+    collection = db[args.collection or pointer["collection"]]
+    dimensions, prefix_dimensions = configured_dimensions(pointer.get("settings", {}))
+    if args.prefix_dimensions is not None:
+        prefix_dimensions = args.prefix_dimensions
+    desired = desired_indexes(
+        args.dimensions or dimensions,
+        prefix_dimensions,
+        similarity=args.similarity,
+        quantization=args.quantization,
+        filter_paths=tuple(args.filters) if args.filters else None,
+    )
+    manager = VectorIndexManager(collection)
+
+    if args.command == "status":
+        for name, index in manager.deployed().items():
+            print(f"{name}: {index.get('status')} queryable={index.get('queryable')}")
+        return
+
+    if args.command == "plan":
+        actions = manager.plan(desired)
+    else:
+        actions = manager.apply(desired)
+    if not actions:
+        print(f"Vector indexes on {collection.name} match their definitions")
+    for action, name, changes in actions:
+        print(f"{action} {name}")
+        for change in changes:
+            print(f"  {change}")
+    if args.command == "plan":
+        # Non-zero when changes are pending, for use in deploy checks
+        sys.exit(2 if actions else 0)
+    if not args.no_wait:
+        manager.wait_until_queryable(list(desired), args.timeout)
+
+
+if __name__ == "__main__":
+    main()
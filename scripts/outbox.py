@@ -0,0 +1,126 @@
+import os
+import sys
+import argparse
+import asyncio
+import logging
+from typing import Any, Dict
+from pymongo import MongoClient
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from watcher.outbox import SyncOutbox, OutboxWorker, PENDING, DEAD
+from watcher.sync import (
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BASE_DELAY,
+    OUTBOX_MAX_DELAY,
+    OUTBOX_LEASE_SECONDS,
+)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retrieve environment variables
+MONGODB_URI = os.environ.get("MONGODB_URI")
+
+# Validate environment variables
+if not MONGODB_URI:
+    raise ValueError("MONGODB_URI environment variable is not set")
+
+
+OUTBOXES = {"sync": "sync_outbox", "permit": "permit_outbox"}
+
+
+def get_outbox(name: str) -> SyncOutbox:
+    mongo_client = MongoClient(MONGODB_URI)
+    return SyncOutbox(
+        mongo_client.secure_rag[OUTBOXES[name]],
+        max_attempts=OUTBOX_MAX_ATTEMPTS,
+        base_delay=OUTBOX_BASE_DELAY,
+        max_delay=OUTBOX_MAX_DELAY,
+        lease_seconds=OUTBOX_LEASE_SECONDS,
+    )
+
+
+def list_entries(outbox: SyncOutbox, state: str, limit: int) -> None:
+    counts = outbox.counts()
+    print(f"pending={counts[PENDING]} dead={counts[DEAD]}")
+    for entry in outbox.entries(state, limit):
+        lease = entry.get("lease_owner") or "-"
+        print(
+            f"{entry['_id']}\t{entry['state']}\t{entry['op']}\tattempts={entry['attempts']}"
+            f"\tnext={entry['next_attempt_at'].isoformat()}\tlease={lease}"
+            f"\terror={entry.get('last_error')}"
+        )
+
+
+def retry_now(outbox: SyncOutbox, name: str) -> None:
+    """Drain every due entry in this process instead of waiting for a watcher."""
+    from watcher.sync import DocumentSyncer
+
+    syncer = DocumentSyncer(MONGODB_URI)
+    if name == "permit":
+        from watcher.permit_sync import PermitSync
+
+        permit_sync = PermitSync.from_env(syncer.db, syncer.collection)
+        if permit_sync is None:
+            raise ValueError("Permit sync is disabled or PERMIT_API_KEY is not set")
+        loop = asyncio.new_event_loop()
+
+        def handler(entry: Dict[str, Any]) -> None:
+            loop.run_until_complete(permit_sync.retry_entry(entry))
+
+    else:
+        handler = syncer.retry_entry
+    worker = OutboxWorker(outbox, handler, poll_interval=0)
+    processed = 0
+    while worker.drain_once():
+        processed += 1
+    logger.info(f"Processed {processed} outbox entries")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay the sync outbox")
+    parser.add_argument(
+        "--outbox",
+        choices=list(OUTBOXES),
+        default="sync",
+        help="sync: MongoDB document writes, permit: Permit instances and tuples",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="Show outbox entries")
+    list_parser.add_argument("--state", choices=[PENDING, DEAD])
+    list_parser.add_argument("--limit", type=int, default=50)
+
+    replay_parser = subparsers.add_parser(
+        "replay", help="Make entries due now with a fresh attempt count"
+    )
+    replay_parser.add_argument(
+        "document_ids", nargs="*", help="Entries to replay (default: all dead entries)"
+    )
+
+    subparsers.add_parser(
+        "retry", help="Process due entries in this process (run where the docs live)"
+    )
+
+    purge_parser = subparsers.add_parser("purge", help="Delete entries in a state")
+    purge_parser.add_argument("--state", choices=[PENDING, DEAD], default=DEAD)
+
+    args = parser.parse_args()
+    outbox = get_outbox(args.outbox)
+
+    if args.command == "list":
+        list_entries(outbox, args.state, args.limit)
+    elif args.command == "replay":
+        replayed = outbox.replay(args.document_ids or None)
+        logger.info(f"Replayed {replayed} outbox entries")
+    elif args.command == "retry":
+        retry_now(outbox, args.outbox)
+    elif args.command == "purge":
+        purged = outbox.purge(args.state)
+        logger.info(f"Deleted {purged} {args.state} outbox entries")
+
+
+if __name__ == "__main__":
+    main()
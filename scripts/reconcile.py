@@ -0,0 +1,476 @@
+# reconcile.py
+import os
+import sys
+import asyncio
+import argparse
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from permit import Permit
+from permit.exceptions import PermitNotFoundError
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from scripts.setup_rebac import (
+    RESOURCES,
+    RELATIONS,
+    ROLES,
+    DERIVATIONS,
+    wait_for_relations,
+)
+from scripts.setup_departments import DEPARTMENTS, TENANTS
+from scripts.setup_users import USERS
+from scripts.sync_documents import read_markdown_file, enrich_metadata, normalize_path
+from utils.document_ids import generate_document_id
+from utils.permit_resources import document_instance, parent_tuple
+from utils.tenants import DEFAULT_TENANT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Environment variables
+PERMIT_API_KEY = os.environ.get("PERMIT_API_KEY")
+PERMIT_PDP_URL = os.getenv("PERMIT_PDP_URL", "http://permit-pdp:7000")
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "10"))
+DOCS_DIR = os.getenv("RECONCILE_DOCS_DIR", "./docs")
+
+PAGE_SIZE = 100
+
+Change = Tuple[str, Callable[[], Awaitable[Any]]]
+
+
+async def list_all(fetch: Callable[..., Awaitable[Any]], **kwargs) -> List[Any]:
+    """Read every page of a Permit list endpoint."""
+    items, page = [], 1
+    while True:
+        result = await fetch(page=page, per_page=PAGE_SIZE, **kwargs)
+        batch = result.data if hasattr(result, "data") else result
+        items.extend(batch)
+        if len(batch) < PAGE_SIZE:
+            return items
+        page += 1
+
+
+def chunks(items: List[Any], size: int = PAGE_SIZE) -> List[List[Any]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def short_key(value: str) -> str:
+    """Strip the "resource:" prefix Permit puts on some keys."""
+    return value.split(":", 1)[1] if ":" in value else value
+
+
+class Reconciler:
+    """
+    Bring Permit in line with the desired state declared by the setup scripts.
+
+    Each phase reads the current state, computes the changes still needed and
+    applies them concurrently. Phases run in dependency order (resources before
+    relations, relations before derivations, instances before tuples), and a
+    phase that has nothing to change makes no write calls, so reruns are cheap.
+    """
+
+    def __init__(self, permit_client, concurrency: int, dry_run: bool, prune: bool):
+        self.permit_client = permit_client
+        self.api = permit_client.api
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.dry_run = dry_run
+        self.prune = prune
+        self.applied: Dict[str, int] = {}
+        self._desired_documents: Optional[Dict[str, Dict[str, Any]]] = None
+
+    async def apply(self, phase: str, changes: List[Change]) -> int:
+        """Run the changes of one phase concurrently."""
+        self.applied[phase] = len(changes)
+        if not changes:
+            logger.info(f"{phase}: up to date")
+            return 0
+        for description, _ in changes:
+            logger.info(f"{phase}: {description}")
+        if self.dry_run:
+            return len(changes)
+
+        async def run(change: Change):
+            async with self.semaphore:
+                await change[1]()
+
+        await asyncio.gather(*(run(change) for change in changes))
+        return len(changes)
+
+    # Policy structure
+
+    async def reconcile_resources(self) -> None:
+        existing = {r.key: r for r in await list_all(self.api.resources.list)}
+        changes = []
+        for resource in RESOURCES:
+            current = existing.get(resource["key"])
+            if current is None:
+                changes.append(
+                    (
+                        f"create resource {resource['key']}",
+                        lambda r=resource: self.api.resources.create(r),
+                    )
+                )
+                continue
+            missing = set(resource["actions"]) - set(current.actions or {})
+            if missing:
+                actions = {
+                    key: {"description": action.description}
+                    for key, action in (current.actions or {}).items()
+                }
+                actions.update(resource["actions"])
+                changes.append(
+                    (
+                        f"add actions {sorted(missing)} to {resource['key']}",
+                        lambda r=resource, a=actions: self.api.resources.update(
+                            r["key"], {"actions": a}
+                        ),
+                    )
+                )
+        await self.apply("resources", changes)
+
+    async def reconcile_relations(self) -> None:
+        changes = []
+        for resource_key, relation in RELATIONS:
+            try:
+                await self.api.resource_relations.get(resource_key, relation["key"])
+            except PermitNotFoundError:
+                changes.append(
+                    (
+                        f"create relation {resource_key}.{relation['key']}",
+                        lambda r=resource_key, rel=relation: self.api.resource_relations.create(
+                            r, rel
+                        ),
+                    )
+                )
+        if await self.apply("relations", changes) and not self.dry_run:
+            await wait_for_relations(self.permit_client)
+
+    async def reconcile_roles(self) -> None:
+        resource_keys = sorted({resource_key for resource_key, _ in ROLES})
+        listed = await asyncio.gather(
+            *(
+                list_all(self.api.resource_roles.list, resource_key=r)
+                for r in resource_keys
+            )
+        )
+        existing = {
+            (resource_key, role.key): role
+            for resource_key, roles in zip(resource_keys, listed)
+            for role in roles
+        }
+
+        role_changes, derivation_changes = [], []
+        for resource_key, role in ROLES:
+            current = existing.get((resource_key, role["key"]))
+            if current is None:
+                role_changes.append(
+                    (
+                        f"create role {resource_key}#{role['key']}",
+                        lambda r=resource_key, ro=role: self.api.resource_roles.create(
+                            r, ro
+                        ),
+                    )
+                )
+                continue
+            granted = {short_key(p) for p in current.permissions or []}
+            missing = [p for p in role["permissions"] if p not in granted]
+            if missing:
+                role_changes.append(
+                    (
+                        f"grant {missing} to {resource_key}#{role['key']}",
+                        lambda r=resource_key, ro=role, m=missing: self.api.resource_roles.assign_permissions(
+                            r, ro["key"], m
+                        ),
+                    )
+                )
+
+        for resource_key, role_key, rule in DERIVATIONS:
+            current = existing.get((resource_key, role_key))
+            derived = []
+            if current is not None and current.granted_to is not None:
+                derived = current.granted_to.users_with_role or []
+            if not any(
+                d.role == rule["role"]
+                and d.on_resource == rule["on_resource"]
+                and d.linked_by_relation == rule["linked_by_relation"]
+                for d in derived
+            ):
+                derivation_changes.append(
+                    (
+                        f"derive {resource_key}#{role_key} from {rule['on_resource']}#{rule['role']}",
+                        lambda r=resource_key, ro=role_key, ru=rule: self.api.resource_roles.create_role_derivation(
+                            resource_key=r, role_key=ro, derivation_rule=ru
+                        ),
+                    )
+                )
+
+        # Derivations reference roles, so they go after the roles exist
+        await self.apply("roles", role_changes)
+        await self.apply("derivations", derivation_changes)
+
+    # Instances and assignments
+
+    def desired_tenants(self) -> List[str]:
+        """Configured tenants and those documents and users are in."""
+        tenants = {DEFAULT_TENANT, *TENANTS}
+        tenants.update(i["tenant"] for i in self.desired_documents().values())
+        tenants.update(u.get("tenant", DEFAULT_TENANT) for u in USERS)
+        return sorted(tenants)
+
+    async def reconcile_tenants(self) -> None:
+        existing = {t.key for t in await list_all(self.api.tenants.list)}
+        changes = [
+            (
+                f"create tenant {tenant}",
+                lambda t=tenant: self.api.tenants.create({"key": t, "name": t}),
+            )
+            for tenant in self.desired_tenants()
+            if tenant not in existing
+        ]
+        await self.apply("tenants", changes)
+
+    async def reconcile_departments(self) -> None:
+        existing = {
+            (i.tenant, i.key): i
+            for i in await list_all(
+                self.api.resource_instances.list, resource_key="department"
+            )
+        }
+        changes = []
+        for tenant in self.desired_tenants():
+            for department in DEPARTMENTS:
+                attributes = {"name": department["name"]}
+                current = existing.get((tenant, department["key"]))
+                if current is None:
+                    instance = {
+                        "key": department["key"],
+                        "tenant": tenant,
+                        "resource": "department",
+                        "attributes": attributes,
+                    }
+                    changes.append(
+                        (
+                            f"create department {tenant}/{department['key']}",
+                            lambda i=instance: self.api.resource_instances.create(i),
+                        )
+                    )
+                elif (current.attributes or {}) != attributes:
+                    # By ID, as department keys repeat across tenants
+                    changes.append(
+                        (
+                            f"update department {tenant}/{department['key']}",
+                            lambda i=current.id, a=attributes: (
+                                self.api.resource_instances.update(i, {"attributes": a})
+                            ),
+                        )
+                    )
+        await self.apply("departments", changes)
+
+    async def reconcile_users(self) -> None:
+        existing_users, assignments = await asyncio.gather(
+            list_all(self.api.users.list),
+            list_all(
+                self.api.role_assignments.list,
+                role_key="member",
+                resource_key="department",
+            ),
+        )
+        existing = {u.key for u in existing_users}
+        user_changes = []
+        for user in USERS:
+            if user["id"] not in existing:
+                user_data = {
+                    "key": user["id"],
+                    "email": f"{user['name'].lower()}@example.com",
+                    "first_name": user["name"],
+                    "last_name": "",
+                }
+                user_changes.append(
+                    (
+                        f"create user {user['id']}",
+                        lambda u=user_data: self.api.users.create(u),
+                    )
+                )
+
+        managed = {user["id"] for user in USERS}
+        current = {
+            (a.user, f"department:{short_key(a.resource_instance)}", a.tenant)
+            for a in assignments
+            if a.resource_instance
+        }
+        desired = {
+            (u["id"], f"department:{u['department']}", u.get("tenant", DEFAULT_TENANT))
+            for u in USERS
+        }
+        to_assign = [
+            {"user": user, "role": "member", "resource_instance": i, "tenant": t}
+            for user, i, t in sorted(desired - current)
+        ]
+        to_unassign = [
+            {"user": user, "role": "member", "resource_instance": i, "tenant": t}
+            for user, i, t in sorted(current - desired)
+            if user in managed
+        ]
+        assignment_changes = [
+            (
+                f"assign {len(batch)} department memberships",
+                lambda b=batch: self.api.role_assignments.bulk_assign(b),
+            )
+            for batch in chunks(to_assign)
+        ] + [
+            (
+                f"remove {len(batch)} department memberships",
+                lambda b=batch: self.api.role_assignments.bulk_unassign(b),
+            )
+            for batch in chunks(to_unassign)
+        ]
+
+        # Users must exist before they can be assigned
+        await self.apply("users", user_changes)
+        await self.apply("memberships", assignment_changes)
+
+    def desired_documents(self) -> Dict[str, Dict[str, Any]]:
+        if self._desired_documents is not None:
+            return self._desired_documents
+        documents = {}
+        for root, _, files in os.walk(DOCS_DIR):
+            for file in files:
+                if not file.endswith((".md", ".markdown")):
+                    continue
+                file_path = os.path.join(root, file)
+                normalized_path = normalize_path(file_path)
+                metadata, _, _ = read_markdown_file(file_path)
+                metadata = enrich_metadata(metadata, normalized_path)
+                document_id = generate_document_id(normalized_path)
+                documents[document_id] = document_instance(document_id, metadata)
+        self._desired_documents = documents
+        return documents
+
+    async def reconcile_documents(self) -> None:
+        desired = self.desired_documents()
+        instances, tuples = await asyncio.gather(
+            list_all(self.api.resource_instances.list, resource_key="document"),
+            list_all(self.api.relationship_tuples.list, relation_key="parent"),
+        )
+        existing = {i.key: i for i in instances}
+
+        to_replace = [
+            instance
+            for key, instance in desired.items()
+            if key not in existing
+            or (existing[key].attributes or {}) != instance["attributes"]
+            or existing[key].tenant != instance["tenant"]
+        ]
+        current_tuples = {
+            (t.subject, t.object, t.tenant)
+            for t in tuples
+            if t.object.startswith("document:")
+        }
+        desired_tuples = {
+            (
+                f"department:{i['attributes']['department']}",
+                f"document:{key}",
+                i["tenant"],
+            )
+            for key, i in desired.items()
+        }
+        to_create = [
+            parent_tuple(short_key(obj), short_key(subject), tenant)
+            for subject, obj, tenant in sorted(desired_tuples - current_tuples)
+        ]
+        stale = [
+            {"subject": subject, "relation": "parent", "object": obj}
+            for subject, obj, _ in sorted(current_tuples - desired_tuples)
+            if self.prune or short_key(obj) in desired
+        ]
+        to_delete = (
+            [f"document:{key}" for key in sorted(set(existing) - set(desired))]
+            if self.prune
+            else []
+        )
+
+        await self.apply(
+            "document instances",
+            [
+                (
+                    f"upsert {len(batch)} documents",
+                    lambda b=batch: self.api.resource_instances.bulk_replace(b),
+                )
+                for batch in chunks(to_replace)
+            ],
+        )
+        # Tuples reference the instances, so they go after the instances exist
+        await self.apply(
+            "document parents",
+            [
+                (
+                    f"remove {len(batch)} stale parent tuples",
+                    lambda b=batch: self.api.relationship_tuples.bulk_delete(b),
+                )
+                for batch in chunks(stale)
+            ]
+            + [
+                (
+                    f"create {len(batch)} parent tuples",
+                    lambda b=batch: self.api.relationship_tuples.bulk_create(b),
+                )
+                for batch in chunks(to_create)
+            ],
+        )
+        await self.apply(
+            "removed documents",
+            [
+                (
+                    f"delete {len(batch)} documents no longer in {DOCS_DIR}",
+                    lambda b=batch: self.api.resource_instances.bulk_delete(b),
+                )
+                for batch in chunks(to_delete)
+            ],
+        )
+
+    async def run(self) -> Dict[str, int]:
+        # The policy structure is a chain of dependencies
+        await self.reconcile_resources()
+        await self.reconcile_relations()
+        await self.reconcile_roles()
+        # Tenants hold the departments, and departments must exist before
+        # memberships and parent tuples point at them
+        await self.reconcile_tenants()
+        await self.reconcile_departments()
+        await asyncio.gather(self.reconcile_users(), self.reconcile_documents())
+        return self.applied
+
+
+async def reconcile(dry_run: bool = False, prune: bool = False) -> Dict[str, int]:
+    """
+    Apply only the changes needed to reach the desired Permit state.
+    Returns:
+        Number of changes per phase
+    """
+    permit_client = Permit(token=PERMIT_API_KEY, pdp=PERMIT_PDP_URL)
+    reconciler = Reconciler(permit_client, RECONCILE_CONCURRENCY, dry_run, prune)
+    applied = await reconciler.run()
+    verb = "Planned" if dry_run else "Applied"
+    logger.info(f"{verb} {sum(applied.values())} changes: {applied}")
+    return applied
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Reconcile Permit with the desired ReBAC setup"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Log the changes without applying them"
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Also delete document instances and tuples for files no longer in the docs dir",
+    )
+    args = parser.parse_args()
+    await reconcile(dry_run=args.dry_run, prune=args.prune)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
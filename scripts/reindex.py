@@ -0,0 +1,423 @@
+import os
+import sys
+import time
+import random
+import argparse
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+from pymongo import MongoClient
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.collection_alias import resolve_alias, rollback_alias, switch_alias
+from utils.document_storage import DocumentStorage
+from utils.embedding_backends import create_embedding_backend
+from utils.embedding_store import EmbeddingStore
+from utils.vector_index import VECTOR_INDEX_NAME, VectorIndexManager, desired_indexes
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retrieve environment variables
+MONGODB_URI = os.environ.get("MONGODB_URI")
+STORAGE_LAYOUT = os.environ.get("STORAGE_LAYOUT", "single")
+DOCUMENT_CHUNK_SIZE = int(os.environ.get("DOCUMENT_CHUNK_SIZE", "2000"))
+
+# Fields derived from the body or the embedding model, rebuilt for the target
+DERIVED_FIELDS = (
+    "vector_embedding",
+    "vector_prefix",
+    "embedding_backend",
+    "embedding_model",
+    "preview",
+    "content_length",
+)
+
+
+def storage_for(mongo_client, db, pointer: Dict[str, Any]) -> DocumentStorage:
+    settings = pointer.get("settings", {})
+    return DocumentStorage(
+        mongo_client,
+        db,
+        settings.get("storage_layout", STORAGE_LAYOUT),
+        settings.get("chunk_size", DOCUMENT_CHUNK_SIZE),
+        collection=pointer["collection"],
+    )
+
+
+class Reindexer:
+    """
+    Build a shadow copy of the documents collection the alias points at.
+
+    The copy is made with the target embedding backend and storage layout,
+    at a throttled rate, while the app keeps searching the current collection
+    and the watcher keeps writing to it. Each pass copies only documents whose
+    content hash or embedding model differ between the two collections, so
+    building is resumable and repeated passes catch up with writes made in
+    the meantime. Vectors come from the embedding store where possible.
+    """
+
+    def __init__(
+        self,
+        mongo_client,
+        db,
+        target: str,
+        backend,
+        layout: str,
+        chunk_size: int,
+        rate: float,
+        batch_size: int,
+    ):
+        """
+        Args:
+            mongo_client: MongoClient, used for transactions in the split layout
+            db: Database holding the collections
+            target: Name of the shadow collection
+            backend: EmbeddingBackend the shadow collection is embedded with
+            layout: Storage layout of the shadow collection
+            chunk_size: Max characters per body chunk in the split layout
+            rate: Max documents copied per second, 0 for no limit
+            batch_size: Documents per copied batch
+        """
+        self.db = db
+        self.pointer = resolve_alias(db)
+        if self.pointer["collection"] == target:
+            raise ValueError(f"{target} is the collection currently in use")
+        self.source = storage_for(mongo_client, db, self.pointer)
+        self.target = DocumentStorage(
+            mongo_client, db, layout, chunk_size, collection=target
+        )
+        self.target.documents.create_index("document_id", unique=True)
+        self.target.ensure_text_index()
+        self.backend = backend
+        self.embedding_store = EmbeddingStore(db.embedding_store, backend.model_id)
+        self.settings = {
+            "embedding": backend.settings(),
+            "storage_layout": layout,
+            "chunk_size": chunk_size,
+        }
+        self.rate = rate
+        self.batch_size = batch_size
+        self.copied = 0
+        self.deleted = 0
+        self._started = time.monotonic()
+
+    def _throttle(self) -> None:
+        if self.rate <= 0:
+            return
+        wait = self.copied / self.rate - (time.monotonic() - self._started)
+        if wait > 0:
+            time.sleep(wait)
+
+    def diff(self) -> Tuple[List[str], List[str]]:
+        """
+        Returns:
+            IDs to copy, because they are missing from the target or differ in
+            content or model, and IDs to delete from the target
+        """
+        source = {
+            doc["document_id"]: doc.get("content_hash")
+            for doc in self.source.documents.find(
+                {}, {"_id": 0, "document_id": 1, "content_hash": 1}
+            )
+        }
+        target = {
+            doc["document_id"]: (doc.get("content_hash"), doc.get("embedding_model"))
+            for doc in self.target.documents.find(
+                {},
+                {"_id": 0, "document_id": 1, "content_hash": 1, "embedding_model": 1},
+            )
+        }
+        stale = [
+            document_id
+            for document_id, content_hash in source.items()
+            if target.get(document_id) != (content_hash, self.backend.model_id)
+        ]
+        removed = [document_id for document_id in target if document_id not in source]
+        return sorted(stale), removed
+
+    def _embed(self, documents: List[Dict[str, Any]]) -> List[List[float]]:
+        vectors = [self.embedding_store.get(d["content_hash"]) for d in documents]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.backend.embed_documents(
+                [documents[i]["content"] for i in missing]
+            )
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+                self.embedding_store.put(documents[i]["content_hash"], vector)
+        return vectors
+
+    def copy(self, document_ids: List[str]) -> None:
+        """Copy documents from the source, re-embedded and in the target layout."""
+        projection = {"_id": 0, **{field: 0 for field in DERIVED_FIELDS}}
+        for start in range(0, len(document_ids), self.batch_size):
+            ids = document_ids[start : start + self.batch_size]
+            documents = list(
+                self.source.documents.find({"document_id": {"$in": ids}}, projection)
+            )
+            contents = self.source.get_contents(ids)
+            for document in documents:
+                document["content"] = contents.get(document["document_id"], "")
+            vectors = self._embed(documents)
+            self.target.write(
+                [
+                    {**document, **self.backend.vector_fields(vector)}
+                    for document, vector in zip(documents, vectors)
+                ],
+                [],
+            )
+            for document in documents:
+                self.embedding_store.acquire(
+                    document["content_hash"], document["document_id"]
+                )
+            self.copied += len(documents)
+            logger.info(
+                f"Copied {start + len(ids)}/{len(document_ids)} documents to {self.target.documents.name}"
+            )
+            self._throttle()
+
+    def sync(self) -> int:
+        """
+        Bring the target in line with the source in one pass.
+        Returns:
+            Number of documents copied or deleted
+        """
+        stale, removed = self.diff()
+        self.copy(stale)
+        if removed:
+            self.target.write([], removed)
+            self.deleted += len(removed)
+        return len(stale) + len(removed)
+
+    def catch_up(self, max_passes: int) -> bool:
+        """
+        Repeat sync() until a pass finds nothing to change.
+        Returns:
+            Whether the target caught up within max_passes
+        """
+        for attempt in range(1, max_passes + 1):
+            changed = self.sync()
+            logger.info(f"Pass {attempt}: {changed} documents changed")
+            if changed == 0:
+                return True
+        return False
+
+    def create_indexes(self, timeout: float) -> None:
+        """Create the vector search indexes and wait until they are queryable."""
+        desired = desired_indexes(
+            self.backend.dimensions, self.backend.prefix_dimensions
+        )
+        manager = VectorIndexManager(self.target.documents)
+        manager.apply(desired)
+        manager.wait_until_queryable(list(desired), timeout)
+
+    def verify(self, samples: int, k: int, min_recall: float) -> List[str]:
+        """
+        Compare counts, and check that sample documents are found by a query
+        made of their own opening words.
+        Returns:
+            Problems found, empty if the target is ready to switch to
+        """
+        problems = []
+        source_count = self.source.documents.count_documents({})
+        target_count = self.target.documents.count_documents({})
+        embedded = self.target.documents.count_documents(
+            {"embedding_model": self.backend.model_id}
+        )
+        if target_count != source_count:
+            problems.append(f"{target_count} documents, expected {source_count}")
+        if embedded != target_count:
+            problems.append(f"{target_count - embedded} documents without vectors")
+
+        ids = [
+            doc["document_id"]
+            for doc in self.target.documents.find({}, {"_id": 0, "document_id": 1})
+        ]
+        sample = random.sample(ids, min(samples, len(ids)))
+        contents = self.target.get_contents(sample)
+        queries = [" ".join(contents.get(i, "").split()[:32]) for i in sample]
+        found = 0
+        for document_id, vector in zip(
+            sample, self.backend.embed_documents(queries) if queries else []
+        ):
+            results = self.target.documents.aggregate(
+                [
+                    {
+                        "$vectorSearch": {
+                            "index": VECTOR_INDEX_NAME,
+                            "path": "vector_embedding",
+                            "queryVector": vector,
+                            "numCandidates": k * 10,
+                            "limit": k,
+                            "filter": {"embedding_model": self.backend.model_id},
+                        }
+                    },
+                    {"$project": {"_id": 0, "document_id": 1}},
+                ]
+            )
+            found += any(r["document_id"] == document_id for r in results)
+        recall = found / len(sample) if sample else 1.0
+        logger.info(f"Sample queries found {found}/{len(sample)} source documents")
+        if recall < min_recall:
+            problems.append(f"sample recall {recall:.2f} is below {min_recall}")
+        return problems
+
+    def record_build(self) -> None:
+        """Remember how the verified target was built, for a later switch."""
+        self.db.reindex_builds.replace_one(
+            {"_id": self.target.documents.name},
+            {
+                "source": self.pointer["collection"],
+                "settings": self.settings,
+                "verified_at": datetime.now(timezone.utc),
+            },
+            upsert=True,
+        )
+
+
+def build(mongo_client, db, args) -> None:
+    backend = create_embedding_backend(
+        args.embedding_backend,
+        model=args.embedding_model,
+        dimensions=args.embedding_dimensions,
+        prefix_dimensions=args.prefix_dimensions,
+    )
+    reindexer = Reindexer(
+        mongo_client,
+        db,
+        args.target,
+        backend,
+        args.layout,
+        args.chunk_size,
+        args.rate,
+        args.batch_size,
+    )
+    logger.info(
+        f"Building {args.target} from {reindexer.pointer['collection']} with {backend.model_id} ({args.layout} layout)"
+    )
+    reindexer.sync()
+    if not args.skip_indexes:
+        reindexer.create_indexes(args.index_timeout)
+    # Writes made while the index was building
+    if not reindexer.catch_up(args.max_passes):
+        raise RuntimeError("Target did not catch up with ongoing writes")
+
+    problems = reindexer.verify(args.samples, args.k, args.min_recall)
+    if problems:
+        for problem in problems:
+            logger.error(f"Verification failed: {problem}")
+        sys.exit(1)
+    logger.info(
+        f"{args.target} verified: {reindexer.copied} copied, {reindexer.deleted} deleted"
+    )
+    reindexer.record_build()
+    if args.no_switch:
+        logger.info(f"Not switching; run 'switch --target {args.target}' when ready")
+        return
+    switch(db, args)
+
+
+def switch(db, args) -> None:
+    build_record = db.reindex_builds.find_one({"_id": args.target})
+    if build_record is None:
+        raise ValueError(f"{args.target} has not been built and verified")
+    # Anything written to the old collection since the last pass is picked up
+    # by the watcher, which verifies every file against the new collection
+    switch_alias(db, args.target, build_record["settings"])
+
+
+def status(db) -> None:
+    pointer = resolve_alias(db)
+    previous = pointer.get("previous", {}).get("collection")
+    settings = pointer.get("settings", {})
+    print(f"documents -> {pointer['collection']}")
+    if settings:
+        print(f"  embedding: {settings.get('embedding')}")
+        print(f"  layout: {settings.get('storage_layout')}")
+        print(f"  switched at: {pointer.get('switched_at')}")
+    if previous:
+        print(f"  previous: {previous} (kept for rollback)")
+
+
+def drop(mongo_client, db, args) -> None:
+    pointer = resolve_alias(db)
+    if args.target == pointer["collection"]:
+        raise ValueError(f"{args.target} is the collection currently in use")
+    storage_for(mongo_client, db, {"collection": args.target}).drop()
+    db.reindex_builds.delete_one({"_id": args.target})
+    logger.info(f"Dropped {args.target}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the documents collection in the background and switch to it"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser(
+        "build", help="Build, verify and switch to a shadow collection"
+    )
+    build_parser.add_argument(
+        "--target",
+        default=f"documents_{datetime.now(timezone.utc):%Y%m%d%H%M%S}",
+        help="Name of the shadow collection",
+    )
+    build_parser.add_argument("--embedding-backend", help="openai or local")
+    build_parser.add_argument("--embedding-model")
+    build_parser.add_argument("--embedding-dimensions", type=int)
+    build_parser.add_argument("--prefix-dimensions", type=int)
+    build_parser.add_argument("--layout", default=STORAGE_LAYOUT)
+    build_parser.add_argument("--chunk-size", type=int, default=DOCUMENT_CHUNK_SIZE)
+    build_parser.add_argument(
+        "--rate", type=float, default=50, help="Max documents copied per second"
+    )
+    build_parser.add_argument("--batch-size", type=int, default=100)
+    build_parser.add_argument("--max-passes", type=int, default=5)
+    build_parser.add_argument(
+        "--index-timeout", type=float, default=1800, help="Seconds to wait for indexes"
+    )
+    build_parser.add_argument(
+        "--skip-indexes",
+        action="store_true",
+        help="The vector indexes were created beforehand",
+    )
+    build_parser.add_argument("--samples", type=int, default=50)
+    build_parser.add_argument("--k", type=int, default=4)
+    build_parser.add_argument("--min-recall", type=float, default=0.8)
+    build_parser.add_argument(
+        "--no-switch", action="store_true", help="Stop after verification"
+    )
+
+    switch_parser = commands.add_parser(
+        "switch", help="Point the documents alias at a verified collection"
+    )
+    switch_parser.add_argument("--target", required=True)
+    commands.add_parser("rollback", help="Point the alias back at the previous one")
+    commands.add_parser("status", help="Show where the alias points")
+    drop_parser = commands.add_parser("drop", help="Drop a collection not in use")
+    drop_parser.add_argument("--target", required=True)
+    args = parser.parse_args()
+
+    if not MONGODB_URI:
+        raise ValueError("MONGODB_URI environment variable is not set")
+    mongo_client = MongoClient(MONGODB_URI)
+    db = mongo_client.secure_rag
+
+    if args.command == "build":
+        build(mongo_client, db, args)
+    elif args.command == "switch":
+        switch(db, args)
+    elif args.command == "rollback":
+        rollback_alias(db)
+    elif args.command == "status":
+        status(db)
+    elif args.command == "drop":
+        drop(mongo_client, db, args)
+
+
+if __name__ == "__main__":
+    main()
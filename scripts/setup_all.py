@@ -1,4 +1,5 @@
 import asyncio
+import argparse
 import logging
 
 # from setup_rebac import setup_rebac_structure
@@ -10,14 +11,20 @@ from scripts.setup_rebac import setup_rebac_structure
 from scripts.setup_departments import create_department_instances
 from scripts.setup_users import assign_users_to_departments
 from scripts.sync_documents import sync_all_documents
+from scripts.reconcile import reconcile
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-async def setup_all():
+async def setup_all(reconcile_only: bool = False):
     """Run all setup scripts in order"""
+    if reconcile_only:
+        # Diff against the current Permit state and apply only what is missing
+        await reconcile()
+        return
+
     try:
         logger.info("Starting complete ReBAC setup process...")
 
@@ -41,4 +48,11 @@ async def setup_all():
 
 
 if __name__ == "__main__":
-    asyncio.run(setup_all())
+    parser = argparse.ArgumentParser(description="Set up ReBAC in Permit")
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="Only apply changes missing from the current Permit state (safe to rerun)",
+    )
+    args = parser.parse_args()
+    asyncio.run(setup_all(reconcile_only=args.reconcile))
@@ -10,6 +10,10 @@ logger = logging.getLogger(__name__)
 # Environment variables
 PERMIT_API_KEY = os.environ.get("PERMIT_API_KEY")
 PERMIT_PDP_URL = os.getenv("PERMIT_PDP_URL", "http://permit-pdp:7000")
+# Tenants hosting documents; each gets its own set of departments
+TENANTS = [
+    t.strip().lower() for t in os.getenv("TENANTS", "default").split(",") if t.strip()
+]
 
 # Department definitions
 DEPARTMENTS = [
@@ -20,7 +24,7 @@ DEPARTMENTS = [
 
 
 async def create_department_instances():
-    """Create department resource instances in Permit"""
+    """Create the tenants and their department resource instances in Permit"""
 
     # Initialize Permit client
     permit_client = Permit(token=PERMIT_API_KEY, pdp=PERMIT_PDP_URL)
@@ -28,17 +32,23 @@ async def create_department_instances():
     try:
         logger.info("Creating department instances...")
 
-        for dept in DEPARTMENTS:
-            # Create department instance
-            instance_data = {
-                "key": dept["key"],
-                "tenant": "default",
-                "resource": "department",
-                "attributes": {"name": dept["name"]},
-            }
-
-            await permit_client.api.resource_instances.create(instance_data)
-            logger.info(f"Created department instance: {dept['key']}")
+        for tenant in TENANTS:
+            # The default tenant exists in every Permit environment
+            if tenant != "default":
+                await permit_client.api.tenants.create({"key": tenant, "name": tenant})
+                logger.info(f"Created tenant: {tenant}")
+
+            for dept in DEPARTMENTS:
+                # Create department instance
+                instance_data = {
+                    "key": dept["key"],
+                    "tenant": tenant,
+                    "resource": "department",
+                    "attributes": {"name": dept["name"]},
+                }
+
+                await permit_client.api.resource_instances.create(instance_data)
+                logger.info(f"Created department instance: {tenant}/{dept['key']}")
 
         logger.info("Department instances created successfully")
 
@@ -12,6 +12,88 @@ PERMIT_API_KEY = os.environ.get("PERMIT_API_KEY")
 PERMIT_PDP_URL = os.getenv("PERMIT_PDP_URL", "http://permit-pdp:7000")
 
 
+# Desired ReBAC structure
+RESOURCES = [
+    {
+        "key": "document",
+        "name": "Document",
+        "actions": {"read": {"description": "Read the document"}},
+    },
+    {
+        "key": "department",
+        "name": "Department",
+        "actions": {"view": {"description": "View department details"}},
+    },
+]
+
+RELATIONS = [
+    (
+        "document",
+        {"key": "parent", "name": "Parent", "subject_resource": "department"},
+    ),
+]
+
+ROLES = [
+    ("department", {"key": "member", "name": "Member", "permissions": ["view"]}),
+    ("document", {"key": "reader", "name": "Reader", "permissions": ["read"]}),
+]
+
+DERIVATIONS = [
+    (
+        "document",
+        "reader",
+        {
+            "role": "member",
+            "on_resource": "department",
+            "linked_by_relation": "parent",
+        },
+    ),
+]
+
+READINESS_TIMEOUT = float(os.getenv("PERMIT_READINESS_TIMEOUT", "60"))
+READINESS_INTERVAL = float(os.getenv("PERMIT_READINESS_INTERVAL", "0.5"))
+
+
+async def wait_until(check, description, timeout=None, interval=None):
+    """
+    Poll check() until it returns True instead of sleeping for a fixed time.
+    Args:
+        check: Async function returning whether the condition holds
+        description: What is being waited for, used in logs and errors
+        timeout: Seconds to wait before giving up
+        interval: Initial seconds between polls, doubled up to 5s
+    """
+    timeout = READINESS_TIMEOUT if timeout is None else timeout
+    interval = READINESS_INTERVAL if interval is None else interval
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        try:
+            if await check():
+                logger.info(f"{description} is ready")
+                return
+        except Exception as e:
+            logger.debug(f"{description} not ready yet: {str(e)}")
+        if asyncio.get_running_loop().time() >= deadline:
+            raise TimeoutError(f"Timed out after {timeout}s waiting for {description}")
+        await asyncio.sleep(interval)
+        interval = min(interval * 2, 5)
+
+
+async def wait_for_relations(permit_client):
+    """Wait until every relation is readable, so derivations can use it."""
+
+    async def relations_ready():
+        await asyncio.gather(
+            *(
+                permit_client.api.resource_relations.get(resource, relation["key"])
+                for resource, relation in RELATIONS
+            )
+        )
+        return True
+
+    await wait_until(relations_ready, "resource relations")
+
+
 async def setup_rebac_structure():
     """Setup the ReBAC structure in Permit.io"""
 
@@ -22,61 +104,36 @@ async def setup_rebac_structure():
         # Create resource types
         logger.info("Creating resource types...")
 
-        await permit_client.api.resources.create(
-            {
-                "key": "document",
-                "name": "Document",
-                "actions": {"read": {"description": "Read the document"}},
-            }
-        )
-
-        await permit_client.api.resources.create(
-            {
-                "key": "department",
-                "name": "Department",
-                "actions": {"view": {"description": "View department details"}},
-            }
-        )
+        for resource in RESOURCES:
+            await permit_client.api.resources.create(resource)
         logger.info("✅ Resource types created successfully.")
 
         # Create resource relations
         logger.info("Creating resource relations...")
 
-        await permit_client.api.resource_relations.create(
-            "document",
-            {"key": "parent", "name": "Parent", "subject_resource": "department"},
-        )
+        for resource_key, relation in RELATIONS:
+            await permit_client.api.resource_relations.create(resource_key, relation)
 
         logger.info("✅ Resource relations created successfully.")
 
-        await asyncio.sleep(10)
+        await wait_for_relations(permit_client)
 
         # Create roles
         logger.info("Creating resource roles...")
 
-        await permit_client.api.resource_roles.create(
-            "department", {"key": "member", "name": "Member", "permissions": ["view"]}
-        )
-
-        await permit_client.api.resource_roles.create(
-            "document", {"key": "reader", "name": "Reader", "permissions": ["read"]}
-        )
+        for resource_key, role in ROLES:
+            await permit_client.api.resource_roles.create(resource_key, role)
 
         logger.info("✅ Resource roles created successfully.")
         # Setup role derivation
         logger.info("Setting up role derivations...")
 
-        derivation_rule = {
-            "role": "member",
-            "on_resource": "department",
-            "linked_by_relation": "parent",
-        }
-
-        await permit_client.api.resource_roles.create_role_derivation(
-            resource_key="document",
-            role_key="reader",
-            derivation_rule=derivation_rule,
-        )
+        for resource_key, role_key, derivation_rule in DERIVATIONS:
+            await permit_client.api.resource_roles.create_role_derivation(
+                resource_key=resource_key,
+                role_key=role_key,
+                derivation_rule=derivation_rule,
+            )
 
         logger.info("✅ Role derivation setup completed.")
 
@@ -12,7 +12,8 @@ PERMIT_API_KEY = os.environ.get("PERMIT_API_KEY")
 PERMIT_PDP_URL = os.getenv("PERMIT_PDP_URL", "http://permit-pdp:7000")
 
 
-# Sample users - you can replace this with reading from a file or database
+# Sample users - you can replace this with reading from a file or database.
+# A user may carry a "tenant" key to be a member in that tenant's department.
 USERS = [
     {"id": "user_engineering_1", "name": "Alice", "department": "engineering"},
     {"id": "user_engineering_2", "name": "Bob", "department": "engineering"},
@@ -53,7 +54,7 @@ async def assign_users_to_departments():
                         "user": user["id"],
                         "role": "member",
                         "resource_instance": f"department:{user['department']}",
-                        "tenant": "default",
+                        "tenant": user.get("tenant", "default"),
                     }
                 )
                 logger.info(
@@ -0,0 +1,93 @@
+import os
+import sys
+import argparse
+import logging
+
+from pymongo import MongoClient
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils.collection_alias import resolve_alias
+from utils.document_storage import DocumentStorage
+from utils.embedding_backends import model_id, resolve_settings
+from utils.embedding_store import EmbeddingStore
+from utils.snapshot import Snapshot, export_snapshot
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Retrieve environment variables
+MONGODB_URI = os.environ.get("MONGODB_URI")
+STORAGE_LAYOUT = os.environ.get("STORAGE_LAYOUT", "single")
+DOCUMENT_CHUNK_SIZE = int(os.environ.get("DOCUMENT_CHUNK_SIZE", "2000"))
+
+
+def open_storage(mongo_client, db, collection=None) -> tuple:
+    """Storage of the collection the documents alias points at, and its settings."""
+    pointer = resolve_alias(db)
+    settings = pointer.get("settings", {})
+    storage = DocumentStorage(
+        mongo_client,
+        db,
+        settings.get("storage_layout", STORAGE_LAYOUT),
+        settings.get("chunk_size", DOCUMENT_CHUNK_SIZE),
+        collection=collection or pointer["collection"],
+    )
+    return storage, settings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export the documents collection to a snapshot, or load one"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="Write a snapshot")
+    export_parser.add_argument("--output", required=True, help="Snapshot directory")
+    export_parser.add_argument("--batch-size", type=int, default=500)
+    import_parser = commands.add_parser("import", help="Bulk-load a snapshot")
+    import_parser.add_argument("--input", required=True, help="Snapshot directory")
+    import_parser.add_argument("--batch-size", type=int, default=500)
+    import_parser.add_argument(
+        "--skip-verify", action="store_true", help="Do not check file checksums"
+    )
+    for command in (export_parser, import_parser):
+        command.add_argument(
+            "--collection", help="Defaults to the collection the documents alias names"
+        )
+    args = parser.parse_args()
+
+    if not MONGODB_URI:
+        raise ValueError("MONGODB_URI environment variable is not set")
+    mongo_client = MongoClient(MONGODB_URI)
+    db = mongo_client.secure_rag
+    storage, settings = open_storage(mongo_client, db, args.collection)
+
+    if args.command == "export":
+        export_snapshot(storage, args.output, args.batch_size)
+        return
+
+    snapshot = Snapshot(args.input, verify=not args.skip_verify)
+    configured = resolve_settings(**settings.get("embedding", {}))
+    prefix_dimensions = configured["prefix_dimensions"]
+    if snapshot.embedding_model and snapshot.embedding_model != model_id(configured):
+        # Loaded anyway; the watcher re-embeds documents from another model
+        logger.warning(
+            f"Snapshot vectors are from {snapshot.embedding_model}, but {model_id(configured)} is configured"
+        )
+        prefix_dimensions = 0
+    storage.documents.create_index("document_id", unique=True)
+    storage.ensure_text_index()
+    embedding_store = None
+    if snapshot.embedding_model:
+        embedding_store = EmbeddingStore(db.embedding_store, snapshot.embedding_model)
+    snapshot.import_into(
+        storage,
+        embedding_store,
+        prefix_dimensions=prefix_dimensions,
+        batch_size=args.batch_size,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,8 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from utils.document_ids import generate_document_id
+from utils.permit_resources import document_instance, parent_tuple
+from utils.tenants import document_tenant
 
 
 logging.basicConfig(level=logging.INFO)
@@ -54,6 +56,7 @@ def extract_department_from_path(file_path):
 def enrich_metadata(metadata, file_path):
     """Enrich metadata with additional information."""
     enriched_metadata = metadata.copy()
+    enriched_metadata["tenant"] = document_tenant(metadata, file_path)
 
     if "department" not in enriched_metadata:
         department = extract_department_from_path(file_path)
@@ -69,41 +72,29 @@ def enrich_metadata(metadata, file_path):
     return enriched_metadata
 
 
+def normalize_path(file_path):
+    """Return file_path as seen inside the containers, e.g. /app/docs/..."""
+    if file_path.startswith("/app/"):
+        return file_path
+    # Remove './' if present and prepend '/app/'
+    return f"/app/{file_path.lstrip('./')}"
+
+
 async def sync_to_permit_rebac(document_id, metadata):
     """Sync document to Permit using ReBAC model."""
     try:
-        department = metadata.get("department", "").lower()
-
-        if not department or department not in ["engineering", "marketing", "finance"]:
-            department = "marketing"
-            logger.warning(
-                f"Department not found or invalid for {document_id}, defaulting to marketing"
-            )
-
         # 1. Create document resource instance
-        document_instance_data = {
-            "key": document_id,
-            "tenant": "default",
-            "resource": "document",
-            "attributes": {
-                "author": metadata.get("author", "unknown"),
-                "confidential": metadata.get("confidential", False),
-                "department": department,
-                "title": metadata.get("title", os.path.basename(document_id)),
-            },
-        }
+        document_instance_data = document_instance(document_id, metadata)
+        department = document_instance_data["attributes"]["department"]
 
         # Sync document instance to Permit
         await permit_client.api.resource_instances.create(document_instance_data)
         logger.info(f"Document instance {document_id} created in Permit")
 
         # 2. Create relationship tuple between department and document
-        relationship_data = {
-            "subject": f"department:{department}",
-            "relation": "parent",
-            "object": f"document:{document_id}",
-            "tenant": "default",
-        }
+        relationship_data = parent_tuple(
+            document_id, department, document_instance_data["tenant"]
+        )
 
         # Create the relationship tuple
         await permit_client.api.relationship_tuples.create(relationship_data)
@@ -121,11 +112,7 @@ async def sync_document(file_path):
     """Sync a document to Permit."""
     try:
         # Normalize file_path to match Docker container's path format for document_id generation
-        normalized_path = file_path
-        if not normalized_path.startswith("/app/"):
-            # Remove './' if present and prepend '/app/'
-            normalized_path = normalized_path.lstrip("./")
-            normalized_path = f"/app/{normalized_path}"
+        normalized_path = normalize_path(file_path)
 
         logger.info(f"Syncing document to Permit: {normalized_path}")
 
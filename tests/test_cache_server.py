@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+from app.cache import CacheServer
+
+
+@pytest.mark.parametrize("address", ["0.0.0.0:0", ":0"])
+def test_server_refuses_non_loopback_addresses(address):
+    server = CacheServer(address, max_entries=10)
+    with pytest.raises(ValueError, match="loopback"):
+        asyncio.run(server.start())
+    assert server._server is None
+
+
+def test_server_listens_on_loopback():
+    async def run():
+        server = CacheServer("127.0.0.1:0", max_entries=10)
+        await server.start()
+        server._server.close()
+        await server._server.wait_closed()
+
+    asyncio.run(run())
@@ -0,0 +1,107 @@
+from pymongo.results import BulkWriteResult
+
+from utils.document_storage import SINGLE, DocumentStorage
+from utils.embedding_backends import VECTOR_FIELDS
+from watcher.outbox import DEAD, PENDING, SyncOutbox
+from watcher.sync import DocumentSyncer
+
+
+class RecordingCollection:
+    name = "recording"
+
+    def __init__(self):
+        self.bulk_writes = []
+        self.updates = []
+
+    def create_index(self, *args, **kwargs):
+        pass
+
+    def bulk_write(self, operations, ordered=True):
+        self.bulk_writes.append(operations)
+        return BulkWriteResult({"nModified": len(operations)}, acknowledged=True)
+
+    def update_one(self, query, update, upsert=False):
+        self.updates.append((query, update))
+
+
+class RecordingOutbox:
+    def __init__(self):
+        self.enqueued = []
+        self.resolved = []
+
+    def enqueue(self, op, document_id, filepath, error):
+        self.enqueued.append(document_id)
+
+    def resolve(self, document_ids):
+        self.resolved += document_ids
+
+
+def make_syncer(collection):
+    syncer = object.__new__(DocumentSyncer)
+    syncer.collection = collection
+    db = {
+        "documents": collection,
+        "document_bodies": RecordingCollection(),
+        "document_chunks": RecordingCollection(),
+    }
+    syncer.storage = DocumentStorage(None, db, SINGLE)
+    syncer.outbox = RecordingOutbox()
+    syncer.embeddings = None
+    syncer.embedding_store = None
+    return syncer
+
+
+def test_failed_embedding_drops_the_stale_vector():
+    collection = RecordingCollection()
+    syncer = make_syncer(collection)
+    document = {
+        "document_id": "doc-1",
+        "content": "New body",
+        "content_hash": "new",
+        "metadata": {},
+    }
+    item = {"op": "upsert", "path": "doc.md", "document": document, "vector": None}
+
+    syncer.write_batch([item])
+
+    (operations,) = collection.bulk_writes
+    update = operations[0]._doc
+    assert update["$set"]["content_hash"] == "new"
+    assert set(update["$unset"]) == set(VECTOR_FIELDS)
+    assert syncer.outbox.enqueued == ["doc-1"]
+    assert syncer.outbox.resolved == []
+
+
+def test_metadata_only_write_keeps_the_vector():
+    collection = RecordingCollection()
+    syncer = make_syncer(collection)
+    document = {"document_id": "doc-1", "content": "Body", "metadata": {}}
+    item = {
+        "op": "upsert",
+        "path": "doc.md",
+        "document": document,
+        "metadata_only": True,
+    }
+
+    syncer.write_batch([item])
+
+    update = collection.bulk_writes[0][0]._doc
+    assert "$unset" not in update
+    assert "content" not in update["$set"]
+
+
+def test_fresh_failure_makes_a_dead_entry_retryable():
+    collection = RecordingCollection()
+    outbox = SyncOutbox(
+        collection, max_attempts=3, base_delay=1, max_delay=10, lease_seconds=60
+    )
+
+    outbox.enqueue("upsert", "doc-1", "doc.md", "Failed to generate embeddings")
+
+    ((query, update),) = collection.updates
+    assert query == {"_id": "doc-1"}
+    # In $set, so an existing dead entry is reset too, not just a new one
+    assert update["$set"]["state"] == PENDING != DEAD
+    assert update["$set"]["attempts"] == 0
+    assert "next_attempt_at" in update["$set"]
+    assert "state" not in update["$setOnInsert"]
@@ -0,0 +1,81 @@
+from app.adapters import MongoDBAtlasVectorSearchWithQueryTransformer
+from utils.document_storage import PREVIEW_LENGTH, SPLIT
+
+# The identifier only appears past the preview of the budget document
+BODIES = {
+    "acme-budget": "Budget overview. " * 20 + "See budget_2024 for details.",
+    "acme-plan": "Quarterly plan.",
+    "globex-budget": "Numbers are in budget_2024.",
+}
+DOCUMENTS = [
+    {
+        "_id": document_id,
+        "document_id": document_id,
+        "metadata": {"tenant": document_id.split("-")[0]},
+        "preview": body[:PREVIEW_LENGTH],
+    }
+    for document_id, body in BODIES.items()
+]
+
+
+def matches(document, query):
+    for key, condition in query.items():
+        value = document
+        for part in key.split("."):
+            value = value.get(part)
+        if isinstance(condition, dict):
+            if value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    def aggregate(self, pipeline):
+        documents = [dict(d) for d in DOCUMENTS]
+        for stage in pipeline:
+            if "$match" in stage:
+                documents = [d for d in documents if matches(d, stage["$match"])]
+        return documents
+
+
+class FakeSplitStorage:
+    """Searches whole bodies, as the chunks' text index does."""
+
+    layout = SPLIT
+
+    def __init__(self):
+        self.document_filters = []
+
+    def search_chunks(self, query, k, document_filter=None):
+        self.document_filters.append(document_filter)
+        return [
+            (document_id, 1.0)
+            for document_id, body in BODIES.items()
+            if query in body
+            and (document_filter is None or document_id in document_filter["$in"])
+        ][:k]
+
+
+class FakeVectorStore(MongoDBAtlasVectorSearchWithQueryTransformer):
+    def __init__(self, storage):
+        self._collection = FakeCollection()
+        self._text_key = "preview"
+        self._embedding_key = "vector_embedding"
+        self.storage = storage
+
+
+def test_split_layout_text_search_matches_past_the_preview():
+    storage = FakeSplitStorage()
+    vector_store = FakeVectorStore(storage)
+    pre_filter = {
+        "metadata.tenant": "acme",
+        "document_id": {"$in": ["acme-budget", "acme-plan", "globex-budget"]},
+    }
+
+    results = vector_store._chunk_text_search("budget_2024", 4, pre_filter)
+
+    # globex-budget matches too, but is outside the tenant
+    assert [doc.metadata["document_id"] for doc, _ in results] == ["acme-budget"]
+    assert storage.document_filters == [pre_filter["document_id"]]
@@ -0,0 +1,48 @@
+from watcher.pipeline import IngestPipeline
+
+
+class FailingEmbedSyncer:
+    """Syncer whose embedding step raises, like an unreachable embedding store."""
+
+    embeddings = None
+
+    def __init__(self):
+        self.written = []
+
+    def get_stored_hashes(self, document_id):
+        return None
+
+    def embed_batch(self, documents):
+        raise ConnectionError("embedding store unreachable")
+
+    def write_batch(self, items):
+        self.written += items
+
+
+def test_failed_embedding_batch_is_written_without_vectors(tmp_path):
+    paths = []
+    for name in ["a", "b"]:
+        path = tmp_path / f"{name}.md"
+        path.write_text(f"---\ntitle: {name}\n---\nBody {name}\n", encoding="utf-8")
+        paths.append(str(path))
+    syncer = FailingEmbedSyncer()
+    pipeline = IngestPipeline(
+        syncer,
+        parse_workers=1,
+        embed_concurrency=1,
+        write_batch_size=10,
+        write_interval=0.01,
+        queue_size=10,
+    )
+    pipeline.start()
+    try:
+        # The second file only gets through if the embed worker survived
+        for path in paths:
+            pipeline.submit(path, "upsert")
+            pipeline.wait_until_idle()
+    finally:
+        pipeline.stop()
+
+    assert sorted(item["path"] for item in syncer.written) == paths
+    assert all(item["vector"] is None for item in syncer.written)
+    assert pipeline.stage_stats["embed"].errors == 2
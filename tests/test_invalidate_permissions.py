@@ -0,0 +1,45 @@
+from fastapi.testclient import TestClient
+
+from app import main
+
+
+class RecordingCaches:
+    def __init__(self):
+        self.invalidated = []
+
+    async def invalidate(self, *args):
+        self.invalidated.append(args)
+
+
+def test_invalidation_requires_the_admin_token(monkeypatch):
+    caches = RecordingCaches()
+    snapshots = RecordingCaches()
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(main, "permission_caches", caches)
+    monkeypatch.setattr(main, "permission_snapshots", snapshots)
+    # Without the context manager the lifespan, and its clients, never start
+    client = TestClient(main.app)
+    body = {"user_id": "user_finance_1", "tenant": "acme"}
+
+    assert client.post("/invalidate-permissions", json=body).status_code == 401
+    response = client.post(
+        "/invalidate-permissions", json=body, headers={"X-Admin-Token": "wrong"}
+    )
+    assert response.status_code == 401
+    assert caches.invalidated == []
+
+    response = client.post(
+        "/invalidate-permissions", json=body, headers={"X-Admin-Token": "s3cret"}
+    )
+    assert response.status_code == 200
+    assert caches.invalidated == [("acme", "user_finance_1")]
+    assert snapshots.invalidated == [()]
+
+
+def test_invalidation_is_disabled_without_an_admin_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    client = TestClient(main.app)
+    response = client.post(
+        "/invalidate-permissions", json={}, headers={"X-Admin-Token": ""}
+    )
+    assert response.status_code == 401
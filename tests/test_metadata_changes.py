@@ -0,0 +1,86 @@
+from watcher.permit_sync import PermitSync
+from watcher.pipeline import IngestPipeline
+
+BODY = "Quarterly budget review."
+
+
+class FakeSyncer:
+    """Stores written documents in memory, as the pipeline sees MongoDB."""
+
+    embeddings = None
+
+    def __init__(self):
+        self.documents = {}
+        self.embedded = []
+
+    def get_stored_hashes(self, document_id):
+        document = self.documents.get(document_id)
+        if document is None:
+            return None
+        return {
+            "content_hash": document["content_hash"],
+            "metadata_hash": document["metadata_hash"],
+        }
+
+    def embed_batch(self, documents):
+        self.embedded += [document["document_id"] for document in documents]
+        return [[0.1, 0.2] for _ in documents]
+
+    def write_batch(self, items):
+        for item in items:
+            document = dict(item["document"])
+            if item.get("metadata_only"):
+                document.pop("content", None)
+            self.documents.setdefault(document["document_id"], {}).update(document)
+
+
+class RecordingPermitSync(PermitSync):
+    def __init__(self):
+        self.errors = 0
+        self.changes = []
+
+    async def apply(self, changes):
+        self.changes += changes
+
+
+def write_note(path, department):
+    path.write_text(
+        f"---\ntitle: Budget\ndepartment: {department}\n---\n{BODY}\n",
+        encoding="utf-8",
+    )
+
+
+def test_frontmatter_only_edit_is_written_and_synced_to_permit(tmp_path):
+    note = tmp_path / "budget.md"
+    write_note(note, "finance")
+    syncer = FakeSyncer()
+    permit_sync = RecordingPermitSync()
+    pipeline = IngestPipeline(
+        syncer,
+        parse_workers=1,
+        embed_concurrency=1,
+        write_batch_size=10,
+        write_interval=0.01,
+        queue_size=10,
+        permit_sync=permit_sync,
+    )
+    pipeline.start()
+    try:
+        pipeline.submit(str(note), "upsert")
+        pipeline.wait_until_idle()
+        (document_id,) = syncer.documents
+        assert syncer.embedded == [document_id]
+
+        write_note(note, "hr")
+        pipeline.submit(str(note), "upsert")
+        pipeline.wait_until_idle()
+    finally:
+        pipeline.stop()
+
+    stored = syncer.documents[document_id]
+    assert stored["metadata"]["department"] == "hr"
+    assert stored["content"] == BODY
+    # The body is unchanged, so its vector is kept
+    assert syncer.embedded == [document_id]
+    departments = [change["metadata"]["department"] for change in permit_sync.changes]
+    assert departments == ["finance", "hr"]
@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+from utils.tenants import DEFAULT_TENANT
+from watcher.permit_sync import PERMIT_PAGE_SIZE, PermitSync
+
+
+class FakeTuples:
+    """Parent tuples in Permit, listed page by page."""
+
+    def __init__(self, parents):
+        self.tuples = [
+            SimpleNamespace(
+                subject=f"department:{department}",
+                object=f"document:{document_id}",
+                tenant=DEFAULT_TENANT,
+            )
+            for document_id, department in parents.items()
+        ]
+        self.list_calls = 0
+        self.deleted = []
+        self.created = []
+
+    async def list(self, page=1, per_page=100, relation_key=None, object_key=None):
+        self.list_calls += 1
+        return self.tuples[(page - 1) * per_page : page * per_page]
+
+    async def bulk_delete(self, tuples):
+        self.deleted += tuples
+
+    async def bulk_create(self, tuples):
+        self.created += tuples
+
+
+class FakeInstances:
+    async def bulk_replace(self, instances):
+        pass
+
+    async def bulk_delete(self, instances):
+        pass
+
+
+class FakeStateCollection:
+    def __init__(self):
+        self.writes = []
+
+    def find(self, query):
+        return []
+
+    def bulk_write(self, operations, ordered=True):
+        self.writes += operations
+
+
+def test_documents_without_state_read_their_parents_in_bulk():
+    count = PERMIT_PAGE_SIZE * 2 + 50
+    tuples = FakeTuples({f"doc-{i}": "finance" for i in range(count)})
+    api = SimpleNamespace(
+        relationship_tuples=tuples, resource_instances=FakeInstances()
+    )
+    permit_sync = PermitSync(
+        SimpleNamespace(api=api),
+        documents=None,
+        state_collection=FakeStateCollection(),
+        outbox=None,
+        batch_size=100,
+        rate=0,
+    )
+    # The first document moved department since the one-shot sync
+    changes = [
+        {
+            "op": "upsert",
+            "document_id": f"doc-{i}",
+            "path": f"doc-{i}.md",
+            "metadata": {"department": "engineering" if i == 0 else "finance"},
+        }
+        for i in range(count)
+    ]
+
+    async def run():
+        await permit_sync.apply(changes[:100])
+        await permit_sync.apply(changes[100:])
+
+    asyncio.run(run())
+
+    # One pass over the pages, not one lookup per document
+    assert tuples.list_calls == 3
+    assert tuples.deleted == [
+        {
+            "subject": "department:finance",
+            "relation": "parent",
+            "object": "document:doc-0",
+        }
+    ]
+    assert [t["object"] for t in tuples.created] == ["document:doc-0"]
+    assert permit_sync._parents == {}
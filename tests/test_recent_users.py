@@ -0,0 +1,34 @@
+import asyncio
+
+from app import permissions
+from app.permissions import RecentUsers
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.updated = []
+
+    def update_one(self, query, update, upsert=False):
+        self.updated.append(query["_id"])
+
+
+def test_touches_are_throttled_and_forgotten_after_the_interval(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(permissions.time, "monotonic", lambda: clock[0])
+    recent_users = RecentUsers(touch_interval=30)
+    recent_users.collection = RecordingCollection()
+
+    async def run():
+        for user in range(1000):
+            recent_users.touch(f"user_{user}", "acme")
+        recent_users.touch("user_0", "acme")
+        assert len(recent_users._last_touch) == 1000
+
+        clock[0] += 31
+        recent_users.touch("user_0", "acme")
+        # Let the executor writes finish
+        await asyncio.get_running_loop().run_in_executor(None, lambda: None)
+
+    asyncio.run(run())
+    assert len(recent_users._last_touch) == 1
+    assert recent_users.collection.updated.count("acme:user_0") == 2
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from permit.exceptions import PermitConnectionError
+
+from app.admission import StageLimiter
+from app.resilience import (
+    CircuitOpenError,
+    Deadline,
+    DeadlineExceeded,
+    StageGuard,
+    current_deadline,
+    is_dependency_failure,
+)
+
+
+def pdp_status_error(status):
+    return PermitConnectionError(
+        f"Permit.getUserPermissions() got an unexpected status code: {status}, "
+        "please check your SDK init"
+    )
+
+
+def make_guard():
+    return StageGuard(StageLimiter({"pdp": 4}), failure_threshold=3, reset_timeout=60)
+
+
+async def call_failing(guard, error):
+    with pytest.raises(type(error)):
+        async with guard.stage("pdp"):
+            raise error
+
+
+def test_client_errors_do_not_open_the_breaker():
+    guard = make_guard()
+
+    async def run():
+        for _ in range(10):
+            await call_failing(guard, pdp_status_error(404))
+        async with guard.stage("pdp"):
+            pass
+
+    asyncio.run(run())
+    assert guard.breakers["pdp"].state == "closed"
+
+
+def test_server_and_transport_errors_open_the_breaker():
+    guard = make_guard()
+
+    async def run():
+        await call_failing(guard, pdp_status_error(503))
+        await call_failing(guard, ConnectionRefusedError())
+        await call_failing(guard, PermitConnectionError("cannot connect to the PDP"))
+        with pytest.raises(CircuitOpenError):
+            async with guard.stage("pdp"):
+                pass
+
+    asyncio.run(run())
+    assert guard.breakers["pdp"].state == "open"
+
+
+def test_wrapped_errors_are_classified_by_their_cause():
+    try:
+        try:
+            raise ConnectionResetError()
+        except ConnectionResetError as e:
+            raise RuntimeError("query failed") from e
+    except RuntimeError as e:
+        assert is_dependency_failure(e)
+    assert not is_dependency_failure(ValueError("bad filter"))
+
+
+def test_client_timeouts_with_budget_left_are_dependency_failures():
+    guard = make_guard()
+
+    async def run():
+        current_deadline.set(Deadline(60))
+        # Not reported as the request's deadline
+        await call_failing(guard, TimeoutError("read timed out"))
+
+    asyncio.run(run())
+    assert guard.breakers["pdp"].failures == 1
+
+
+def test_running_out_of_budget_exceeds_the_deadline():
+    guard = make_guard()
+
+    async def run():
+        current_deadline.set(Deadline(0.01))
+        with pytest.raises(DeadlineExceeded):
+            async with guard.stage("pdp"):
+                await asyncio.sleep(1)
+
+    asyncio.run(run())
+    assert guard.breakers["pdp"].failures == 1
@@ -0,0 +1,99 @@
+import asyncio
+
+from langchain_core.documents import Document
+from langchain_core.language_models import FakeListLLM
+from langchain_core.runnables import RunnableLambda
+from langchain_core.structured_query import StructuredQuery
+
+from app.adapters import (
+    MongoDBAtlasVectorSearchWithQueryTransformer,
+    PermitSelfQueryRetrieverWithPermissions,
+)
+
+CORPUS = [
+    {"document_id": "acme-plan", "metadata": {"tenant": "acme"}},
+    {"document_id": "acme-budget", "metadata": {"tenant": "acme"}},
+    {"document_id": "globex-plan", "metadata": {"tenant": "globex"}},
+    {"document_id": "globex-budget", "metadata": {"tenant": "globex"}},
+]
+
+
+def matches(document, pre_filter):
+    if document["metadata"]["tenant"] != pre_filter.get("metadata.tenant"):
+        return False
+    return document["document_id"] in pre_filter["document_id"]["$in"]
+
+
+class FakeVectorStore(MongoDBAtlasVectorSearchWithQueryTransformer):
+    """Searches CORPUS with the pre-filter it is given, without Atlas."""
+
+    def __init__(self):
+        self.searches = []
+
+    async def _avector_search_with_score(self, query, k, pre_filter, **kwargs):
+        self.searches.append(pre_filter)
+        # Let the other request run between building and using the filter
+        await asyncio.sleep(0.01)
+        return [
+            (Document(page_content=d["document_id"], metadata=d), 1.0)
+            for d in CORPUS
+            if matches(d, pre_filter)
+        ][:k]
+
+
+def make_retriever(vector_store, user_id, tenant, allowed_ids, delay):
+    retriever = PermitSelfQueryRetrieverWithPermissions.from_permissions(
+        permit_client=None,
+        user={"key": user_id},
+        permissions={
+            f"document:{document_id}": {"permissions": ["document:read"]}
+            for document_id in allowed_ids
+        },
+        resource_type="document",
+        action="read",
+        llm=FakeListLLM(responses=["unused"]),
+        vectorstore=vector_store,
+        tenant=tenant,
+    )
+
+    async def construct(inputs):
+        # Stands in for the self-query LLM call, which awaits before the
+        # filter is built
+        await asyncio.sleep(delay)
+        return StructuredQuery(query=inputs["query"], filter=None, limit=None)
+
+    retriever.query_constructor = RunnableLambda(construct)
+    return retriever
+
+
+def test_interleaved_queries_keep_their_own_tenant_and_documents():
+    vector_store = FakeVectorStore()
+    acme = make_retriever(
+        vector_store, "alice", "acme", ["acme-plan", "acme-budget"], 0.03
+    )
+    # Allowed IDs from another tenant must not match either
+    globex = make_retriever(
+        vector_store, "bob", "globex", ["globex-plan", "acme-plan"], 0.0
+    )
+
+    async def run():
+        return await asyncio.gather(acme.invoke("plan"), globex.invoke("plan"))
+
+    acme_docs, globex_docs = asyncio.run(run())
+
+    assert {d.metadata["document_id"] for d in acme_docs} == {
+        "acme-plan",
+        "acme-budget",
+    }
+    assert {d.metadata["document_id"] for d in globex_docs} == {"globex-plan"}
+    assert {f["metadata.tenant"] for f in vector_store.searches} == {"acme", "globex"}
+
+
+def test_no_allowed_ids_matches_nothing():
+    vector_store = FakeVectorStore()
+    retriever = make_retriever(vector_store, "carol", "acme", [], 0.0)
+
+    assert asyncio.run(retriever.invoke("plan")) == []
+    assert vector_store.searches == [
+        {"metadata.tenant": "acme", "document_id": {"$in": []}}
+    ]
@@ -0,0 +1,112 @@
+import gzip
+import json
+import os
+
+import numpy as np
+
+from utils.snapshot import (
+    COLUMNS,
+    CONTENTS_FILE,
+    DOCUMENTS_FILE,
+    MANIFEST_FILE,
+    SNAPSHOT_VERSION,
+    VECTORS_FILE,
+    Snapshot,
+)
+from watcher.pipeline import IngestPipeline
+from watcher.utils import prepare_document
+
+
+class RecordingStorage:
+    documents = type("Collection", (), {"name": "documents"})()
+
+    def __init__(self):
+        self.written = {}
+
+    def write(self, upserts, deleted_ids):
+        for document in upserts:
+            self.written[document["document_id"]] = dict(document)
+
+
+class ImportedSyncer:
+    """Sees the imported documents, as the watcher would in MongoDB."""
+
+    embeddings = None
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.writes = []
+
+    def get_stored_hashes(self, document_id):
+        document = self.documents.get(document_id)
+        if document is None:
+            return None
+        return {
+            "content_hash": document["content_hash"],
+            "metadata_hash": document.get("metadata_hash"),
+        }
+
+    def embed_batch(self, documents):
+        return [[0.5, 0.5] for _ in documents]
+
+    def write_batch(self, items):
+        self.writes += items
+
+
+def write_snapshot(path, document, vector):
+    """A one-document snapshot, as export_snapshot writes it."""
+    os.makedirs(path)
+    columns = {column: [document[column]] for column in COLUMNS[:-1]}
+    columns["row"] = [0]
+    with gzip.open(os.path.join(path, DOCUMENTS_FILE), "wt", encoding="utf-8") as f:
+        json.dump(columns, f)
+    with gzip.open(os.path.join(path, CONTENTS_FILE), "wt", encoding="utf-8") as f:
+        body = {
+            "content_hash": document["content_hash"],
+            "content": document["content"],
+            "embedded": True,
+        }
+        f.write(json.dumps(body) + "\n")
+    with open(os.path.join(path, VECTORS_FILE), "wb") as f:
+        f.write(np.asarray(vector, dtype="<f4").tobytes())
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "embedding_backend": "local",
+        "embedding_model": "local:hashing:2",
+        "dimensions": len(vector),
+        "documents": 1,
+        "rows": 1,
+        "checksums": {},
+    }
+    with open(os.path.join(path, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+
+
+def test_imported_documents_are_unchanged_for_the_watcher(tmp_path):
+    note = tmp_path / "plan.md"
+    note.write_text(
+        "---\ntitle: Plan\ndepartment: finance\nconfidential: true\n---\nQ3 plan.\n",
+        encoding="utf-8",
+    )
+    write_snapshot(str(tmp_path / "snapshot"), prepare_document(str(note)), [0.6, 0.8])
+
+    storage = RecordingStorage()
+    Snapshot(str(tmp_path / "snapshot"), verify=False).import_into(storage)
+    syncer = ImportedSyncer(storage.written)
+    pipeline = IngestPipeline(
+        syncer,
+        parse_workers=1,
+        embed_concurrency=1,
+        write_batch_size=10,
+        write_interval=0.01,
+        queue_size=10,
+    )
+    pipeline.start()
+    try:
+        pipeline.submit(str(note), "upsert")
+        pipeline.wait_until_idle()
+    finally:
+        pipeline.stop()
+
+    assert syncer.writes == []
+    assert pipeline.stage_stats["parse"].skipped == 1
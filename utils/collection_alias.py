@@ -0,0 +1,115 @@
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ALIASES_COLLECTION = "collection_aliases"
+DOCUMENTS_ALIAS = "documents"
+
+
+def resolve_alias(db, alias: str = DOCUMENTS_ALIAS) -> Dict[str, Any]:
+    """
+    Return the pointer document of an alias. Without one, the alias names
+    the collection itself, configured from the environment as before.
+    """
+    pointer = db[ALIASES_COLLECTION].find_one({"_id": alias})
+    return pointer or {"_id": alias, "collection": alias}
+
+
+def switch_alias(
+    db, collection: str, settings: Dict[str, Any], alias: str = DOCUMENTS_ALIAS
+) -> Dict[str, Any]:
+    """
+    Point an alias at a collection, remembering the current one for rollback.
+    Args:
+        db: Database holding the collections
+        collection: Collection the alias should name
+        settings: How the collection was built, e.g. its embedding backend and
+            storage layout, so readers and writers can follow it
+        alias: Alias to switch
+    Returns:
+        The new pointer document
+    """
+    current = resolve_alias(db, alias)
+    if current["collection"] == collection:
+        raise ValueError(f"{alias} already points at {collection}")
+    pointer = {
+        "collection": collection,
+        "settings": settings,
+        "previous": {
+            "collection": current["collection"],
+            "settings": current.get("settings", {}),
+        },
+        "switched_at": datetime.now(timezone.utc),
+    }
+    db[ALIASES_COLLECTION].update_one({"_id": alias}, {"$set": pointer}, upsert=True)
+    logger.info(f"Switched {alias} from {current['collection']} to {collection}")
+    return {"_id": alias, **pointer}
+
+
+def rollback_alias(db, alias: str = DOCUMENTS_ALIAS) -> Dict[str, Any]:
+    """
+    Point an alias back at its previous collection. Rolling back twice
+    returns to where it started.
+    """
+    previous = resolve_alias(db, alias).get("previous")
+    if not previous:
+        raise ValueError(f"{alias} has no previous collection to roll back to")
+    return switch_alias(db, previous["collection"], previous["settings"], alias)
+
+
+class AliasFollower:
+    """
+    Poll an alias pointer and report when it moves.
+
+    Reindexing switches readers and writers to a new collection by updating a
+    single pointer document. Processes follow it within one poll interval
+    without a restart of the whole stack or a change stream, which would need
+    a replica set.
+    """
+
+    def __init__(
+        self,
+        db,
+        on_switch: Callable[[Dict[str, Any]], None],
+        interval: float,
+        alias: str = DOCUMENTS_ALIAS,
+        current: Optional[str] = None,
+    ):
+        """
+        Args:
+            db: Database holding the alias pointers
+            on_switch: Called with the new pointer when the alias moves
+            interval: Min seconds between polls in poll()
+            alias: Alias to follow
+            current: Collection currently in use, resolved now if not given
+        """
+        self.db = db
+        self.on_switch = on_switch
+        self.interval = interval
+        self.alias = alias
+        self.current = current or resolve_alias(db, alias)["collection"]
+        self._next_poll = time.monotonic() + interval
+
+    def check(self) -> bool:
+        """Read the pointer, calling on_switch if the alias moved."""
+        pointer = resolve_alias(self.db, self.alias)
+        if pointer["collection"] == self.current:
+            return False
+        logger.info(f"{self.alias} now points at {pointer['collection']}")
+        self.on_switch(pointer)
+        self.current = pointer["collection"]
+        return True
+
+    def poll(self) -> bool:
+        """check(), at most once per interval; errors are logged, not raised."""
+        if time.monotonic() < self._next_poll:
+            return False
+        self._next_poll = time.monotonic() + self.interval
+        try:
+            return self.check()
+        except Exception as e:
+            logger.error(f"Error following {self.alias}: {str(e)}")
+            return False
@@ -1,18 +1,34 @@
 import os
 import hashlib
+import json
+from typing import Any, Dict
 
 
-def generate_document_id(file_path: str) -> str:
+def relative_document_path(file_path: str) -> str:
+    """Path of a document relative to the docs root's parent, e.g. docs/a/b.md"""
     # Remove container path prefix if present
     if file_path.startswith("/app/"):
         file_path = file_path.replace("/app/", "", 1)
+    return file_path if file_path.startswith("docs/") else f"docs/{file_path}"
+
 
+def generate_document_id(file_path: str) -> str:
     file_name = os.path.basename(file_path)
     name = os.path.splitext(file_name)[0]
 
-    relative_path = file_path if file_path.startswith("docs/") else f"docs/{file_path}"
-    relative_path = relative_path.lower()
+    relative_path = relative_document_path(file_path).lower()
 
     hash_part = hashlib.md5(relative_path.encode()).hexdigest()[:8]
 
     return f"{name}_{hash_part}"
+
+
+def compute_metadata_hash(document: Dict[str, Any]) -> str:
+    """
+    Hash of the fields synced to MongoDB and Permit besides the body, so a
+    frontmatter-only edit (department, confidential, tenant) is not skipped.
+    """
+    synced = {key: document[key] for key in ("filename", "filepath", "metadata")}
+    return hashlib.md5(
+        json.dumps(synced, sort_keys=True, default=str).encode()
+    ).hexdigest()
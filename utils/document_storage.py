@@ -0,0 +1,340 @@
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+SINGLE = "single"
+SPLIT = "split"
+LAYOUTS = (SINGLE, SPLIT)
+PREVIEW_LENGTH = 200
+# Full-text index hybrid search queries with $text
+TEXT_INDEX_NAME = "text_index"
+# Matches on file names, which often carry identifiers, rank higher
+TEXT_INDEX_WEIGHTS = {"filename": 5, "text": 1}
+
+
+def companion_names(collection: str) -> Tuple[str, str]:
+    """Names of the bodies and chunks collections of a documents collection."""
+    if collection == "documents":
+        return "document_bodies", "document_chunks"
+    return f"{collection}_bodies", f"{collection}_chunks"
+
+
+def chunk_text(content: str, size: int) -> List[str]:
+    """
+    Split content into chunks of at most size characters, breaking between
+    paragraphs where possible.
+    """
+    chunks, current = [], ""
+    for paragraph in content.split("\n\n"):
+        while len(paragraph) > size:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(paragraph[:size])
+            paragraph = paragraph[size:]
+        candidate = f"{current}\n\n{paragraph}" if current else paragraph
+        if len(candidate) > size:
+            chunks.append(current)
+            current = paragraph
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+@dataclass
+class WriteResult:
+    upserted_count: int = 0
+    modified_count: int = 0
+    deleted_count: int = 0
+
+
+def _upsert(document: Dict[str, Any], unset: Dict[str, Sequence[str]]) -> UpdateOne:
+    update: Dict[str, Any] = {"$set": document}
+    fields = unset.get(document["document_id"])
+    if fields:
+        update["$unset"] = {field: "" for field in fields}
+    return UpdateOne({"document_id": document["document_id"]}, update, upsert=True)
+
+
+class DocumentStorage:
+    """
+    Where document records live in MongoDB.
+
+    The single layout keeps everything, body included, in the documents
+    collection. The split layout keeps the documents collection lean, holding
+    only what search and access filters read: the ID, metadata, hash, vectors
+    and a short preview. Full bodies go to document_bodies and their chunks to
+    document_chunks. Scans and vector searches then only touch small records,
+    so the hot working set stays in memory as the corpus grows. Split writes
+    to the three collections are applied in one transaction.
+    """
+
+    def __init__(
+        self,
+        mongo_client,
+        db,
+        layout: str,
+        chunk_size: int = 2000,
+        collection: str = "documents",
+    ):
+        """
+        Args:
+            mongo_client: MongoClient, used to start transactions
+            db: Database holding the collections
+            layout: "single" or "split"
+            chunk_size: Max characters per body chunk in the split layout
+            collection: Name of the searchable documents collection
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(
+                f"Unknown storage layout {layout}, expected one of {LAYOUTS}"
+            )
+        self.mongo_client = mongo_client
+        self.layout = layout
+        self.chunk_size = chunk_size
+        bodies, chunks = companion_names(collection)
+        self.documents = db[collection]
+        self.bodies = db[bodies]
+        self.chunks = db[chunks]
+        if layout == SPLIT:
+            self.chunks.create_index("document_id")
+
+    @property
+    def text_key(self) -> str:
+        """Field of the documents collection holding searchable text."""
+        return "preview" if self.layout == SPLIT else "content"
+
+    def ensure_text_index(self) -> None:
+        """
+        Create the text index over filename and text_key, replacing one left
+        on the other layout's text field by a migration. In the split layout,
+        where text_key only holds a preview, the chunks get a text index over
+        their text too, for search_chunks().
+        """
+        if self.layout == SPLIT:
+            self.chunks.create_index([("text", "text")], name=TEXT_INDEX_NAME)
+        weights = {
+            "filename": TEXT_INDEX_WEIGHTS["filename"],
+            self.text_key: TEXT_INDEX_WEIGHTS["text"],
+        }
+        existing = self.documents.index_information().get(TEXT_INDEX_NAME)
+        # Text indexes list their fields under weights rather than key
+        if existing is not None and dict(existing.get("weights", {})) != weights:
+            logger.info(f"Rebuilding {TEXT_INDEX_NAME} over {sorted(weights)}")
+            self.documents.drop_index(TEXT_INDEX_NAME)
+        self.documents.create_index(
+            [(field, "text") for field in weights],
+            name=TEXT_INDEX_NAME,
+            weights=weights,
+        )
+
+    def search_chunks(
+        self, query: str, k: int, document_filter: Optional[Any] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Full-text search over whole bodies in the split layout: documents
+        with a chunk matching query, by the text score of their best chunk.
+        Args:
+            query: $text search string
+            k: Max documents
+            document_filter: Condition on document_id, e.g. {"$in": ids}
+        Returns:
+            (document ID, score) pairs, best first
+        """
+        match: Dict[str, Any] = {"$text": {"$search": query}}
+        if document_filter is not None:
+            match["document_id"] = document_filter
+        pipeline = [
+            {"$match": match},
+            {"$set": {"score": {"$meta": "textScore"}}},
+            {"$group": {"_id": "$document_id", "score": {"$max": "$score"}}},
+            {"$sort": {"score": -1, "_id": 1}},
+            {"$limit": k},
+        ]
+        return [(row["_id"], row["score"]) for row in self.chunks.aggregate(pipeline)]
+
+    def write(
+        self,
+        upserts: List[Dict[str, Any]],
+        deleted_ids: List[str],
+        unset: Optional[Dict[str, Sequence[str]]] = None,
+    ) -> WriteResult:
+        """
+        Upsert and delete documents in bulk.
+        Args:
+            upserts: Fields to set on each document, including "document_id"
+                and, when the body changed, "content"
+            deleted_ids: IDs of documents to delete
+            unset: Fields to remove, by document ID of the upsert
+        """
+        unset = unset or {}
+        if self.layout == SINGLE:
+            operations = [_upsert(d, unset) for d in upserts] + [
+                DeleteOne({"document_id": i}) for i in deleted_ids
+            ]
+            if not operations:
+                return WriteResult()
+            result = self.documents.bulk_write(operations, ordered=False)
+            return WriteResult(
+                result.upserted_count, result.modified_count, result.deleted_count
+            )
+        return self._write_split(upserts, deleted_ids, unset)
+
+    def _write_split(
+        self,
+        upserts: List[Dict[str, Any]],
+        deleted_ids: List[str],
+        unset: Dict[str, Sequence[str]],
+    ) -> WriteResult:
+        now = datetime.now(timezone.utc)
+        document_ops, body_ops, chunk_ops = [], [], []
+        for upsert in upserts:
+            document = dict(upsert)
+            document_id = document["document_id"]
+            content = document.pop("content", None)
+            if content is not None:
+                document["preview"] = content[:PREVIEW_LENGTH]
+                document["content_length"] = len(content)
+                body_ops.append(
+                    ReplaceOne(
+                        {"_id": document_id},
+                        {
+                            "content": content,
+                            "content_hash": document.get("content_hash"),
+                            "updated_at": now,
+                        },
+                        upsert=True,
+                    )
+                )
+                chunk_ops.append(DeleteMany({"document_id": document_id}))
+                chunk_ops += [
+                    InsertOne(
+                        {
+                            "_id": f"{document_id}:{index:05d}",
+                            "document_id": document_id,
+                            "index": index,
+                            "text": text,
+                            "content_hash": document.get("content_hash"),
+                        }
+                    )
+                    for index, text in enumerate(chunk_text(content, self.chunk_size))
+                ]
+            document_ops.append(_upsert(document, unset))
+        for document_id in deleted_ids:
+            document_ops.append(DeleteOne({"document_id": document_id}))
+            body_ops.append(DeleteOne({"_id": document_id}))
+            chunk_ops.append(DeleteMany({"document_id": document_id}))
+
+        results = {}
+
+        def apply(session) -> None:
+            # Chunk replacement deletes before inserting, so it must be ordered
+            if chunk_ops:
+                self.chunks.bulk_write(chunk_ops, ordered=True, session=session)
+            if body_ops:
+                self.bodies.bulk_write(body_ops, ordered=False, session=session)
+            if document_ops:
+                results["documents"] = self.documents.bulk_write(
+                    document_ops, ordered=False, session=session
+                )
+
+        with self.mongo_client.start_session() as session:
+            session.with_transaction(apply)
+        result = results.get("documents")
+        if result is None:
+            return WriteResult()
+        return WriteResult(
+            result.upserted_count, result.modified_count, result.deleted_count
+        )
+
+    def drop(self) -> None:
+        """Drop the documents collection with its bodies and chunks."""
+        for collection in (self.documents, self.bodies, self.chunks):
+            collection.drop()
+
+    def get_contents(self, document_ids: List[str]) -> Dict[str, str]:
+        """Return the full bodies of documents by ID."""
+        if self.layout == SPLIT:
+            return self._split_contents(document_ids)
+        cursor = self.documents.find(
+            {"document_id": {"$in": document_ids}},
+            {"_id": 0, "document_id": 1, "content": 1},
+        )
+        return {doc["document_id"]: doc.get("content", "") for doc in cursor}
+
+    def migrate(self, batch_size: int = 200) -> int:
+        """
+        Move bodies to match the configured layout, for documents written
+        under the other one. Safe to run repeatedly.
+        Returns:
+            Number of documents moved
+        """
+        moved = 0
+        if self.layout == SPLIT:
+            while True:
+                batch = list(
+                    self.documents.find(
+                        {"content": {"$exists": True}},
+                        {"document_id": 1, "content": 1, "content_hash": 1},
+                    ).limit(batch_size)
+                )
+                if not batch:
+                    break
+                self._write_split(
+                    [
+                        {
+                            "document_id": doc["document_id"],
+                            "content": doc["content"],
+                            "content_hash": doc.get("content_hash"),
+                        }
+                        for doc in batch
+                    ],
+                    [],
+                )
+                self.documents.update_many(
+                    {"document_id": {"$in": [doc["document_id"] for doc in batch]}},
+                    {"$unset": {"content": ""}},
+                )
+                moved += len(batch)
+        else:
+            while True:
+                batch = list(
+                    self.documents.find(
+                        {"content": {"$exists": False}, "preview": {"$exists": True}},
+                        {"document_id": 1},
+                    ).limit(batch_size)
+                )
+                if not batch:
+                    break
+                ids = [doc["document_id"] for doc in batch]
+                contents = self._split_contents(ids)
+                self.documents.bulk_write(
+                    [
+                        UpdateOne(
+                            {"document_id": document_id},
+                            {
+                                "$set": {"content": contents.get(document_id, "")},
+                                "$unset": {"preview": "", "content_length": ""},
+                            },
+                        )
+                        for document_id in ids
+                    ],
+                    ordered=False,
+                )
+                self.bodies.delete_many({"_id": {"$in": ids}})
+                self.chunks.delete_many({"document_id": {"$in": ids}})
+                moved += len(batch)
+        if moved:
+            logger.info(f"Moved {moved} document bodies to the {self.layout} layout")
+        return moved
+
+    def _split_contents(self, document_ids: List[str]) -> Dict[str, str]:
+        cursor = self.bodies.find({"_id": {"$in": document_ids}}, {"content": 1})
+        return {doc["_id"]: doc["content"] for doc in cursor}
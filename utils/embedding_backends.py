@@ -0,0 +1,230 @@
+import logging
+import math
+import os
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "openai")
+# Also store a truncated prefix of each vector for two-stage search (0 disables)
+EMBEDDING_PREFIX_DIMENSIONS = int(os.environ.get("EMBEDDING_PREFIX_DIMENSIONS", "0"))
+
+# Document fields written by EmbeddingBackend.vector_fields
+VECTOR_FIELDS = (
+    "vector_embedding",
+    "vector_prefix",
+    "embedding_backend",
+    "embedding_model",
+)
+
+# Defaults per backend, each overridable with EMBEDDING_MODEL,
+# EMBEDDING_DIMENSIONS and EMBEDDING_BATCH_SIZE
+BACKEND_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "openai": {
+        "model": "text-embedding-ada-002",
+        "dimensions": 1536,
+        "batch_size": 100,
+    },
+    "local": {"model": "hashing", "dimensions": 256, "batch_size": 512},
+}
+
+
+def truncate_vector(vector: List[float], dimensions: int) -> List[float]:
+    """
+    Return the first dimensions of vector, re-normalized to unit length. For
+    Matryoshka-trained models such as text-embedding-3 the prefix is itself a
+    usable, lower-resolution embedding.
+    """
+    prefix = list(vector[:dimensions])
+    norm = math.sqrt(sum(v * v for v in prefix))
+    return [v / norm for v in prefix] if norm else prefix
+
+
+class EmbeddingBackend:
+    """
+    An embedding model together with the settings it was configured with.
+
+    model_id names the backend, model and dimensions. It is stored next to
+    every vector and used as the embedding store key, so vectors from
+    different backends or dimensions are never compared with each other.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        dimensions: int,
+        batch_size: int,
+        embeddings,
+        prefix_dimensions: int = 0,
+    ):
+        """
+        Args:
+            name: Backend name, e.g. "openai" or "local"
+            model: Model name within the backend
+            dimensions: Length of the vectors produced
+            batch_size: Max texts per embedding request
+            embeddings: LangChain Embeddings implementing the model
+            prefix_dimensions: Length of the prefix vector stored alongside
+                each vector, or 0 to store none
+        """
+        if prefix_dimensions >= dimensions:
+            raise ValueError(
+                f"Prefix dimensions ({prefix_dimensions}) must be below {dimensions}"
+            )
+        self.name = name
+        self.model = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.embeddings = embeddings
+        self.prefix_dimensions = prefix_dimensions
+        self.model_id = model_id(
+            {"name": name, "model": model, "dimensions": dimensions}
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts with at most batch_size texts per request."""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            vectors += self.embeddings.embed_documents(batch)
+        return vectors
+
+    def settings(self) -> Dict[str, Any]:
+        """Arguments recreating this backend with create_embedding_backend()."""
+        return {
+            "name": self.name,
+            "model": self.model,
+            "dimensions": self.dimensions,
+            "prefix_dimensions": self.prefix_dimensions,
+        }
+
+    def stamp(self) -> Dict[str, str]:
+        """Fields recorded on a stored vector to identify where it came from."""
+        return {"embedding_backend": self.name, "embedding_model": self.model_id}
+
+    def vector_fields(self, vector: List[float]) -> Dict[str, Any]:
+        """Document fields storing vector, its prefix if enabled, and its model."""
+        fields = {"vector_embedding": vector, **self.stamp()}
+        if self.prefix_dimensions:
+            fields["vector_prefix"] = truncate_vector(vector, self.prefix_dimensions)
+        return fields
+
+
+def _create_openai(
+    model: str, dimensions: int, batch_size: int, api_key: Optional[str]
+):
+    from langchain_openai import OpenAIEmbeddings
+
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    options = {"model": model, "chunk_size": batch_size, "openai_api_key": api_key}
+    # Only text-embedding-3 models accept a dimensions parameter
+    if not model.startswith("text-embedding-ada"):
+        options["dimensions"] = dimensions
+    elif dimensions != 1536:
+        raise ValueError(f"{model} only produces 1536 dimensions")
+    return OpenAIEmbeddings(**options)
+
+
+def _create_local(model: str, dimensions: int, batch_size: int, api_key: Optional[str]):
+    from utils.local_embeddings import HashingEmbeddings
+
+    if model != "hashing":
+        raise ValueError(f"Unknown local embedding model: {model}")
+    return HashingEmbeddings(dimensions)
+
+
+FACTORIES = {"openai": _create_openai, "local": _create_local}
+
+
+def resolve_settings(
+    name: Optional[str] = None,
+    model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    prefix_dimensions: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Fill in backend settings left out from the environment, then from the
+    backend's defaults, without creating the backend.
+    Raises:
+        ValueError: If the backend is unknown
+    """
+    name = name or EMBEDDING_BACKEND
+    if name not in FACTORIES:
+        raise ValueError(
+            f"Unknown embedding backend {name}, expected one of {', '.join(FACTORIES)}"
+        )
+    defaults = BACKEND_DEFAULTS[name]
+    if prefix_dimensions is None:
+        prefix_dimensions = EMBEDDING_PREFIX_DIMENSIONS
+    return {
+        "name": name,
+        "model": model or os.environ.get("EMBEDDING_MODEL") or defaults["model"],
+        "dimensions": dimensions
+        or int(os.environ.get("EMBEDDING_DIMENSIONS") or defaults["dimensions"]),
+        "batch_size": batch_size
+        or int(os.environ.get("EMBEDDING_BATCH_SIZE") or defaults["batch_size"]),
+        "prefix_dimensions": prefix_dimensions,
+    }
+
+
+def model_id(settings: Dict[str, Any]) -> str:
+    """The model ID of a backend, from its resolved settings."""
+    return f"{settings['name']}:{settings['model']}:{settings['dimensions']}"
+
+
+def create_embedding_backend(
+    name: Optional[str] = None,
+    model: Optional[str] = None,
+    dimensions: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    api_key: Optional[str] = None,
+    prefix_dimensions: Optional[int] = None,
+) -> EmbeddingBackend:
+    """
+    Create the configured embedding backend. Arguments left out are read
+    from the environment, then from the backend's defaults.
+    Raises:
+        ValueError: If the backend is unknown or missing its credentials
+    """
+    settings = resolve_settings(name, model, dimensions, batch_size, prefix_dimensions)
+    embeddings = FACTORIES[settings["name"]](
+        settings["model"], settings["dimensions"], settings["batch_size"], api_key
+    )
+    backend = EmbeddingBackend(embeddings=embeddings, **settings)
+    logger.info(
+        f"Embedding backend {backend.model_id} (batch size {backend.batch_size})"
+    )
+    return backend
+
+
+# Vectors written before backends were recorded all came from OpenAIEmbeddings'
+# default model
+LEGACY_MODEL_ID = "openai:text-embedding-ada-002:1536"
+
+
+def stamp_legacy_vectors(collection, backend: EmbeddingBackend) -> int:
+    """
+    Record the model on vectors stored before backends were tracked, if they
+    came from the configured model. Other backends re-embed those documents.
+    Returns:
+        Number of documents stamped
+    """
+    if backend.model_id != LEGACY_MODEL_ID:
+        return 0
+    result = collection.update_many(
+        {"vector_embedding": {"$exists": True}, "embedding_model": {"$exists": False}},
+        {"$set": backend.stamp()},
+    )
+    if result.modified_count:
+        logger.info(f"Recorded {backend.model_id} on {result.modified_count} vectors")
+    return result.modified_count
@@ -0,0 +1,117 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore:
+    """
+    Content-addressed store of embeddings keyed by model and content hash.
+
+    A document's embedding depends only on its content and the embedding model,
+    not on where the file lives, so renamed, moved, copied or reverted files can
+    reuse a vector that was computed before. Each entry keeps the set of
+    document IDs referencing it; entries nobody references are removed by
+    collect_garbage() once they have been unused for a grace period.
+    """
+
+    def __init__(self, collection, model: str):
+        """
+        Args:
+            collection: MongoDB collection holding the embeddings
+            model: Name of the embedding model the vectors come from
+        """
+        self.collection = collection
+        self.model = model
+        self.collection.create_index("unreferenced_since", sparse=True)
+
+    def _key(self, content_hash: str) -> str:
+        return f"{self.model}:{content_hash}"
+
+    def get(self, content_hash: str) -> Optional[List[float]]:
+        """Return the stored vector for content_hash, if any."""
+        entry = self.collection.find_one(
+            {"_id": self._key(content_hash)}, {"vector": 1}
+        )
+        return entry["vector"] if entry else None
+
+    def put(self, content_hash: str, vector: List[float]) -> None:
+        now = datetime.now(timezone.utc)
+        self.collection.update_one(
+            {"_id": self._key(content_hash)},
+            {
+                "$set": {"vector": vector, "last_used_at": now},
+                "$setOnInsert": {
+                    "model": self.model,
+                    "content_hash": content_hash,
+                    "refs": [],
+                    "created_at": now,
+                    "unreferenced_since": now,
+                },
+            },
+            upsert=True,
+        )
+
+    def get_or_embed(
+        self,
+        content_hash: str,
+        content: str,
+        embed: Callable[[str], Optional[List[float]]],
+    ) -> Optional[List[float]]:
+        """
+        Return the vector for content, calling embed() only on a store miss.
+        Args:
+            content_hash: Hash of content
+            content: Text to embed on a miss
+            embed: Function computing the embedding, returning None on failure
+        Returns:
+            The embedding, or None if it had to be computed and that failed
+        """
+        vector = self.get(content_hash)
+        if vector is not None:
+            logger.info(f"Reusing stored embedding for content {content_hash}")
+            return vector
+
+        vector = embed(content)
+        if vector:
+            self.put(content_hash, vector)
+        return vector
+
+    def acquire(self, content_hash: str, document_id: str) -> None:
+        """Record that document_id uses the embedding of content_hash."""
+        self.collection.update_one(
+            {"_id": self._key(content_hash)},
+            {
+                "$addToSet": {"refs": document_id},
+                "$set": {"last_used_at": datetime.now(timezone.utc)},
+                "$unset": {"unreferenced_since": ""},
+            },
+        )
+
+    def release(self, content_hash: str, document_id: str) -> None:
+        """Record that document_id no longer uses the embedding of content_hash."""
+        key = self._key(content_hash)
+        self.collection.update_one({"_id": key}, {"$pull": {"refs": document_id}})
+        # Start the grace period once the last reference is gone
+        self.collection.update_one(
+            {"_id": key, "refs": {"$size": 0}, "unreferenced_since": None},
+            {"$set": {"unreferenced_since": datetime.now(timezone.utc)}},
+        )
+
+    def collect_garbage(self, grace_period: timedelta) -> int:
+        """
+        Delete entries that have been unreferenced for longer than grace_period.
+        Returns:
+            Number of deleted entries
+        """
+        cutoff = datetime.now(timezone.utc) - grace_period
+        result = self.collection.delete_many(
+            {
+                "model": self.model,
+                "refs": {"$size": 0},
+                "unreferenced_since": {"$lt": cutoff},
+            }
+        )
+        logger.info(f"Removed {result.deleted_count} unused embeddings")
+        return result.deleted_count
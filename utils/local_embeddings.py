@@ -0,0 +1,74 @@
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import List, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+FIRST_BLOCK_SIZE = 16
+
+
+def nested_blocks(dimensions: int) -> List[Tuple[int, int]]:
+    """
+    Split dimensions into blocks of doubling size, (start, size) each:
+    16, 16, 32, 64, ... so that every power-of-two prefix is whole blocks.
+    """
+    blocks = []
+    start, size = 0, FIRST_BLOCK_SIZE
+    while start < dimensions:
+        size = min(size, dimensions - start)
+        blocks.append((start, size))
+        start += size
+        size = start
+    return blocks
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic embeddings computed locally by feature hashing.
+
+    Every token (and every pair of adjacent tokens) is hashed to a dimension
+    and a sign, and the counts are L2-normalized. Texts sharing vocabulary get
+    similar vectors, which is enough to exercise ingest and vector search at
+    scale without calling a paid API, and the same text always gets the same
+    vector on every machine.
+
+    Features are hashed once into each of a series of doubling blocks rather
+    than once over the whole vector. Any power-of-two prefix is then itself a
+    complete, coarser hashing embedding, like a Matryoshka-trained model, so
+    truncated prefix vectors behave as they would with text-embedding-3.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        """
+        Args:
+            dimensions: Length of the vectors produced
+        """
+        self.dimensions = dimensions
+        self.blocks = nested_blocks(dimensions)
+
+    def _features(self, text: str) -> Counter:
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        return Counter(tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])])
+
+    def embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for feature, count in self._features(text).items():
+            # 4 independent hash bytes per block, one bit of each for the sign
+            digest = hashlib.blake2b(feature.encode(), digest_size=64).digest()
+            for level, (start, size) in enumerate(self.blocks):
+                value = int.from_bytes(digest[4 * level : 4 * level + 4], "little")
+                sign = 1.0 if value & 1 else -1.0
+                vector[start + (value >> 1) % size] += sign * count
+        norm = math.sqrt(sum(v * v for v in vector))
+        if norm:
+            vector = [v / norm for v in vector]
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed(text)
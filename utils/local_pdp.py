@@ -0,0 +1,171 @@
+import json
+import os
+import tempfile
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Union
+
+from utils.tenants import DEFAULT_TENANT
+
+# Role and permission model of scripts/setup_rebac.py: department members get
+# "view" on the department, and the derived "reader" role on its documents
+DEPARTMENT_PERMISSIONS = ["department:view"]
+DOCUMENT_PERMISSIONS = ["document:read"]
+
+
+class LocalPDP:
+    """
+    In-process stand-in for the Permit PDP, answering from stored tuples.
+
+    Holds the same relationships Permit would (users as members of
+    departments, departments as parents of documents) and answers
+    get_user_permissions() and check() the way the PDP does for this app's
+    ReBAC model. It lets generated fixtures drive the query path at scale
+    without a Permit account or network round trips. As in Permit, every
+    tenant has its own departments, memberships and documents.
+    """
+
+    def __init__(self):
+        # tenant -> user -> departments, and tenant -> department -> documents
+        self.memberships: Dict[str, Dict[str, Set[str]]] = defaultdict(
+            lambda: defaultdict(set)
+        )
+        self.tenant_documents: Dict[str, Dict[str, Set[str]]] = defaultdict(
+            lambda: defaultdict(set)
+        )
+
+    @property
+    def members(self) -> Dict[str, Set[str]]:
+        """Memberships in the default tenant."""
+        return self.memberships[DEFAULT_TENANT]
+
+    @property
+    def documents(self) -> Dict[str, Set[str]]:
+        """Documents by department in the default tenant."""
+        return self.tenant_documents[DEFAULT_TENANT]
+
+    def add_member(
+        self, user_key: str, department: str, tenant: str = DEFAULT_TENANT
+    ) -> None:
+        self.memberships[tenant][user_key].add(department)
+
+    def add_parent(
+        self, document_id: str, department: str, tenant: str = DEFAULT_TENANT
+    ) -> None:
+        self.tenant_documents[tenant][department].add(document_id)
+
+    @staticmethod
+    def _user_key(user: Union[Dict[str, Any], str]) -> str:
+        return user["key"] if isinstance(user, dict) else user
+
+    async def get_user_permissions(
+        self,
+        user: Union[Dict[str, Any], str],
+        tenants: Optional[List[str]] = None,
+        resources: Optional[List[str]] = None,
+        resource_types: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """Return the user's permissions in the shape the Permit PDP uses."""
+        user_key = self._user_key(user)
+        permissions = {}
+        for tenant in sorted(self.memberships):
+            if tenants is not None and tenant not in tenants:
+                continue
+            documents = self.tenant_documents.get(tenant, {})
+            for department in sorted(self.memberships[tenant].get(user_key, ())):
+                if resource_types is None or "department" in resource_types:
+                    permissions[f"department:{department}"] = {
+                        "tenant": tenant,
+                        "roles": ["member"],
+                        "permissions": DEPARTMENT_PERMISSIONS,
+                    }
+                if resource_types is None or "document" in resource_types:
+                    for document_id in documents.get(department, ()):
+                        permissions[f"document:{document_id}"] = {
+                            "tenant": tenant,
+                            "roles": ["reader"],
+                            "permissions": DOCUMENT_PERMISSIONS,
+                        }
+        if resources is not None:
+            permissions = {k: v for k, v in permissions.items() if k in resources}
+        return permissions
+
+    async def check(
+        self,
+        user: Union[Dict[str, Any], str],
+        action: str,
+        resource: Union[Dict[str, Any], str],
+        context: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        tenant = None
+        if isinstance(resource, dict):
+            resource_type, key = resource.get("type"), resource.get("key")
+            tenant = resource.get("tenant")
+        else:
+            resource_type, _, key = resource.partition(":")
+        user_key = self._user_key(user)
+        names = [tenant] if tenant else list(self.memberships)
+        departments = {
+            (name, d)
+            for name in names
+            for d in self.memberships.get(name, {}).get(user_key, ())
+        }
+        if resource_type == "department":
+            return action == "view" and (
+                not key or any(d == key for _, d in departments)
+            )
+        if resource_type == "document" and action == "read":
+            if not key:
+                return bool(departments)
+            return any(
+                key in self.tenant_documents.get(name, {}).get(d, ())
+                for name, d in departments
+            )
+        return False
+
+    @staticmethod
+    def _tuples(
+        members: Dict[str, Set[str]], documents: Dict[str, Set[str]]
+    ) -> Dict[str, Any]:
+        return {
+            "members": {user: sorted(d) for user, d in sorted(members.items())},
+            "parents": {
+                department: sorted(ids) for department, ids in sorted(documents.items())
+            },
+        }
+
+    def save(self, path: str) -> None:
+        """
+        Write the tuples to path atomically, as JSON. The default tenant's are
+        at the top level, other tenants' under "tenants".
+        """
+        data = self._tuples(self.members, self.documents)
+        others = sorted(
+            (set(self.memberships) | set(self.tenant_documents)) - {DEFAULT_TENANT}
+        )
+        if others:
+            data["tenants"] = {
+                tenant: self._tuples(
+                    self.memberships.get(tenant, {}),
+                    self.tenant_documents.get(tenant, {}),
+                )
+                for tenant in others
+            }
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalPDP":
+        with open(path) as f:
+            data = json.load(f)
+        pdp = cls()
+        tenants = {DEFAULT_TENANT: data, **data.get("tenants", {})}
+        for tenant, tuples in tenants.items():
+            for user, departments in tuples.get("members", {}).items():
+                for department in departments:
+                    pdp.add_member(user, department, tenant)
+            for department, document_ids in tuples.get("parents", {}).items():
+                pdp.tenant_documents[tenant][department].update(document_ids)
+        return pdp
@@ -0,0 +1,89 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Word characters only, so identifiers such as budget_2024 or E1234 stay
+# single terms, as in a MongoDB text index
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.casefold())
+
+
+class LocalTextIndex:
+    """
+    In-memory inverted index with BM25 scoring.
+
+    The offline counterpart of the MongoDB text index hybrid search queries,
+    so lexical and fused retrieval can be measured on generated fixtures.
+    Terms are not stemmed, unlike in MongoDB.
+    """
+
+    def __init__(
+        self, ids: Sequence[str], texts: Sequence[str], k1: float = 1.2, b: float = 0.75
+    ):
+        """
+        Args:
+            ids: Document ID of each text
+            texts: Document bodies, in the same order as ids
+            k1: Term frequency saturation
+            b: Document length normalization
+        """
+        self.ids = list(ids)
+        self.k1 = k1
+        self.b = b
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        lengths = np.zeros(len(self.ids), dtype=np.float32)
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            lengths[row] = len(terms)
+            for term, count in Counter(terms).items():
+                postings[term].append((row, count))
+        self.lengths = lengths
+        average = float(lengths.mean()) if len(lengths) else 0.0
+        # Per-document part of the BM25 denominator
+        self._norms = k1 * (1 - b + b * lengths / (average or 1))
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            term: (
+                np.fromiter((row for row, _ in entries), dtype=np.int64),
+                np.fromiter((count for _, count in entries), dtype=np.float32),
+            )
+            for term, entries in postings.items()
+        }
+
+    def idf(self, term: str) -> float:
+        frequency = len(self.postings[term][0]) if term in self.postings else 0
+        return math.log(1 + (len(self.ids) - frequency + 0.5) / (frequency + 0.5))
+
+    def search(
+        self, query: str, k: int, rows: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Documents containing any query term, by BM25 score.
+        Args:
+            query: Query text
+            k: Number of results
+            rows: Restrict the search to these row indices, like a pre-filter
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            matched, counts = self.postings[term]
+            scores[matched] += (
+                self.idf(term)
+                * counts
+                * (self.k1 + 1)
+                / (counts + self._norms[matched])
+            )
+        candidates = np.flatnonzero(scores)
+        if rows is not None:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+        if k <= 0 or not len(candidates):
+            return []
+        top = candidates[np.argsort(-scores[candidates], kind="stable")[:k]]
+        return [(self.ids[row], float(scores[row])) for row in top]
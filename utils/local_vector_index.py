@@ -0,0 +1,196 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class LocalVectorIndex:
+    """
+    Exact in-memory cosine search over document vectors.
+
+    Mirrors what Atlas Vector Search does for the app, full-width search and
+    the two-stage search over Matryoshka prefixes, so retrieval quality and
+    latency can be measured offline on generated fixtures. Scores use Atlas'
+    cosine normalization, (1 + cosine) / 2.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        vectors: Iterable[Sequence[float]],
+        prefix_dimensions: int = 0,
+    ):
+        """
+        Args:
+            ids: Document ID of each vector
+            vectors: Full-width vectors, in the same order as ids
+            prefix_dimensions: Length of the prefix vectors to index, or 0
+        """
+        self.ids = list(ids)
+        self.vectors = _normalize(np.asarray(list(vectors), dtype=np.float32))
+        self.prefix_dimensions = prefix_dimensions
+        self.prefixes = (
+            _normalize(self.vectors[:, :prefix_dimensions].copy())
+            if prefix_dimensions
+            else None
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes
+
+    @property
+    def prefix_nbytes(self) -> int:
+        return self.prefixes.nbytes if self.prefixes is not None else 0
+
+    def _results(self, rows: np.ndarray, scores: np.ndarray) -> List[Tuple[str, float]]:
+        return [(self.ids[r], float((1 + s) / 2)) for r, s in zip(rows, scores)]
+
+    def search(
+        self, query: Sequence[float], k: int, rows: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Full-width search.
+        Args:
+            query: Query vector
+            k: Number of results
+            rows: Restrict the search to these row indices, like a pre-filter
+        """
+        q = _normalize(np.asarray(query, dtype=np.float32))
+        candidates = np.arange(len(self.ids)) if rows is None else rows
+        scores = self.vectors[candidates] @ q
+        top = _top_k(scores, k)
+        return self._results(candidates[top], scores[top])
+
+    def search_two_stage(
+        self,
+        query: Sequence[float],
+        k: int,
+        candidates: int,
+        rows: Optional[np.ndarray] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Find candidates by prefix similarity, then re-score them at full width.
+        Args:
+            query: Full-width query vector
+            k: Number of results
+            candidates: Number of first-stage candidates to re-score
+            rows: Restrict the search to these row indices, like a pre-filter
+        """
+        if self.prefixes is None:
+            raise ValueError("Index was built without prefix vectors")
+        q = _normalize(np.asarray(query, dtype=np.float32))
+        q_prefix = _normalize(q[: self.prefix_dimensions])
+        pool = np.arange(len(self.ids)) if rows is None else rows
+        first = pool[_top_k(self.prefixes[pool] @ q_prefix, candidates)]
+        scores = self.vectors[first] @ q
+        top = _top_k(scores, k)
+        return self._results(first[top], scores[top])
+
+
+def _filter_paths(query_filter: Dict[str, Any]) -> Iterable[str]:
+    for key, value in query_filter.items():
+        if key in ("$and", "$or", "$nor"):
+            for clause in value:
+                yield from _filter_paths(clause)
+        else:
+            yield key
+
+
+class LocalSearchIndexes:
+    """
+    In-memory stand-in for the search index methods of an Atlas collection.
+
+    Lets utils.vector_index.VectorIndexManager be exercised without Atlas:
+    indexes report as building for build_polls listings after each create or
+    update, then as queryable. validate_query() fails the way Atlas does on a
+    search the index cannot serve, instead of at query time in production.
+    """
+
+    def __init__(self, build_polls: int = 1):
+        """
+        Args:
+            build_polls: Listings an index stays building for after a change
+        """
+        self.build_polls = build_polls
+        self.indexes: Dict[str, Dict[str, Any]] = {}
+        self._building: Dict[str, int] = {}
+
+    def list_search_indexes(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        listed = []
+        for index_name, index in self.indexes.items():
+            if name is not None and index_name != name:
+                continue
+            building = self._building.get(index_name, 0)
+            if building:
+                self._building[index_name] = building - 1
+            listed.append(
+                {
+                    **index,
+                    "status": "BUILDING" if building else "READY",
+                    "queryable": not building or index.get("queryable", False),
+                }
+            )
+            if not building:
+                index["queryable"] = True
+        return listed
+
+    def create_search_index(self, model) -> str:
+        document = model.document
+        if document["name"] in self.indexes:
+            raise ValueError(f"Index {document['name']} already exists")
+        self.indexes[document["name"]] = {
+            "name": document["name"],
+            "type": document.get("type", "search"),
+            "latestDefinition": document["definition"],
+            "queryable": False,
+        }
+        self._building[document["name"]] = self.build_polls
+        return document["name"]
+
+    def update_search_index(self, name: str, definition: Dict[str, Any]) -> None:
+        if name not in self.indexes:
+            raise ValueError(f"Index {name} does not exist")
+        self.indexes[name]["latestDefinition"] = definition
+        self._building[name] = self.build_polls
+
+    def validate_query(
+        self,
+        index_name: str,
+        path: str,
+        query_vector: Sequence[float],
+        query_filter: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Raise ValueError if a $vectorSearch with these arguments would fail.
+        """
+        index = self.indexes.get(index_name)
+        if index is None or not index.get("queryable"):
+            raise ValueError(f"Index {index_name} is not queryable")
+        fields = {f["path"]: f for f in index["latestDefinition"]["fields"]}
+        vector = fields.get(path)
+        if vector is None or vector["type"] != "vector":
+            raise ValueError(f"Path {path} is not indexed as a vector in {index_name}")
+        if len(query_vector) != vector["numDimensions"]:
+            raise ValueError(
+                f"Query has {len(query_vector)} dimensions, {path} has {vector['numDimensions']}"
+            )
+        for filter_path in _filter_paths(query_filter or {}):
+            field = fields.get(filter_path)
+            if field is None or field["type"] != "filter":
+                raise ValueError(
+                    f"Path {filter_path} needs to be indexed as a filter in {index_name}"
+                )
@@ -0,0 +1,51 @@
+import logging
+import os
+from typing import Any, Dict
+
+from utils.tenants import DEFAULT_TENANT
+
+logger = logging.getLogger(__name__)
+
+DEPARTMENTS = ["engineering", "marketing", "finance"]
+DEFAULT_DEPARTMENT = "marketing"
+
+
+def document_department(document_id: str, metadata: Dict[str, Any]) -> str:
+    """Return the department owning a document, defaulting unknown ones."""
+    department = str(metadata.get("department", "")).lower()
+    if department not in DEPARTMENTS:
+        logger.warning(
+            f"Department not found or invalid for {document_id}, defaulting to {DEFAULT_DEPARTMENT}"
+        )
+        department = DEFAULT_DEPARTMENT
+    return department
+
+
+def document_instance(document_id: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the Permit resource instance for a document, in its tenant."""
+    return {
+        "key": document_id,
+        "tenant": metadata.get("tenant", DEFAULT_TENANT),
+        "resource": "document",
+        "attributes": {
+            "author": metadata.get("author", "unknown"),
+            "confidential": metadata.get("confidential", False),
+            "department": document_department(document_id, metadata),
+            "title": metadata.get("title", os.path.basename(document_id)),
+        },
+    }
+
+
+def parent_tuple(
+    document_id: str, department: str, tenant: str = DEFAULT_TENANT
+) -> Dict[str, Any]:
+    """
+    Build the tuple making a department the parent of a document. Each tenant
+    has its own department instances, so the tuple is in the document's tenant.
+    """
+    return {
+        "subject": f"department:{department}",
+        "relation": "parent",
+        "object": f"document:{document_id}",
+        "tenant": tenant,
+    }
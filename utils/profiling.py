@@ -0,0 +1,318 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import FrameType
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("speedscope", "collapsed")
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+# Task creation frames left out of the stacks of created tasks
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+# (function, file, first line)
+FrameKey = Tuple[str, str, int]
+Stack = Tuple[FrameKey, ...]
+
+# Profiler of the request being served; copied into its tasks and executor
+# threads, unset (and never looked at) when nothing is being profiled
+active_profiler: ContextVar[Optional["Profiler"]] = ContextVar(
+    "active_profiler", default=None
+)
+
+
+def _frame_key(frame: FrameType) -> FrameKey:
+    code = frame.f_code
+    return (
+        getattr(code, "co_qualname", code.co_name),
+        code.co_filename,
+        code.co_firstlineno,
+    )
+
+
+def _thread_frames(frame: Optional[FrameType]) -> List[FrameType]:
+    """Frames of a thread stack, outermost first."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _await_chain(coro: Any) -> List[FrameType]:
+    """Frames of a coroutine and of what it awaits, outermost first."""
+    frames = []
+    while coro is not None:
+        frame = (
+            getattr(coro, "cr_frame", None)
+            or getattr(coro, "gi_frame", None)
+            or getattr(coro, "ag_frame", None)
+        )
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = (
+            getattr(coro, "cr_await", None)
+            or getattr(coro, "gi_yieldfrom", None)
+            or getattr(coro, "ag_await", None)
+        )
+    return frames
+
+
+class Profiler:
+    """
+    Wall-clock sampling profiler for one request or call.
+
+    A background thread records a stack every interval seconds, whether the
+    profiled code is running or waiting. Started inside a task, it follows
+    the task and every task it creates: a waiting task is sampled from its
+    chain of awaited coroutines, a running one from the event loop thread's
+    stack. Executor threads are sampled while they run code wrapped in
+    attach_thread(). Started outside an event loop, it samples the calling
+    thread. Nothing is installed or sampled unless a profiler is running.
+    """
+
+    _factory_users = 0
+    _previous_factory = None
+
+    def __init__(self, name: str, interval: float = 0.005):
+        self.name = name
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.duration = 0.0
+        self._tasks: Dict[asyncio.Task, Stack] = {}
+        self._threads: Dict[int, Tuple[Stack, Optional[FrameType]]] = {}
+        self._thread_id = threading.get_ident()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started = 0.0
+        self._token = None
+
+    def start(self) -> "Profiler":
+        self._started = time.perf_counter()
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+        if self._loop is not None:
+            task = asyncio.current_task()
+            if task is not None:
+                self._tasks[task] = ()
+            self._install_task_factory(self._loop)
+        self._token = active_profiler.set(self)
+        self._sampler = threading.Thread(
+            target=self._run, name=f"profiler-{self.name}", daemon=True
+        )
+        self._sampler.start()
+        return self
+
+    def stop(self) -> "Profiler":
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.perf_counter() - self._started
+        active_profiler.reset(self._token)
+        if self._loop is not None:
+            self._uninstall_task_factory(self._loop)
+        self._tasks.clear()
+        self._threads.clear()
+        return self
+
+    # Task tracking
+
+    @classmethod
+    def _install_task_factory(cls, loop: asyncio.AbstractEventLoop) -> None:
+        if cls._factory_users == 0:
+            cls._previous_factory = loop.get_task_factory()
+            loop.set_task_factory(cls._create_task)
+        cls._factory_users += 1
+
+    @classmethod
+    def _uninstall_task_factory(cls, loop: asyncio.AbstractEventLoop) -> None:
+        cls._factory_users -= 1
+        if cls._factory_users == 0:
+            loop.set_task_factory(cls._previous_factory)
+            cls._previous_factory = None
+
+    @classmethod
+    def _create_task(cls, loop, coro, **kwargs):
+        if cls._previous_factory is not None:
+            task = cls._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        profiler = active_profiler.get()
+        parent = asyncio.current_task(loop)
+        if profiler is not None and parent is not None:
+            # Samples of the new task hang below the code that created it
+            stack = _thread_frames(sys._getframe(1))
+            chain = _await_chain(parent.get_coro())
+            if chain and chain[0] in stack:
+                stack = stack[stack.index(chain[0]) :]
+            profiler._tasks[task] = profiler._tasks.get(parent, ()) + tuple(
+                _frame_key(f)
+                for f in stack
+                if not f.f_code.co_filename.startswith((__file__, ASYNCIO_DIR))
+            )
+        return task
+
+    def _attach(self, thread_id: int, entry: Optional[FrameType]) -> None:
+        self._threads[thread_id] = ((("<executor thread>", "", 0),), entry)
+
+    def _detach(self, thread_id: int) -> None:
+        self._threads.pop(thread_id, None)
+
+    # Sampling
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                # Frames change under the sampler; skip the sample
+                logger.debug(f"Profiler sample skipped: {e}")
+
+    def _sample(self) -> None:
+        current = sys._current_frames()
+        if self._loop is None:
+            self._record((), _thread_frames(current.get(self._thread_id)))
+            return
+
+        loop_stack = _thread_frames(current.get(self._thread_id))
+        for task, prefix in list(self._tasks.items()):
+            if task.done():
+                continue
+            frames = _await_chain(task.get_coro())
+            if frames and frames[-1] in loop_stack:
+                # Running: continue below the innermost coroutine
+                frames += loop_stack[loop_stack.index(frames[-1]) + 1 :]
+            self._record(prefix, frames)
+        for thread_id, (prefix, entry) in list(self._threads.items()):
+            stack = _thread_frames(current.get(thread_id))
+            if entry in stack:
+                stack = stack[stack.index(entry) :]
+            self._record(prefix, stack)
+
+    def _record(self, prefix: Stack, frames: List[FrameType]) -> None:
+        stack = prefix + tuple(
+            _frame_key(f) for f in frames if f.f_code.co_filename != __file__
+        )
+        if stack:
+            self.samples[stack] += 1
+
+    # Output
+
+    def to_speedscope(self) -> Dict[str, Any]:
+        frames: Dict[FrameKey, int] = {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            samples.append([frames.setdefault(key, len(frames)) for key in stack])
+            weights.append(count * self.interval)
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": self.name,
+            "exporter": "secure-rag profiler",
+            "shared": {
+                "frames": [
+                    {"name": name, "file": file, "line": line}
+                    for name, file, line in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": self.name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self.duration,
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+
+    def to_collapsed(self) -> str:
+        """Folded stacks, one "a;b;c count" line per stack, for flamegraph.pl."""
+        lines = []
+        for stack, count in sorted(self.samples.items()):
+            names = [
+                f"{name} ({os.path.basename(file)}:{line})"
+                for name, file, line in stack
+            ]
+            lines.append(f"{';'.join(names)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, directory: str, profile_id: str, fmt: str = "speedscope") -> str:
+        """
+        Write the profile to directory as <profile_id>.speedscope.json or
+        <profile_id>.folded.
+        Returns:
+            Path of the written file
+        Raises:
+            ValueError: If fmt is not one of FORMATS
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown profile format {fmt}, expected {FORMATS}")
+        os.makedirs(directory, exist_ok=True)
+        safe_id = "".join(c if c.isalnum() or c in "-_." else "_" for c in profile_id)
+        if fmt == "speedscope":
+            path = os.path.join(directory, f"{safe_id}.speedscope.json")
+            content = json.dumps(self.to_speedscope())
+        else:
+            path = os.path.join(directory, f"{safe_id}.folded")
+            content = self.to_collapsed()
+        with open(path, "w") as f:
+            f.write(content)
+        logger.info(
+            f"Profile of {self.name} ({self.duration:.3f}s, {sum(self.samples.values())} samples) written to {path}"
+        )
+        return path
+
+
+@contextmanager
+def attach_thread():
+    """
+    Sample the current executor thread while in the block, if the request
+    that handed it work is being profiled. Costs one ContextVar lookup
+    otherwise.
+    """
+    profiler = active_profiler.get()
+    if profiler is None:
+        yield
+        return
+    # Sample from the code using the block down, not the executor's frames
+    entry = sys._getframe(1)
+    while entry is not None and entry.f_code.co_filename in (
+        __file__,
+        contextlib.__file__,
+    ):
+        entry = entry.f_back
+    thread_id = threading.get_ident()
+    profiler._attach(thread_id, entry)
+    try:
+        yield
+    finally:
+        profiler._detach(thread_id)
+
+
+@contextmanager
+def profiled(name: str, directory: str, profile_id: str, interval: float, fmt: str):
+    """Profile the block and save the profile, even if the block raises."""
+    profiler = Profiler(name, interval).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        try:
+            profiler.save(directory, profile_id, fmt)
+        except Exception as e:
+            logger.error(f"Could not save profile {profile_id}: {str(e)}")
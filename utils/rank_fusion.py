@@ -0,0 +1,31 @@
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+# Rank constant of Cormack et al.; larger values flatten the gap between
+# the top ranks and the rest
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Hashable]],
+    k: int = RRF_K,
+    weights: Optional[Sequence[float]] = None,
+) -> List[Tuple[Hashable, float]]:
+    """
+    Fuse rankings of the same items, e.g. document IDs from a vector and a
+    full-text search. An item scores sum(weight / (k + rank)) over the
+    rankings it appears in, ranks counting from 1, so only positions matter
+    and the searches' own score scales never have to be compared.
+    Args:
+        rankings: Items of each search, best first
+        k: Rank constant
+        weights: Weight of each ranking, 1 for all when left out
+    Returns:
+        (item, fused score) pairs, best first; ties keep first-seen order
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[Hashable, float] = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] += weight / (k + rank)
+    return sorted(scores.items(), key=lambda entry: entry[1], reverse=True)
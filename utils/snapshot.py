@@ -0,0 +1,310 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils.document_ids import compute_metadata_hash
+from utils.embedding_backends import truncate_vector
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+# One entry per document, stored column by column
+DOCUMENTS_FILE = "documents.json.gz"
+# One line per distinct content hash, in the row order of the vectors
+CONTENTS_FILE = "contents.jsonl.gz"
+# float32 row-major matrix, one row per line of CONTENTS_FILE
+VECTORS_FILE = "vectors.f32"
+
+COLUMNS = ("document_id", "filename", "filepath", "metadata", "content_hash", "row")
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_snapshot(storage, output: str, batch_size: int = 500) -> Dict[str, Any]:
+    """
+    Write the documents of a collection to a snapshot directory.
+
+    Bodies and vectors are stored once per content hash. Only vectors of the
+    embedding model most documents use are exported; documents embedded with
+    another model, or not at all, are exported without one and embedded again
+    after import.
+    Args:
+        storage: DocumentStorage of the collection to export
+        output: Directory to write, created if needed
+        batch_size: Documents read per query
+    Returns:
+        The snapshot manifest
+    """
+    os.makedirs(output, exist_ok=True)
+    models = list(
+        storage.documents.aggregate(
+            [
+                {"$match": {"embedding_model": {"$exists": True}}},
+                {"$group": {"_id": "$embedding_model", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": 1},
+            ]
+        )
+    )
+    model = models[0]["_id"] if models else None
+    dimensions, backend = 0, None
+    if model:
+        sample = storage.documents.find_one(
+            {"embedding_model": model},
+            {"vector_embedding": 1, "embedding_backend": 1},
+        )
+        dimensions = len(sample["vector_embedding"])
+        backend = sample.get("embedding_backend")
+
+    columns: Dict[str, List[Any]] = {column: [] for column in COLUMNS}
+    rows: Dict[str, int] = {}
+    embedded = 0
+    projection = {
+        "_id": 0,
+        "document_id": 1,
+        "filename": 1,
+        "filepath": 1,
+        "metadata": 1,
+        "content_hash": 1,
+        "embedding_model": 1,
+        "vector_embedding": 1,
+    }
+    contents_path = os.path.join(output, CONTENTS_FILE)
+    vectors_path = os.path.join(output, VECTORS_FILE)
+    with gzip.open(contents_path, "wt", encoding="utf-8") as contents_file, open(
+        vectors_path, "wb"
+    ) as vectors_file:
+        cursor = storage.documents.find({}, projection).sort("document_id", 1)
+        batch: List[Dict[str, Any]] = []
+
+        def flush() -> None:
+            nonlocal embedded
+            new = [d for d in batch if d["content_hash"] not in rows]
+            contents = storage.get_contents([d["document_id"] for d in new])
+            for document in new:
+                if document["content_hash"] in rows:
+                    continue
+                vector = document.get("vector_embedding")
+                usable = (
+                    vector is not None
+                    and document.get("embedding_model") == model
+                    and len(vector) == dimensions
+                )
+                rows[document["content_hash"]] = len(rows)
+                contents_file.write(
+                    json.dumps(
+                        {
+                            "content_hash": document["content_hash"],
+                            "content": contents.get(document["document_id"], ""),
+                            "embedded": usable,
+                        }
+                    )
+                    + "\n"
+                )
+                row = np.zeros(dimensions, dtype="<f4")
+                if usable:
+                    row[:] = vector
+                    embedded += 1
+                vectors_file.write(row.tobytes())
+            for document in batch:
+                for column in COLUMNS[:-1]:
+                    columns[column].append(document.get(column))
+                columns["row"].append(rows[document["content_hash"]])
+            batch.clear()
+
+        for document in cursor:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                flush()
+                logger.info(f"Exported {len(columns['row'])} documents")
+        flush()
+
+    with gzip.open(os.path.join(output, DOCUMENTS_FILE), "wt", encoding="utf-8") as f:
+        json.dump(columns, f)
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "source": storage.documents.name,
+        "embedding_backend": backend,
+        "embedding_model": model,
+        "dimensions": dimensions,
+        "documents": len(columns["row"]),
+        "rows": len(rows),
+        "embedded_rows": embedded,
+        "checksums": {
+            name: _sha256(os.path.join(output, name))
+            for name in (DOCUMENTS_FILE, CONTENTS_FILE, VECTORS_FILE)
+        },
+    }
+    with open(os.path.join(output, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(
+        f"Snapshot of {manifest['documents']} documents ({len(rows)} distinct bodies, {model}) written to {output}"
+    )
+    return manifest
+
+
+class Snapshot:
+    """
+    A snapshot directory written by export_snapshot().
+
+    The vectors are memory-mapped rather than read, so opening a snapshot is
+    cheap whatever its size, and a local vector index or a bulk load only
+    touches the rows it uses.
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        """
+        Args:
+            path: Snapshot directory
+            verify: Check file checksums against the manifest
+        Raises:
+            ValueError: If the snapshot is of another version or corrupted
+        """
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {self.manifest['version']}")
+        if verify:
+            for name, checksum in self.manifest["checksums"].items():
+                if _sha256(os.path.join(path, name)) != checksum:
+                    raise ValueError(f"Checksum mismatch for {name}")
+        with gzip.open(os.path.join(path, DOCUMENTS_FILE), "rt", encoding="utf-8") as f:
+            self.columns = json.load(f)
+
+    @property
+    def embedding_model(self) -> Optional[str]:
+        return self.manifest["embedding_model"]
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Vectors by row, memory-mapped."""
+        shape = (self.manifest["rows"], self.manifest["dimensions"])
+        if not all(shape):
+            return np.zeros(shape, dtype="<f4")
+        return np.memmap(
+            os.path.join(self.path, VECTORS_FILE), dtype="<f4", mode="r", shape=shape
+        )
+
+    def contents(self) -> Iterator[Dict[str, Any]]:
+        """Body lines in row order."""
+        with gzip.open(
+            os.path.join(self.path, CONTENTS_FILE), "rt", encoding="utf-8"
+        ) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def documents(
+        self,
+    ) -> Iterator[Tuple[Dict[str, Any], Optional[List[float]]]]:
+        """
+        Documents with their content, and their vector if they have one, in
+        row order so the bodies are read in a single pass.
+        """
+        by_row = defaultdict(list)
+        for index, row in enumerate(self.columns["row"]):
+            by_row[row].append(index)
+        vectors = self.vectors
+        for row, body in enumerate(self.contents()):
+            vector = vectors[row].tolist() if body["embedded"] else None
+            for index in by_row.get(row, ()):
+                document = {
+                    column: self.columns[column][index] for column in COLUMNS[:-1]
+                }
+                document["content"] = body["content"]
+                yield document, vector
+
+    def local_index(self, prefix_dimensions: int = 0):
+        """A utils.local_vector_index.LocalVectorIndex over the embedded documents."""
+        from utils.local_vector_index import LocalVectorIndex
+
+        embedded_rows = {
+            row for row, body in enumerate(self.contents()) if body["embedded"]
+        }
+        indices = [
+            i for i, row in enumerate(self.columns["row"]) if row in embedded_rows
+        ]
+        rows = np.asarray([self.columns["row"][i] for i in indices], dtype=np.int64)
+        return LocalVectorIndex(
+            [self.columns["document_id"][i] for i in indices],
+            self.vectors[rows],
+            prefix_dimensions=prefix_dimensions,
+        )
+
+    def import_into(
+        self,
+        storage,
+        embedding_store=None,
+        prefix_dimensions: int = 0,
+        batch_size: int = 500,
+    ) -> int:
+        """
+        Bulk-load the snapshot into a collection. Documents keep their content
+        hash and embedding model, and get their metadata hash recomputed, so
+        the watcher finds them up to date and only re-embeds documents that
+        had no vector.
+        Args:
+            storage: DocumentStorage of the collection to load into
+            embedding_store: EmbeddingStore of the snapshot's model to seed
+            prefix_dimensions: Length of the prefix vectors to store, or 0
+            batch_size: Documents per bulk write
+        Returns:
+            Number of documents loaded
+        """
+        stamp = {
+            "embedding_backend": self.manifest["embedding_backend"],
+            "embedding_model": self.embedding_model,
+        }
+        seeded = set()
+        loaded = 0
+        batch: List[Dict[str, Any]] = []
+
+        def flush() -> None:
+            storage.write(batch, [])
+            if embedding_store is not None:
+                for document in batch:
+                    if "vector_embedding" in document:
+                        embedding_store.acquire(
+                            document["content_hash"], document["document_id"]
+                        )
+            batch.clear()
+
+        for document, vector in self.documents():
+            document["metadata_hash"] = compute_metadata_hash(document)
+            if vector is not None:
+                document.update(vector_embedding=vector, **stamp)
+                if prefix_dimensions:
+                    document["vector_prefix"] = truncate_vector(
+                        vector, prefix_dimensions
+                    )
+                if (
+                    embedding_store is not None
+                    and document["content_hash"] not in seeded
+                ):
+                    embedding_store.put(document["content_hash"], vector)
+                    seeded.add(document["content_hash"])
+            batch.append(document)
+            loaded += 1
+            if len(batch) >= batch_size:
+                flush()
+                logger.info(f"Imported {loaded}/{self.manifest['documents']} documents")
+        if batch:
+            flush()
+        logger.info(f"Imported {loaded} documents into {storage.documents.name}")
+        return loaded
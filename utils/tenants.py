@@ -0,0 +1,67 @@
+import logging
+import os
+import re
+from typing import Any, Dict, Optional
+
+from utils.document_ids import relative_document_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = "default"
+# Permit tenant keys
+TENANT_KEY = re.compile(r"^[a-z0-9][a-z0-9_-]*$")
+
+# With TENANT_FROM_PATH, docs are laid out as docs/<tenant>/<department>/...
+TENANT_FROM_PATH = os.environ.get("TENANT_FROM_PATH", "false").lower() == "true"
+
+
+def normalize_tenant(tenant: Any) -> str:
+    """
+    Raises:
+        ValueError: If tenant is not a valid Permit tenant key
+    """
+    key = str(tenant).strip().lower()
+    if not TENANT_KEY.match(key):
+        raise ValueError(f"Invalid tenant {tenant!r}")
+    return key
+
+
+def tenant_from_path(file_path: str) -> Optional[str]:
+    """The first directory under docs/, if tenants are taken from paths."""
+    if not TENANT_FROM_PATH:
+        return None
+    parts = relative_document_path(file_path).split("/")
+    # docs/<tenant>/<file> at least
+    if len(parts) < 3:
+        return None
+    return parts[1]
+
+
+def document_tenant(metadata: Dict[str, Any], file_path: str) -> str:
+    """
+    The tenant owning a document: its frontmatter "tenant", else the tenant
+    directory of its path, else the default tenant.
+    Raises:
+        ValueError: If the tenant found is not a valid tenant key; such a
+            document is not synced rather than put in the default tenant
+    """
+    tenant = metadata.get("tenant") or tenant_from_path(file_path)
+    return normalize_tenant(tenant) if tenant else DEFAULT_TENANT
+
+
+def stamp_legacy_tenants(collection) -> int:
+    """
+    Put documents stored before tenants existed in the default tenant, so
+    the tenant filter of searches matches them.
+    Returns:
+        Number of documents stamped
+    """
+    result = collection.update_many(
+        {"metadata.tenant": {"$exists": False}},
+        {"$set": {"metadata.tenant": DEFAULT_TENANT}},
+    )
+    if result.modified_count:
+        logger.info(
+            f"Put {result.modified_count} documents in the {DEFAULT_TENANT} tenant"
+        )
+    return result.modified_count
@@ -0,0 +1,219 @@
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.operations import SearchIndexModel
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_NAME = "vector_index"
+PREFIX_INDEX_NAME = "vector_prefix_index"
+SIMILARITIES = ("cosine", "dotProduct", "euclidean")
+QUANTIZATIONS = ("none", "scalar", "binary")
+
+# Fields searches filter on: the tenant, which every search is scoped to,
+# the permission pre-filter, the model of the vectors and department tags
+DEFAULT_FILTER_PATHS = (
+    "metadata.tenant",
+    "document_id",
+    "embedding_model",
+    "metadata.department",
+)
+
+VECTOR_INDEX_SIMILARITY = os.environ.get("VECTOR_INDEX_SIMILARITY", "cosine")
+# scalar stores vectors as int8 and binary as single bits in the index, for
+# about 4x and 32x less index memory; full vectors are kept for rescoring
+VECTOR_INDEX_QUANTIZATION = os.environ.get("VECTOR_INDEX_QUANTIZATION", "none")
+# Extra comma-separated filter paths, e.g. metadata.tags
+VECTOR_INDEX_EXTRA_FILTERS = [
+    path
+    for path in os.environ.get("VECTOR_INDEX_EXTRA_FILTERS", "").split(",")
+    if path.strip()
+]
+
+
+def vector_index_definition(
+    path: str,
+    dimensions: int,
+    similarity: str = "cosine",
+    quantization: str = "none",
+    filter_paths: Tuple[str, ...] = DEFAULT_FILTER_PATHS,
+) -> Dict[str, Any]:
+    """
+    Atlas vectorSearch index definition for one vector field and its filters.
+    Raises:
+        ValueError: If similarity or quantization is unknown
+    """
+    if similarity not in SIMILARITIES:
+        raise ValueError(f"Unknown similarity {similarity}, expected {SIMILARITIES}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(
+            f"Unknown quantization {quantization}, expected {QUANTIZATIONS}"
+        )
+    vector = {
+        "type": "vector",
+        "path": path,
+        "numDimensions": dimensions,
+        "similarity": similarity,
+    }
+    if quantization != "none":
+        vector["quantization"] = quantization
+    return {
+        "fields": [vector]
+        + [{"type": "filter", "path": p} for p in dict.fromkeys(filter_paths)]
+    }
+
+
+def desired_indexes(
+    dimensions: int,
+    prefix_dimensions: int = 0,
+    similarity: Optional[str] = None,
+    quantization: Optional[str] = None,
+    filter_paths: Optional[Tuple[str, ...]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    The vector indexes the app searches, by name: vector_index over the full
+    vectors and, with prefix_dimensions, vector_prefix_index over the prefixes.
+    Arguments left out are read from the environment.
+    """
+    similarity = similarity or VECTOR_INDEX_SIMILARITY
+    quantization = quantization or VECTOR_INDEX_QUANTIZATION
+    if filter_paths is None:
+        filter_paths = DEFAULT_FILTER_PATHS + tuple(VECTOR_INDEX_EXTRA_FILTERS)
+    indexes = {
+        VECTOR_INDEX_NAME: vector_index_definition(
+            "vector_embedding", dimensions, similarity, quantization, filter_paths
+        )
+    }
+    if prefix_dimensions:
+        indexes[PREFIX_INDEX_NAME] = vector_index_definition(
+            "vector_prefix", prefix_dimensions, similarity, quantization, filter_paths
+        )
+    return indexes
+
+
+def _normalize(definition: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Fields by path, with Atlas' defaults filled in so equal indexes compare equal."""
+    fields = {}
+    for field in definition.get("fields", []):
+        field = dict(field)
+        if field.get("type") == "vector":
+            field.setdefault("quantization", "none")
+        fields[field["path"]] = field
+    return fields
+
+
+def diff_definition(desired: Dict[str, Any], deployed: Dict[str, Any]) -> List[str]:
+    """
+    Describe how a deployed index definition differs from the desired one.
+    Returns:
+        One line per difference, empty if they match
+    """
+    want, have = _normalize(desired), _normalize(deployed)
+    changes = []
+    for path, field in want.items():
+        current = have.get(path)
+        if current is None:
+            changes.append(f"add {field['type']} field {path}")
+            continue
+        for key, value in field.items():
+            if current.get(key) != value:
+                changes.append(f"{path}: {key} {current.get(key)} -> {value}")
+    for path, field in have.items():
+        if path not in want:
+            changes.append(f"remove {field.get('type')} field {path}")
+    return changes
+
+
+class VectorIndexManager:
+    """
+    Bring a collection's vector search indexes in line with their definitions.
+
+    Works with any collection exposing pymongo's search index methods, an
+    Atlas collection or utils.local_vector_index.LocalSearchIndexes. Indexes
+    are created or updated in place; Atlas keeps serving the old definition
+    of an updated index until the new one is built.
+    """
+
+    def __init__(self, collection):
+        """
+        Args:
+            collection: Collection whose search indexes are managed
+        """
+        self.collection = collection
+
+    def deployed(self) -> Dict[str, Dict[str, Any]]:
+        """Deployed search indexes by name, as listed by Atlas."""
+        return {index["name"]: index for index in self.collection.list_search_indexes()}
+
+    def plan(
+        self, desired: Dict[str, Dict[str, Any]]
+    ) -> List[Tuple[str, str, List[str]]]:
+        """
+        Returns:
+            (action, index name, changes) for each index that is missing or
+            differs, where action is "create" or "update"
+        """
+        deployed = self.deployed()
+        actions = []
+        for name, definition in desired.items():
+            index = deployed.get(name)
+            if index is None:
+                actions.append(("create", name, diff_definition(definition, {})))
+                continue
+            if index.get("type", "vectorSearch") != "vectorSearch":
+                raise ValueError(f"{name} exists but is a {index['type']} index")
+            changes = diff_definition(
+                definition,
+                index.get("latestDefinition") or index.get("definition") or {},
+            )
+            if changes:
+                actions.append(("update", name, changes))
+        return actions
+
+    def apply(
+        self, desired: Dict[str, Dict[str, Any]]
+    ) -> List[Tuple[str, str, List[str]]]:
+        """Create or update every index that is missing or differs."""
+        actions = self.plan(desired)
+        for action, name, changes in actions:
+            logger.info(f"{action.capitalize()} {name}: {'; '.join(changes)}")
+            if action == "create":
+                self.collection.create_search_index(
+                    SearchIndexModel(
+                        definition=desired[name], name=name, type="vectorSearch"
+                    )
+                )
+            else:
+                self.collection.update_search_index(name, desired[name])
+        return actions
+
+    def wait_until_queryable(
+        self, names: List[str], timeout: float, interval: float = 5
+    ) -> None:
+        """
+        Wait until every named index is queryable with its latest definition.
+        Raises:
+            RuntimeError: If an index failed to build
+            TimeoutError: If an index is still building after timeout seconds
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            deployed = self.deployed()
+            failed = [n for n in names if deployed.get(n, {}).get("status") == "FAILED"]
+            if failed:
+                raise RuntimeError(f"Index build failed: {', '.join(failed)}")
+            pending = [
+                name
+                for name in names
+                if name not in deployed
+                or not deployed[name].get("queryable")
+                or deployed[name].get("status", "READY") != "READY"
+            ]
+            if not pending:
+                logger.info(f"Indexes queryable: {', '.join(names)}")
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Indexes still building: {', '.join(pending)}")
+            time.sleep(interval)
@@ -1,13 +1,19 @@
 import os
+import sys
 import time
 import logging
+from datetime import timedelta
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler, FileCreatedEvent
-import hashlib
-from utils.document_ids import generate_document_id
-from watcher.utils import read_markdown_file
 
 from watcher.sync import DocumentSyncer
+from watcher.pipeline import IngestPipeline
+from watcher.outbox import start_outbox_workers
+from watcher.permit_sync import PermitSync
+from watcher.shards import ShardCoordinator
+from watcher.manifest import manifest_path, open_manifest, remove_stale_manifests
+from watcher.utils import iter_markdown_files
+from utils.collection_alias import AliasFollower
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,55 +21,70 @@ logger = logging.getLogger(__name__)
 # Constants
 DOCS_DIR = "/app/docs"
 SYNC_COMPLETE_FILE = "/app/sync_complete"
+EMBEDDING_GC_GRACE_PERIOD = timedelta(
+    hours=float(os.environ.get("EMBEDDING_GC_GRACE_HOURS", "24"))
+)
+PARSE_WORKERS = int(os.environ.get("WATCHER_PARSE_WORKERS", str(os.cpu_count() or 1)))
+EMBED_CONCURRENCY = int(os.environ.get("WATCHER_EMBED_CONCURRENCY", "8"))
+WRITE_BATCH_SIZE = int(os.environ.get("WATCHER_WRITE_BATCH_SIZE", "100"))
+WRITE_INTERVAL = float(os.environ.get("WATCHER_WRITE_INTERVAL", "0.5"))
+QUEUE_SIZE = int(os.environ.get("WATCHER_QUEUE_SIZE", "1000"))
+STATS_INTERVAL = float(os.environ.get("WATCHER_STATS_INTERVAL", "30"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "5"))
+WATCHER_SHARDS = int(os.environ.get("WATCHER_SHARDS", "1"))
+STATE_DIR = os.environ.get("WATCHER_STATE_DIR", "/app/state")
+MANIFEST_SAVE_INTERVAL = float(os.environ.get("WATCHER_MANIFEST_SAVE_INTERVAL", "10"))
+ALIAS_POLL_INTERVAL = float(os.environ.get("ALIAS_POLL_INTERVAL", "10"))
 
 
 class MarkdownEventHandler(FileSystemEventHandler):
-    def __init__(self, syncer: DocumentSyncer):
-        self.syncer = syncer
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
 
     def on_created(self, event):
         if not event.is_directory and event.src_path.endswith((".md", ".markdown")):
             logger.info(f"File created: {event.src_path}")
-            self.syncer.sync_document(event.src_path, is_new=True)
+            self.pipeline.submit(event.src_path, "upsert")
 
     def on_modified(self, event):
         if not event.is_directory and event.src_path.endswith((".md", ".markdown")):
             logger.info(f"File modified: {event.src_path}")
-            self.syncer.sync_document(event.src_path, is_new=False)
+            self.pipeline.submit(event.src_path, "upsert")
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        if event.src_path.endswith((".md", ".markdown")):
+            logger.info(f"File moved away: {event.src_path}")
+            self.pipeline.submit(event.src_path, "delete")
+        if event.dest_path.endswith((".md", ".markdown")):
+            logger.info(f"File moved to: {event.dest_path}")
+            self.pipeline.submit(event.dest_path, "upsert")
 
     def on_deleted(self, event):
         if not event.is_directory and event.src_path.endswith((".md", ".markdown")):
             logger.info(f"File deleted: {event.src_path}")
-            self.syncer.delete_document(event.src_path)
+            self.pipeline.submit(event.src_path, "delete")
 
 
-def sync_existing_documents(syncer: DocumentSyncer, docs_dir: str):
+def sync_existing_documents(pipeline, docs_dir: str):
     logger.info(f"Syncing existing documents in {docs_dir}")
 
     file_count = 0
-    for root, _, files in os.walk(docs_dir):
-        for file in files:
-            if file.endswith((".md", ".markdown")):
-                file_path = os.path.join(root, file)
-                logger.info(f"Processing file: {file_path}")
-                file_count += 1
-
-                # Read the file to compute content hash
-                metadata, content, _ = read_markdown_file(file_path)
-                content_hash = hashlib.md5(content.encode()).hexdigest()
-
-                # Generate document_id
-                document_id = generate_document_id(file_path)
-
-                # Check if document exists with same content hash
-                existing_doc = syncer.collection.find_one({"document_id": document_id})
-                if existing_doc and existing_doc.get("content_hash") == content_hash:
-                    logger.info(f"Document {document_id} unchanged, skipping sync")
-                    continue
-
-                # Sync the document if it’s new or changed
-                syncer.sync_document(file_path, is_new=True)
-
+    for file_path in iter_markdown_files(docs_dir):
+        file_count += 1
+        # Files unchanged since the last sync are skipped by the pipeline,
+        # from the manifest's stat record or from the content hash
+        pipeline.submit(file_path, "upsert")
+
+    # Files deleted while the watcher was stopped
+    removed = pipeline.submit_removed()
+    if removed:
+        logger.info(f"Removing {removed} documents deleted since the last sync")
+
+    # Wait for every queued document to be written before signalling readiness
+    pipeline.wait_until_idle()
+    logger.info(f"Ingest pipeline stats: {pipeline.stats()}")
     logger.info(f"Found {file_count} markdown files to process")
     logger.info("Existing document sync completed")
 
@@ -86,25 +107,91 @@ def main():
         return
 
     syncer = DocumentSyncer(mongodb_uri)
+    pipeline_options = dict(
+        parse_workers=PARSE_WORKERS,
+        embed_concurrency=EMBED_CONCURRENCY,
+        write_batch_size=WRITE_BATCH_SIZE,
+        write_interval=WRITE_INTERVAL,
+        queue_size=QUEUE_SIZE,
+        stats_interval=STATS_INTERVAL,
+    )
+
+    remove_stale_manifests(STATE_DIR, WATCHER_SHARDS)
+    pipeline_options["manifest_save_interval"] = MANIFEST_SAVE_INTERVAL
+
+    if WATCHER_SHARDS > 1:
+        # Each shard runs its own pipeline, manifest, Permit sync and outbox
+        # workers in a separate process
+        pipeline_options["parse_workers"] = max(1, PARSE_WORKERS // WATCHER_SHARDS)
+        pipeline = ShardCoordinator(
+            mongodb_uri,
+            WATCHER_SHARDS,
+            pipeline_options,
+            outbox_poll_interval=OUTBOX_POLL_INTERVAL,
+            queue_size=QUEUE_SIZE,
+            state_dir=STATE_DIR,
+        )
+        pipeline.start()
+        outbox_workers = []
+    else:
+        manifest = open_manifest(
+            manifest_path(STATE_DIR), syncer.collection, syncer.embedding_model
+        )
+        permit_sync = PermitSync.from_env(syncer.db, syncer.collection)
+        pipeline = IngestPipeline(
+            syncer, manifest=manifest, permit_sync=permit_sync, **pipeline_options
+        )
+        pipeline.start()
+
+        # Retry failed embeddings, writes and Permit syncs in the background
+        outbox_workers = start_outbox_workers(
+            syncer, pipeline, permit_sync, OUTBOX_POLL_INTERVAL
+        )
 
     # Sync existing documents at startup
-    sync_existing_documents(syncer, DOCS_DIR)
+    sync_existing_documents(pipeline, DOCS_DIR)
+
+    # Drop stored embeddings that no document has used for a while
+    if syncer.embedding_store:
+        syncer.embedding_store.collect_garbage(EMBEDDING_GC_GRACE_PERIOD)
 
     # Set up file watcher
-    event_handler = MarkdownEventHandler(syncer)
+    event_handler = MarkdownEventHandler(pipeline)
     observer = Observer()
     observer.schedule(event_handler, DOCS_DIR, recursive=True)
     observer.start()
 
     logger.info(f"Watching directory: {DOCS_DIR}")
 
+    # A reindex moves the documents alias to a new collection
+    follower = AliasFollower(
+        syncer.db,
+        on_switch=lambda pointer: None,
+        interval=ALIAS_POLL_INTERVAL,
+        current=syncer.collection_name,
+    )
+    switched = False
     try:
-        while True:
+        while not switched:
             time.sleep(1)
+            if WATCHER_SHARDS > 1:
+                pipeline.check_alive()
+            switched = follower.poll()
     except KeyboardInterrupt:
-        observer.stop()
+        pass
 
+    observer.stop()
     observer.join()
+    for worker in outbox_workers:
+        worker.stop()
+    pipeline.stop()
+
+    if switched:
+        # Start over on the new collection. Its manifest is discarded, so every
+        # file is verified against it by content hash, which also picks up
+        # changes written to the old collection during the switch.
+        logger.info("Documents alias moved, restarting the watcher")
+        os.execv(sys.executable, [sys.executable, "-m", "watcher.main"])
 
 
 if __name__ == "__main__":
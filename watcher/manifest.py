@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def stat_signature(stat: os.stat_result) -> Dict[str, int]:
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+class FileManifest:
+    """
+    Persisted record of the files the watcher has synced.
+
+    Each entry stores the size, mtime and inode a file had when its content was
+    last synced, with the content hash and document ID. A file whose stat still
+    matches its entry is known to be unchanged without opening it; any other
+    file is re-verified against MongoDB by content hash. The manifest is
+    written atomically, and a missing or unreadable manifest is simply rebuilt
+    by re-verifying every file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding_model: Optional[str] = None,
+        collection: str = "documents",
+    ):
+        """
+        Args:
+            path: JSON file the manifest is persisted to
+            embedding_model: Model ID the synced files were embedded with; a
+                manifest written for another model is discarded
+            collection: Collection the files were synced to; a manifest
+                written for another one, e.g. before a reindex, is discarded
+        """
+        self.path = path
+        self.embedding_model = embedding_model
+        self.collection = collection
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("version") != MANIFEST_VERSION:
+                raise ValueError(f"unsupported version {data.get('version')}")
+            if data.get("embedding_model") != self.embedding_model:
+                logger.info("Embedding model changed, all files will be verified")
+                self.entries = {}
+                self.dirty = True
+                return
+            if data.get("collection", "documents") != self.collection:
+                logger.info("Documents collection changed, all files will be verified")
+                self.entries = {}
+                self.dirty = True
+                return
+            self.entries = dict(data["files"])
+            logger.info(f"Loaded manifest with {len(self.entries)} files")
+        except FileNotFoundError:
+            logger.info(f"No manifest at {self.path}, all files will be verified")
+            self.entries = {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable manifest {self.path}: {str(e)}")
+            self.entries = {}
+            self.dirty = True
+
+    def save(self) -> None:
+        """Write the manifest to a temporary file and atomically replace the old one."""
+        with self._lock:
+            if not self.dirty:
+                return
+            data = {
+                "version": MANIFEST_VERSION,
+                "embedding_model": self.embedding_model,
+                "collection": self.collection,
+                "files": dict(self.entries),
+            }
+            self.dirty = False
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+        except Exception:
+            self.dirty = True
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries = {}
+            self.dirty = True
+
+    def unchanged(self, file_path: str, stat: os.stat_result) -> bool:
+        entry = self.entries.get(file_path)
+        return entry is not None and all(
+            entry.get(key) == value for key, value in stat_signature(stat).items()
+        )
+
+    def record(
+        self,
+        file_path: str,
+        stat: os.stat_result,
+        content_hash: str,
+        document_id: str,
+    ) -> None:
+        with self._lock:
+            self.entries[file_path] = {
+                **stat_signature(stat),
+                "content_hash": content_hash,
+                "document_id": document_id,
+            }
+            self.dirty = True
+
+    def forget(self, file_path: str) -> None:
+        with self._lock:
+            if self.entries.pop(file_path, None) is not None:
+                self.dirty = True
+
+    def missing_files(self) -> List[str]:
+        """Return recorded files that no longer exist, e.g. deleted while stopped."""
+        with self._lock:
+            paths = list(self.entries)
+        return [path for path in paths if not os.path.exists(path)]
+
+
+def open_manifest(
+    path: str, collection, embedding_model: Optional[str] = None
+) -> FileManifest:
+    """
+    Load the manifest at path, discarding it if the documents collection is
+    empty, since its entries would otherwise skip files that were never written.
+    """
+    manifest = FileManifest(path, embedding_model, collection.name)
+    manifest.load()
+    if manifest.entries and collection.estimated_document_count() == 0:
+        logger.warning("Documents collection is empty, rebuilding manifest")
+        manifest.clear()
+    return manifest
+
+
+def manifest_path(state_dir: str, shard_index: int = 0, shard_count: int = 1) -> str:
+    if shard_count <= 1:
+        return os.path.join(state_dir, "manifest.json")
+    return os.path.join(state_dir, f"manifest-{shard_index}-of-{shard_count}.json")
+
+
+def remove_stale_manifests(state_dir: str, shard_count: int) -> None:
+    """
+    Delete manifests written under a different shard layout. Their entries
+    stopped being updated when the layout changed and may no longer be true.
+    """
+    current = {
+        os.path.basename(manifest_path(state_dir, index, shard_count))
+        for index in range(shard_count)
+    }
+    if not os.path.isdir(state_dir):
+        return
+    for name in os.listdir(state_dir):
+        if (
+            name.startswith("manifest")
+            and name.endswith(".json")
+            and name not in current
+        ):
+            logger.info(f"Removing manifest from another shard layout: {name}")
+            os.remove(os.path.join(state_dir, name))
@@ -0,0 +1,257 @@
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+DEAD = "dead"
+
+
+class SyncOutbox:
+    """
+    Durable queue of sync work that failed and must be retried.
+
+    There is at most one entry per document, keyed by document_id, so repeated
+    failures for the same file collapse into one entry. Workers claim entries
+    with a time-limited lease, which lets several watcher replicas drain the
+    outbox in parallel; an entry whose worker died becomes claimable again once
+    its lease expires. Each failed attempt pushes the next one back
+    exponentially, and entries that fail max_attempts times are moved to the
+    dead-letter state until they are replayed by hand or the document fails
+    to sync again, which starts a fresh round of attempts.
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_attempts: int,
+        base_delay: float,
+        max_delay: float,
+        lease_seconds: float,
+    ):
+        """
+        Args:
+            collection: MongoDB collection holding the outbox entries
+            max_attempts: Failed attempts before an entry is dead-lettered
+            base_delay: Seconds before the first retry
+            max_delay: Upper bound in seconds for the retry delay
+            lease_seconds: How long a claimed entry is reserved for its worker
+        """
+        self.collection = collection
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self.collection.create_index([("state", 1), ("next_attempt_at", 1)])
+
+    def enqueue(self, op: str, document_id: str, filepath: str, error: str) -> None:
+        """
+        Record sync work for a document that did not complete.
+        Args:
+            op: "upsert" or "delete"
+            document_id: ID of the affected document
+            filepath: Path of the markdown file
+            error: Why the work failed
+        """
+        now = datetime.now(timezone.utc)
+        try:
+            self.collection.update_one(
+                {"_id": document_id},
+                {
+                    "$set": {
+                        "op": op,
+                        "filepath": filepath,
+                        "last_error": error,
+                        "updated_at": now,
+                        # A fresh failure makes even a dead entry retryable
+                        "state": PENDING,
+                        "attempts": 0,
+                        "next_attempt_at": now,
+                    },
+                    "$setOnInsert": {"created_at": now},
+                },
+                upsert=True,
+            )
+            logger.warning(f"Queued {op} of document {document_id} for retry: {error}")
+        except Exception as e:
+            logger.error(f"Could not queue {op} of document {document_id}: {str(e)}")
+
+    def resolve(self, document_ids: List[str]) -> None:
+        """Drop entries for documents that have since been synced successfully."""
+        if document_ids:
+            self.collection.delete_many({"_id": {"$in": document_ids}})
+
+    def claim(self, owner: str) -> Optional[Dict[str, Any]]:
+        """Lease the next due entry to owner, or return None if nothing is due."""
+        now = datetime.now(timezone.utc)
+        return self.collection.find_one_and_update(
+            {
+                "state": PENDING,
+                "next_attempt_at": {"$lte": now},
+                "$or": [
+                    {"lease_expires_at": None},
+                    {"lease_expires_at": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "lease_owner": owner,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                }
+            },
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def complete(self, entry: Dict[str, Any], owner: str) -> None:
+        self.collection.delete_one({"_id": entry["_id"], "lease_owner": owner})
+
+    def fail(self, entry: Dict[str, Any], owner: str, error: str) -> None:
+        """Schedule the next attempt for a claimed entry, or dead-letter it."""
+        attempts = entry.get("attempts", 0) + 1
+        now = datetime.now(timezone.utc)
+        update = {"attempts": attempts, "last_error": error, "updated_at": now}
+        if attempts >= self.max_attempts:
+            update["state"] = DEAD
+            logger.error(
+                f"Giving up on {entry['op']} of document {entry['_id']} after {attempts} attempts: {error}"
+            )
+        else:
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+            # Jitter spreads out retries of entries that failed together
+            delay *= random.uniform(0.5, 1.0)
+            update["next_attempt_at"] = now + timedelta(seconds=delay)
+            logger.warning(
+                f"Retry {attempts} of {entry['op']} for document {entry['_id']} failed, next in {delay:.1f}s: {error}"
+            )
+        self.collection.update_one(
+            {"_id": entry["_id"], "lease_owner": owner},
+            {
+                "$set": update,
+                "$unset": {"lease_owner": "", "lease_expires_at": ""},
+            },
+        )
+
+    def replay(self, document_ids: Optional[List[str]] = None) -> int:
+        """
+        Make entries due immediately with a fresh attempt count.
+        Args:
+            document_ids: Entries to replay; all dead entries if None
+        Returns:
+            Number of entries replayed
+        """
+        query = (
+            {"state": DEAD} if document_ids is None else {"_id": {"$in": document_ids}}
+        )
+        result = self.collection.update_many(
+            query,
+            {
+                "$set": {
+                    "state": PENDING,
+                    "attempts": 0,
+                    "next_attempt_at": datetime.now(timezone.utc),
+                },
+                "$unset": {"lease_owner": "", "lease_expires_at": ""},
+            },
+        )
+        return result.modified_count
+
+    def purge(self, state: str = DEAD) -> int:
+        return self.collection.delete_many({"state": state}).deleted_count
+
+    def entries(self, state: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        query = {"state": state} if state else {}
+        cursor = self.collection.find(query).sort("next_attempt_at", 1).limit(limit)
+        return list(cursor)
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            state: self.collection.count_documents({"state": state})
+            for state in (PENDING, DEAD)
+        }
+
+
+class OutboxWorker:
+    """Background thread that drains due outbox entries through a handler."""
+
+    def __init__(
+        self,
+        outbox: SyncOutbox,
+        handler: Callable[[Dict[str, Any]], None],
+        poll_interval: float,
+    ):
+        """
+        Args:
+            outbox: Outbox to drain
+            handler: Retries one entry, raising if the retry failed
+            poll_interval: Seconds to wait when no entry is due
+        """
+        self.outbox = outbox
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"outbox-{outbox.collection.name}", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._thread.join()
+
+    def drain_once(self) -> bool:
+        """Process one due entry. Returns False if nothing was due."""
+        entry = self.outbox.claim(self.owner)
+        if entry is None:
+            return False
+        try:
+            self.handler(entry)
+        except Exception as e:
+            self.outbox.fail(entry, self.owner, str(e) or type(e).__name__)
+        else:
+            self.outbox.complete(entry, self.owner)
+            logger.info(f"Retried {entry['op']} of document {entry['_id']}")
+        return True
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                if self.drain_once():
+                    continue
+            except Exception as e:
+                logger.error(f"Error draining sync outbox: {str(e)}")
+            self._stopping.wait(self.poll_interval)
+
+
+def start_outbox_workers(
+    syncer, pipeline, permit_sync, poll_interval: float
+) -> List[OutboxWorker]:
+    """
+    Start the workers retrying failed document syncs and, when Permit sync is
+    enabled, failed Permit syncs. Permit retries run on the pipeline's event
+    loop, where the Permit client lives.
+    """
+    workers = [
+        OutboxWorker(syncer.outbox, syncer.retry_entry, poll_interval=poll_interval)
+    ]
+    if permit_sync is not None:
+        workers.append(
+            OutboxWorker(
+                permit_sync.outbox,
+                lambda entry: pipeline.call(permit_sync.retry_entry(entry)),
+                poll_interval=poll_interval,
+            )
+        )
+    for worker in workers:
+        worker.start()
+    return workers
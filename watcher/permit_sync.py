@@ -0,0 +1,290 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, UpdateOne
+
+from utils.permit_resources import document_instance, parent_tuple
+from utils.tenants import DEFAULT_TENANT
+from watcher.outbox import SyncOutbox
+from watcher.sync import (
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BASE_DELAY,
+    OUTBOX_MAX_DELAY,
+    OUTBOX_LEASE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+PERMIT_API_KEY = os.environ.get("PERMIT_API_KEY")
+PERMIT_PDP_URL = os.environ.get("PERMIT_PDP_URL", "http://localhost:7000")
+PERMIT_SYNC_ENABLED = os.environ.get("PERMIT_SYNC_ENABLED", "true").lower() == "true"
+PERMIT_SYNC_BATCH_SIZE = int(os.environ.get("PERMIT_SYNC_BATCH_SIZE", "100"))
+PERMIT_SYNC_RATE = float(os.environ.get("PERMIT_SYNC_RATE", "5"))
+# Largest page the Permit list endpoints return
+PERMIT_PAGE_SIZE = 100
+
+
+def chunks(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+class PermitSync:
+    """
+    Keep Permit resource instances and parent tuples in step with the
+    documents the watcher writes.
+
+    The last state pushed for each document (its instance attributes and
+    parent department) is kept in MongoDB, so a change only calls Permit for
+    what actually differs: a content-only edit makes no calls, and a moved
+    department replaces just the parent tuple. Calls use the bulk endpoints
+    and are spaced to stay under a request rate. Changes that fail are put in
+    their own outbox and retried from the current MongoDB document.
+    """
+
+    def __init__(
+        self,
+        permit_client,
+        documents,
+        state_collection,
+        outbox: SyncOutbox,
+        batch_size: int,
+        rate: float,
+    ):
+        """
+        Args:
+            permit_client: Permit client used for the management API
+            documents: MongoDB documents collection, the source of truth
+            state_collection: Collection holding the state last pushed to Permit
+            outbox: Outbox for changes that failed to sync
+            batch_size: Max items per bulk API call
+            rate: Max Permit API calls per second
+        """
+        self.permit_client = permit_client
+        self.documents = documents
+        self.state_collection = state_collection
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.min_interval = 1 / rate if rate > 0 else 0
+        self._next_call = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        # Parents in Permit of documents without sync state, read in bulk
+        # the first time such a document is synced
+        self._parents: Optional[Dict[str, List[Tuple[str, str]]]] = None
+        self._parents_lock: Optional[asyncio.Lock] = None
+        self.calls = 0
+        self.errors = 0
+
+    @classmethod
+    def from_env(cls, db, documents=None) -> Optional["PermitSync"]:
+        """
+        Create a PermitSync from the environment, or None if it is disabled.
+        Args:
+            db: Database holding the Permit outbox and sync state
+            documents: Documents collection in use, db.documents by default
+        """
+        if not PERMIT_SYNC_ENABLED or not PERMIT_API_KEY:
+            logger.warning("Permit sync disabled, documents will not be authorized")
+            return None
+
+        from permit import Permit
+
+        outbox = SyncOutbox(
+            db.permit_outbox,
+            max_attempts=OUTBOX_MAX_ATTEMPTS,
+            base_delay=OUTBOX_BASE_DELAY,
+            max_delay=OUTBOX_MAX_DELAY,
+            lease_seconds=OUTBOX_LEASE_SECONDS,
+        )
+        return cls(
+            Permit(token=PERMIT_API_KEY, pdp=PERMIT_PDP_URL),
+            documents if documents is not None else db.documents,
+            db.permit_sync_state,
+            outbox,
+            batch_size=PERMIT_SYNC_BATCH_SIZE,
+            rate=PERMIT_SYNC_RATE,
+        )
+
+    async def _throttle(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            wait = self._next_call - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._next_call = time.monotonic() + self.min_interval
+        self.calls += 1
+
+    async def _bulk(self, call, items: List[Any]) -> None:
+        for chunk in chunks(items, self.batch_size):
+            await self._throttle()
+            await call(chunk)
+
+    async def apply(self, changes: List[Dict[str, Any]]) -> None:
+        """
+        Push a batch of document changes to Permit.
+        Args:
+            changes: Dicts with "op" ("upsert" or "delete"), "document_id",
+                "path" and, for upserts, the document "metadata"
+        Raises:
+            Exception: If a Permit call fails; no state is recorded then
+        """
+        loop = asyncio.get_running_loop()
+        document_ids = [change["document_id"] for change in changes]
+        current = await loop.run_in_executor(None, self._load_state, document_ids)
+        unsynced_parents: Dict[str, List[Tuple[str, str]]] = {}
+        if any(document_id not in current for document_id in document_ids):
+            unsynced_parents = await self._unsynced_parents()
+
+        instances, deleted_instances = [], []
+        new_tuples, old_tuples = [], []
+        state_updates = []
+        for change in changes:
+            document_id = change["document_id"]
+            previous = current.get(document_id)
+            if previous is not None:
+                parents = [
+                    (previous["department"], previous.get("tenant", DEFAULT_TENANT))
+                ]
+            else:
+                # Not synced by the watcher before, e.g. created by the
+                # one-shot permit-sync, so use its parents in Permit
+                parents = unsynced_parents.get(document_id, [])
+
+            if change["op"] == "delete":
+                old_tuples += [parent_tuple(document_id, d, t) for d, t in parents]
+                if previous is not None or parents:
+                    deleted_instances.append(f"document:{document_id}")
+                state_updates.append(DeleteOne({"_id": document_id}))
+                continue
+
+            instance = document_instance(document_id, change["metadata"])
+            department = instance["attributes"]["department"]
+            tenant = instance["tenant"]
+            if (
+                previous
+                and previous["attributes"] == instance["attributes"]
+                and previous.get("tenant", DEFAULT_TENANT) == tenant
+            ):
+                continue
+            instances.append(instance)
+            if (department, tenant) not in parents:
+                new_tuples.append(parent_tuple(document_id, department, tenant))
+            old_tuples += [
+                parent_tuple(document_id, d, t)
+                for d, t in parents
+                if (d, t) != (department, tenant)
+            ]
+            state_updates.append(
+                UpdateOne(
+                    {"_id": document_id},
+                    {
+                        "$set": {
+                            "attributes": instance["attributes"],
+                            "department": department,
+                            "tenant": tenant,
+                            "synced_at": datetime.now(timezone.utc),
+                        }
+                    },
+                    upsert=True,
+                )
+            )
+
+        if not state_updates:
+            return
+
+        api = self.permit_client.api
+        # Instances must exist before tuples reference them, and tuples are
+        # removed before the instances they point at
+        await self._bulk(api.resource_instances.bulk_replace, instances)
+        await self._bulk(
+            api.relationship_tuples.bulk_delete,
+            [
+                {key: t[key] for key in ("subject", "relation", "object")}
+                for t in old_tuples
+            ],
+        )
+        await self._bulk(api.relationship_tuples.bulk_create, new_tuples)
+        await self._bulk(api.resource_instances.bulk_delete, deleted_instances)
+
+        await loop.run_in_executor(
+            None, lambda: self.state_collection.bulk_write(state_updates, ordered=False)
+        )
+        # These documents now have sync state, or are gone from Permit
+        if self._parents is not None:
+            for document_id in document_ids:
+                self._parents.pop(document_id, None)
+        logger.info(
+            f"Permit sync: {len(instances)} instances upserted, {len(deleted_instances)} deleted, "
+            f"{len(new_tuples)} tuples created, {len(old_tuples)} removed"
+        )
+
+    async def _unsynced_parents(self) -> Dict[str, List[Tuple[str, str]]]:
+        """
+        Return the (department, tenant) pairs Permit has as parents of each
+        document, by document ID. All parent tuples are paged through once,
+        instead of listing them per document at the sync rate; afterwards
+        documents drop out as they get sync state.
+        """
+        if self._parents_lock is None:
+            self._parents_lock = asyncio.Lock()
+        async with self._parents_lock:
+            if self._parents is None:
+                parents: Dict[str, List[Tuple[str, str]]] = {}
+                page = 1
+                while True:
+                    await self._throttle()
+                    tuples = await self.permit_client.api.relationship_tuples.list(
+                        page=page, per_page=PERMIT_PAGE_SIZE, relation_key="parent"
+                    )
+                    for t in tuples:
+                        if t.object.startswith("document:"):
+                            parents.setdefault(t.object.split(":", 1)[1], []).append(
+                                (t.subject.split(":", 1)[1], t.tenant)
+                            )
+                    if len(tuples) < PERMIT_PAGE_SIZE:
+                        break
+                    page += 1
+                logger.info(f"Loaded Permit parents of {len(parents)} documents")
+                self._parents = parents
+        return self._parents
+
+    def _load_state(self, document_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        return {
+            state["_id"]: state
+            for state in self.state_collection.find({"_id": {"$in": document_ids}})
+        }
+
+    async def sync_batch(self, changes: List[Dict[str, Any]]) -> None:
+        """Apply changes, queueing them for retry if Permit rejects the batch."""
+        try:
+            await self.apply(changes)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Permit sync of {len(changes)} documents failed: {str(e)}")
+            for change in changes:
+                self.outbox.enqueue(
+                    change["op"], change["document_id"], change["path"], str(e)
+                )
+
+    async def retry_entry(self, entry: Dict[str, Any]) -> None:
+        """Retry an outbox entry from the document's current state in MongoDB."""
+        loop = asyncio.get_running_loop()
+        document = await loop.run_in_executor(
+            None,
+            lambda: self.documents.find_one(
+                {"document_id": entry["_id"]}, {"metadata": 1}
+            ),
+        )
+        change = {"document_id": entry["_id"], "path": entry["filepath"]}
+        if document is None:
+            change["op"] = "delete"
+        else:
+            change.update(op="upsert", metadata=document.get("metadata", {}))
+        await self.apply([change])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "errors": self.errors}
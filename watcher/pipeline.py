@@ -0,0 +1,452 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set
+
+from utils.document_ids import generate_document_id
+from watcher.manifest import FileManifest
+from watcher.utils import prepare_document
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats:
+    """Counters for one pipeline stage."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.processed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+
+    def record(self, seconds: float, count: int = 1) -> None:
+        self.processed += count
+        self.busy_seconds += seconds
+
+    def to_dict(self, queue: "asyncio.Queue") -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started_at, 1e-9)
+        return {
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "queue_depth": queue.qsize(),
+            "throughput_per_s": round(self.processed / elapsed, 2),
+            "busy_seconds": round(self.busy_seconds, 2),
+        }
+
+
+class IngestPipeline:
+    """
+    Staged, concurrent ingest of markdown files into MongoDB.
+
+    File events flow through bounded queues between these stages:
+
+    - parse: read, enrich and hash files on a process pool, and drop files
+      whose content hash is unchanged. With a manifest, files whose stat
+      matches their manifest entry are dropped without being read at all
+    - embed: compute embeddings in batches with bounded concurrency
+    - write: apply upserts and deletes in bulk batches
+    - authz: with a PermitSync, push each written batch to Permit
+
+    Events for a file that is already queued are merged, and a file is never
+    processed by two stages at once; an event arriving while it is in flight
+    is replayed once the current run has been written. When the first queue is
+    full, submit() blocks the caller, which pushes back on the event source.
+
+    The pipeline runs its own event loop on a background thread so it can be
+    fed from watchdog's observer thread.
+    """
+
+    def __init__(
+        self,
+        syncer,
+        parse_workers: int,
+        embed_concurrency: int,
+        write_batch_size: int,
+        write_interval: float,
+        queue_size: int,
+        stats_interval: float = 0,
+        manifest: Optional[FileManifest] = None,
+        manifest_save_interval: float = 10,
+        permit_sync=None,
+    ):
+        self.syncer = syncer
+        self.parse_workers = parse_workers
+        self.embed_concurrency = embed_concurrency
+        embeddings = getattr(syncer, "embeddings", None)
+        self.embed_batch_size = embeddings.batch_size if embeddings else 1
+        self.write_batch_size = write_batch_size
+        self.write_interval = write_interval
+        self.queue_size = queue_size
+        self.stats_interval = stats_interval
+        self.manifest = manifest
+        self.manifest_save_interval = manifest_save_interval
+        self.permit_sync = permit_sync
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, name="ingest-pipeline", daemon=True
+        )
+        self._started = threading.Event()
+        self._cpu_pool = ProcessPoolExecutor(
+            max_workers=parse_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._io_pool = ThreadPoolExecutor(
+            max_workers=embed_concurrency + 2, thread_name_prefix="ingest-io"
+        )
+
+        # Bookkeeping below is only touched from the pipeline's event loop
+        self._pending: Dict[str, str] = {}
+        self._in_flight: Set[str] = set()
+        self._replay: Dict[str, str] = {}
+        # Re-queues of replayed events; the loop only keeps weak references
+        self._requeues: Set[asyncio.Task] = set()
+        self._outstanding = 0
+        self.coalesced = 0
+        self.unchanged_by_stat = 0
+        stages = ["parse", "embed", "write"]
+        if permit_sync is not None:
+            stages.append("authz")
+        self.stage_stats = {name: StageStats(name) for name in stages}
+
+    # Called from other threads
+
+    def start(self) -> None:
+        self._thread.start()
+        self._started.wait()
+
+    def submit(self, file_path: str, kind: str) -> None:
+        """
+        Queue a file event, blocking while the pipeline is full.
+        Args:
+            file_path: Path of the markdown file
+            kind: "upsert" for created/modified files, "delete" for removed ones
+        """
+        asyncio.run_coroutine_threadsafe(
+            self._enqueue(file_path, kind), self._loop
+        ).result()
+
+    def wait_until_idle(self) -> None:
+        """Block until every submitted event has been fully processed."""
+        asyncio.run_coroutine_threadsafe(self._idle.wait(), self._loop).result()
+
+    def call(self, coro) -> Any:
+        """Run a coroutine on the pipeline's event loop and return its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def stats(self) -> Dict[str, Any]:
+        return asyncio.run_coroutine_threadsafe(
+            self._collect_stats(), self._loop
+        ).result()
+
+    def submit_removed(self) -> int:
+        """
+        Queue deletes for manifest files that no longer exist, i.e. files
+        removed while the watcher was not running.
+        Returns:
+            Number of deletes queued
+        """
+        if self.manifest is None:
+            return 0
+        removed = self.manifest.missing_files()
+        for file_path in removed:
+            self.submit(file_path, "delete")
+        return len(removed)
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join()
+        self._cpu_pool.shutdown()
+        self._io_pool.shutdown()
+        if self.manifest is not None:
+            self.manifest.save()
+
+    # Event loop side
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._main())
+
+    async def _main(self) -> None:
+        self._parse_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._embed_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._write_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._authz_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._stopping = asyncio.Event()
+
+        workers = [
+            asyncio.create_task(self._parse_worker()) for _ in range(self.parse_workers)
+        ]
+        workers += [
+            asyncio.create_task(self._embed_worker())
+            for _ in range(self.embed_concurrency)
+        ]
+        workers.append(asyncio.create_task(self._writer()))
+        if self.permit_sync is not None:
+            workers.append(asyncio.create_task(self._authz_worker()))
+        if self.stats_interval > 0:
+            workers.append(asyncio.create_task(self._report_stats()))
+        if self.manifest is not None:
+            workers.append(asyncio.create_task(self._save_manifest()))
+        self._started.set()
+
+        await self._stopping.wait()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _enqueue(self, file_path: str, kind: str) -> None:
+        if file_path in self._pending:
+            self._pending[file_path] = kind
+            self.coalesced += 1
+            return
+        if file_path in self._in_flight:
+            self._replay[file_path] = kind
+            self.coalesced += 1
+            return
+        self._pending[file_path] = kind
+        self._outstanding += 1
+        self._idle.clear()
+        await self._parse_queue.put(file_path)
+
+    def _finish(self, file_path: str) -> None:
+        self._in_flight.discard(file_path)
+        kind = self._replay.pop(file_path, None)
+        if kind is not None:
+            self._pending[file_path] = kind
+            self._outstanding += 1
+            task = asyncio.create_task(self._parse_queue.put(file_path))
+            self._requeues.add(task)
+            task.add_done_callback(self._requeues.discard)
+        self._outstanding -= 1
+        if self._outstanding == 0:
+            self._idle.set()
+
+    async def _parse_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        stats = self.stage_stats["parse"]
+        while True:
+            file_path = await self._parse_queue.get()
+            kind = self._pending.pop(file_path)
+            self._in_flight.add(file_path)
+            started = time.perf_counter()
+
+            if kind == "delete":
+                item = {
+                    "op": "delete",
+                    "path": file_path,
+                    "document_id": generate_document_id(file_path),
+                }
+                stats.record(time.perf_counter() - started)
+                await self._write_queue.put(item)
+                continue
+
+            try:
+                stat = os.stat(file_path)
+                if self.manifest is not None and self.manifest.unchanged(
+                    file_path, stat
+                ):
+                    logger.debug(f"File {file_path} unchanged since last sync")
+                    self.unchanged_by_stat += 1
+                    stats.skipped += 1
+                    self._finish(file_path)
+                    continue
+                document = await loop.run_in_executor(
+                    self._cpu_pool, prepare_document, file_path
+                )
+                stored = await loop.run_in_executor(
+                    self._io_pool,
+                    self.syncer.get_stored_hashes,
+                    document["document_id"],
+                )
+            except Exception as e:
+                logger.error(f"Error preparing document {file_path}: {str(e)}")
+                stats.errors += 1
+                self._finish(file_path)
+                continue
+            stats.record(time.perf_counter() - started)
+
+            previous_hash = stored["content_hash"] if stored else None
+            same_body = previous_hash == document["content_hash"]
+            if same_body and stored["metadata_hash"] == document["metadata_hash"]:
+                logger.info(f"Document {document['document_id']} unchanged, skipping")
+                stats.skipped += 1
+                if self.manifest is not None:
+                    self.manifest.record(
+                        file_path, stat, previous_hash, document["document_id"]
+                    )
+                self._finish(file_path)
+                continue
+
+            item = {
+                "op": "upsert",
+                "path": file_path,
+                "document": document,
+                "previous_hash": previous_hash,
+                "stat": stat,
+            }
+            if same_body:
+                # Only the frontmatter changed: rewrite the metadata and
+                # resync Permit, keeping the stored vector
+                item["metadata_only"] = True
+                await self._write_queue.put(item)
+                continue
+            await self._embed_queue.put(item)
+
+    async def _embed_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        stats = self.stage_stats["embed"]
+        while True:
+            # Take whatever else is already queued, up to the backend's batch
+            # size, so a backlog is embedded with fewer, larger requests
+            batch = [await self._embed_queue.get()]
+            while len(batch) < self.embed_batch_size and not self._embed_queue.empty():
+                batch.append(self._embed_queue.get_nowait())
+            started = time.perf_counter()
+            try:
+                vectors = await loop.run_in_executor(
+                    self._io_pool,
+                    self.syncer.embed_batch,
+                    [item["document"] for item in batch],
+                )
+            except Exception as e:
+                # Write the batch without vectors, which queues it in the
+                # outbox, rather than losing the only embed worker
+                logger.error(
+                    f"Error embedding batch of {len(batch)} documents: {str(e)}"
+                )
+                vectors = [None] * len(batch)
+            stats.record(time.perf_counter() - started, len(batch))
+            for item, vector in zip(batch, vectors):
+                item["vector"] = vector
+                if not vector:
+                    stats.errors += 1
+                await self._write_queue.put(item)
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._write_queue.get()]
+        flush_at = loop.time() + self.write_interval
+        while len(batch) < self.write_batch_size:
+            timeout = flush_at - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._write_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _writer(self) -> None:
+        loop = asyncio.get_running_loop()
+        stats = self.stage_stats["write"]
+        while True:
+            batch = await self._next_batch()
+            started = time.perf_counter()
+            try:
+                await loop.run_in_executor(
+                    self._io_pool, self.syncer.write_batch, batch
+                )
+                stats.record(time.perf_counter() - started, count=len(batch))
+                self._update_manifest(batch, written=True)
+            except Exception as e:
+                logger.error(f"Error writing batch of {len(batch)} documents: {str(e)}")
+                stats.errors += len(batch)
+                self._update_manifest(batch, written=False)
+            else:
+                if self.permit_sync is not None:
+                    await self._authz_queue.put(batch)
+                    continue
+            for item in batch:
+                self._finish(item["path"])
+
+    async def _authz_worker(self) -> None:
+        stats = self.stage_stats["authz"]
+        while True:
+            batch = await self._authz_queue.get()
+            changes = []
+            for item in batch:
+                if item["op"] == "delete":
+                    changes.append(
+                        {
+                            "op": "delete",
+                            "document_id": item["document_id"],
+                            "path": item["path"],
+                        }
+                    )
+                else:
+                    document = item["document"]
+                    changes.append(
+                        {
+                            "op": "upsert",
+                            "document_id": document["document_id"],
+                            "path": item["path"],
+                            "metadata": document["metadata"],
+                        }
+                    )
+            started = time.perf_counter()
+            # Failures are queued in the Permit outbox by sync_batch
+            errors = self.permit_sync.errors
+            await self.permit_sync.sync_batch(changes)
+            if self.permit_sync.errors > errors:
+                stats.errors += len(batch)
+            else:
+                stats.record(time.perf_counter() - started, count=len(batch))
+            for item in batch:
+                self._finish(item["path"])
+
+    def _update_manifest(self, batch: List[Dict[str, Any]], written: bool) -> None:
+        if self.manifest is None:
+            return
+        for item in batch:
+            if written and item["op"] == "upsert":
+                document = item["document"]
+                self.manifest.record(
+                    item["path"],
+                    item["stat"],
+                    document["content_hash"],
+                    document["document_id"],
+                )
+            else:
+                # Unwritten files must be re-verified on the next scan
+                self.manifest.forget(item["path"])
+
+    async def _save_manifest(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.manifest_save_interval)
+            try:
+                await loop.run_in_executor(self._io_pool, self.manifest.save)
+            except Exception as e:
+                logger.error(f"Error saving manifest: {str(e)}")
+
+    async def _collect_stats(self) -> Dict[str, Any]:
+        queues = {
+            "parse": self._parse_queue,
+            "embed": self._embed_queue,
+            "write": self._write_queue,
+            "authz": self._authz_queue,
+        }
+        return {
+            "outstanding": self._outstanding,
+            "coalesced": self.coalesced,
+            "unchanged_by_stat": self.unchanged_by_stat,
+            "stages": {
+                name: stats.to_dict(queues[name])
+                for name, stats in self.stage_stats.items()
+            },
+        }
+
+    async def _report_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logger.info(f"Ingest pipeline stats: {await self._collect_stats()}")
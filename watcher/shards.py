@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import multiprocessing
+import queue
+from collections import Counter
+from typing import Any, Dict
+
+from utils.document_ids import generate_document_id
+
+logger = logging.getLogger(__name__)
+
+IDLE = "idle"
+REMOVED = "removed"
+STOP = "stop"
+
+
+def shard_for(document_id: str, shard_count: int) -> int:
+    """Return the shard owning a document. Stable across processes and restarts."""
+    digest = hashlib.sha256(document_id.encode()).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def run_shard(
+    index: int,
+    mongodb_uri: str,
+    events: "multiprocessing.Queue",
+    acks: "multiprocessing.Queue",
+    pipeline_options: Dict[str, Any],
+    outbox_poll_interval: float,
+    state_dir: str,
+    shard_count: int,
+) -> None:
+    """
+    Entry point of a shard process: feed routed file events into a local
+    ingest pipeline until told to stop.
+    """
+    from watcher.manifest import manifest_path, open_manifest
+    from watcher.outbox import start_outbox_workers
+    from watcher.permit_sync import PermitSync
+    from watcher.pipeline import IngestPipeline
+    from watcher.sync import DocumentSyncer
+
+    syncer = DocumentSyncer(mongodb_uri)
+    manifest = open_manifest(
+        manifest_path(state_dir, index, shard_count),
+        syncer.collection,
+        syncer.embedding_model,
+    )
+    permit_sync = PermitSync.from_env(syncer.db, syncer.collection)
+    pipeline = IngestPipeline(
+        syncer, manifest=manifest, permit_sync=permit_sync, **pipeline_options
+    )
+    pipeline.start()
+    # Outbox entries are claimed under a lease, so every shard can drain them
+    outbox_workers = start_outbox_workers(
+        syncer, pipeline, permit_sync, outbox_poll_interval
+    )
+    logger.info(f"Shard {index} started")
+
+    while True:
+        kind, file_path = events.get()
+        if kind == STOP:
+            break
+        if kind == IDLE:
+            pipeline.wait_until_idle()
+            logger.info(f"Shard {index} idle: {pipeline.stats()}")
+            acks.put(index)
+            continue
+        if kind == REMOVED:
+            pipeline.submit_removed()
+            continue
+        pipeline.submit(file_path, kind)
+
+    for worker in outbox_workers:
+        worker.stop()
+    pipeline.stop()
+
+
+class ShardCoordinator:
+    """
+    Route file events to worker processes that each own a partition of the
+    documents.
+
+    A document always belongs to the shard picked by shard_for(document_id),
+    so every event for a file, from the startup scan or from the observer, is
+    handled by the same process and events for one file are never processed
+    concurrently by two shards. The coordinator itself only walks the tree and
+    routes paths; parsing, hashing, embedding and writes happen in the shards.
+    Offers the same submit() / wait_until_idle() interface as IngestPipeline.
+    """
+
+    def __init__(
+        self,
+        mongodb_uri: str,
+        shard_count: int,
+        pipeline_options: Dict[str, Any],
+        outbox_poll_interval: float,
+        queue_size: int,
+        state_dir: str,
+    ):
+        self.shard_count = shard_count
+        context = multiprocessing.get_context("spawn")
+        # Bounded queues push back on the scan and the observer when a shard lags
+        self._events = [context.Queue(queue_size) for _ in range(shard_count)]
+        self._acks = context.Queue()
+        self._processes = [
+            context.Process(
+                target=run_shard,
+                name=f"watcher-shard-{index}",
+                args=(
+                    index,
+                    mongodb_uri,
+                    self._events[index],
+                    self._acks,
+                    pipeline_options,
+                    outbox_poll_interval,
+                    state_dir,
+                    shard_count,
+                ),
+                daemon=True,
+            )
+            for index in range(shard_count)
+        ]
+        self.routed: Counter = Counter()
+
+    def start(self) -> None:
+        for process in self._processes:
+            process.start()
+        logger.info(f"Started {self.shard_count} watcher shards")
+
+    def submit(self, file_path: str, kind: str) -> None:
+        index = shard_for(generate_document_id(file_path), self.shard_count)
+        self.routed[index] += 1
+        self._events[index].put((kind, file_path))
+
+    def submit_removed(self) -> int:
+        """Have each shard queue deletes for its files removed while stopped."""
+        for events in self._events:
+            events.put((REMOVED, None))
+        # Each shard logs its own count
+        return 0
+
+    def check_alive(self) -> None:
+        for process in self._processes:
+            if not process.is_alive():
+                raise RuntimeError(
+                    f"{process.name} exited with code {process.exitcode}"
+                )
+
+    def wait_until_idle(self) -> None:
+        """Block until every shard has processed all events routed to it."""
+        for events in self._events:
+            events.put((IDLE, None))
+        pending = set(range(self.shard_count))
+        while pending:
+            try:
+                pending.discard(self._acks.get(timeout=1))
+            except queue.Empty:
+                self.check_alive()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shards": self.shard_count,
+            "routed": {index: self.routed[index] for index in range(self.shard_count)},
+        }
+
+    def stop(self) -> None:
+        for events in self._events:
+            events.put((STOP, None))
+        for process in self._processes:
+            process.join()
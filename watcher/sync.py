@@ -1,16 +1,34 @@
 import os
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 from pymongo import MongoClient
-from langchain_openai import OpenAIEmbeddings
 import hashlib
 
-from watcher.utils import read_markdown_file, enrich_metadata
+from watcher.utils import prepare_document
 from utils.document_ids import generate_document_id
+from utils.embedding_backends import (
+    VECTOR_FIELDS,
+    create_embedding_backend,
+    stamp_legacy_vectors,
+)
+from utils.tenants import stamp_legacy_tenants
+from utils.collection_alias import resolve_alias
+from utils.document_storage import DocumentStorage
+from utils.embedding_store import EmbeddingStore
+from watcher.outbox import SyncOutbox
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BASE_DELAY = float(os.environ.get("OUTBOX_BASE_DELAY", "5"))
+OUTBOX_MAX_DELAY = float(os.environ.get("OUTBOX_MAX_DELAY", "3600"))
+OUTBOX_LEASE_SECONDS = float(os.environ.get("OUTBOX_LEASE_SECONDS", "300"))
+
+# "split" keeps bodies and chunks out of the searchable documents collection
+STORAGE_LAYOUT = os.environ.get("STORAGE_LAYOUT", "single")
+DOCUMENT_CHUNK_SIZE = int(os.environ.get("DOCUMENT_CHUNK_SIZE", "2000"))
+
 
 class DocumentSyncer:
     def __init__(self, mongodb_uri: str):
@@ -22,20 +40,53 @@ class DocumentSyncer:
         self.mongodb_uri = mongodb_uri
         self.mongo_client = MongoClient(self.mongodb_uri)
         self.db = self.mongo_client.secure_rag
-        self.collection = self.db.documents
+        # Write to the collection the documents alias points at; a reindexed
+        # collection also brings the settings it was built with
+        pointer = resolve_alias(self.db)
+        settings = pointer.get("settings", {})
+        self.collection_name = pointer["collection"]
+        self.collection = self.db[self.collection_name]
         self.collection.create_index("document_id", unique=True)
+        self.storage = DocumentStorage(
+            self.mongo_client,
+            self.db,
+            settings.get("storage_layout", STORAGE_LAYOUT),
+            settings.get("chunk_size", DOCUMENT_CHUNK_SIZE),
+            collection=self.collection_name,
+        )
+        self.storage.migrate()
+        self.storage.ensure_text_index()
+        stamp_legacy_tenants(self.collection)
 
-        openai_api_key = os.environ.get("OPENAI_API_KEY")
-        if not openai_api_key:
-            logger.warning(
-                "OPENAI_API_KEY environment variable is not set. Embeddings will not be generated."
-            )
+        try:
+            self.embeddings = create_embedding_backend(**settings.get("embedding", {}))
+        except ValueError as e:
+            logger.warning(f"{str(e)}. Embeddings will not be generated.")
             self.embeddings = None
-        else:
-            self.embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
+
+        self.embedding_store = None
+        if self.embeddings:
+            stamp_legacy_vectors(self.collection, self.embeddings)
+            self.embedding_store = EmbeddingStore(
+                self.db.embedding_store, self.embeddings.model_id
+            )
+
+        # Failed embeddings and writes are queued here and retried
+        self.outbox = SyncOutbox(
+            self.db.sync_outbox,
+            max_attempts=OUTBOX_MAX_ATTEMPTS,
+            base_delay=OUTBOX_BASE_DELAY,
+            max_delay=OUTBOX_MAX_DELAY,
+            lease_seconds=OUTBOX_LEASE_SECONDS,
+        )
 
         logger.info("Document syncer initialized")
 
+    @property
+    def embedding_model(self) -> Optional[str]:
+        """Model ID of the configured embedding backend, if any."""
+        return self.embeddings.model_id if self.embeddings else None
+
     def compute_content_hash(self, content: str) -> str:
         """Compute MD5 hash of the content for change detection."""
         return hashlib.md5(content.encode()).hexdigest()
@@ -43,9 +94,7 @@ class DocumentSyncer:
     def generate_embedding(self, content: str) -> list[float]:
         """Generate vector embedding for the given content."""
         if not self.embeddings:
-            logger.warning(
-                "OpenAI embeddings not initialized. Cannot generate embedding."
-            )
+            logger.warning("Embeddings not initialized. Cannot generate embedding.")
             return None
 
         try:
@@ -54,85 +103,143 @@ class DocumentSyncer:
             logger.error(f"Error generating embedding: {str(e)}")
             return None
 
-    def sync_document(self, file_path: str, is_new: bool = False) -> bool:
+    def embed_content(self, content: str, content_hash: str) -> list[float]:
+        """Return the embedding for content, reusing a stored one when possible."""
+        if not self.embedding_store:
+            return self.generate_embedding(content)
+        return self.embedding_store.get_or_embed(
+            content_hash, content, self.generate_embedding
+        )
+
+    def embed_batch(self, documents: List[Dict[str, Any]]) -> List[Optional[list]]:
+        """
+        Return embeddings for several documents, reusing stored ones and
+        computing the rest with batched requests to the embedding backend.
+        Args:
+            documents: Prepared documents with "content" and "content_hash"
+        Returns:
+            One vector per document, None where it could not be generated
+        """
+        vectors: List[Optional[list]] = [None] * len(documents)
+        if not self.embeddings:
+            return vectors
+
+        # Embedding store errors are handled like backend errors, so a
+        # MongoDB failure costs this batch its vectors, not the pipeline
+        try:
+            missing = []
+            for index, document in enumerate(documents):
+                if self.embedding_store:
+                    vectors[index] = self.embedding_store.get(document["content_hash"])
+                if vectors[index] is None:
+                    missing.append(index)
+            if not missing:
+                return vectors
+
+            computed = self.embeddings.embed_documents(
+                [documents[index]["content"] for index in missing]
+            )
+            for index, vector in zip(missing, computed):
+                vectors[index] = vector
+                if self.embedding_store:
+                    self.embedding_store.put(documents[index]["content_hash"], vector)
+        except Exception as e:
+            logger.error(f"Error embedding {len(documents)} documents: {str(e)}")
+        return vectors
+
+    def sync_document(
+        self, file_path: str, is_new: bool = False, force: bool = False
+    ) -> bool:
         """
         Sync a document to MongoDB.
         Args:
             file_path: Path to the markdown file
             is_new: Whether the document is newly created (True) or updated (False)
+            force: Write and embed the document even if it is unchanged
         Returns:
             True if sync is successful, False otherwise
         """
         logger.info(f"Syncing document: {file_path} (is_new={is_new})")
 
         try:
-            # Read markdown file
-            metadata, content, file_name = read_markdown_file(file_path)
-
-            # Enrich metadata
-            metadata = enrich_metadata(metadata, file_path)
-
-            # Generate document ID
-            document_id = generate_document_id(file_path)
-
-            # Compute content hash
-            content_hash = self.compute_content_hash(content)
+            # Read the file into a document object with its content hash
+            document = prepare_document(file_path)
+            document_id = document["document_id"]
+            content = document["content"]
+            content_hash = document["content_hash"]
 
-            # Check if document exists with same content hash
-            existing_doc = self.collection.find_one({"document_id": document_id})
-            if existing_doc and existing_doc.get("content_hash") == content_hash:
+            # Check if document exists with same body and metadata
+            existing_doc = self.collection.find_one(
+                {"document_id": document_id},
+                {"content_hash": 1, "metadata_hash": 1, "embedding_model": 1},
+            )
+            previous_hash = self._usable_hash(existing_doc) if existing_doc else None
+            if (
+                not force
+                and previous_hash == content_hash
+                and existing_doc.get("metadata_hash") == document["metadata_hash"]
+            ):
                 logger.info(f"Document {document_id} unchanged, skipping sync")
                 return True
 
-            # Create document object
-            document = {
-                "document_id": document_id,
-                "filename": os.path.basename(file_path),
-                "filepath": file_path,
-                "metadata": metadata,
-                "content": content,
-                "content_hash": content_hash,
-            }
-
             # Upsert document to MongoDB
-            result = self.collection.update_one(
-                {"document_id": document_id}, {"$set": document}, upsert=True
-            )
+            result = self.storage.write([document], [])
             logger.info(
-                f"MongoDB result: acknowledged={result.acknowledged}, modified_count={result.modified_count}, upserted_id={result.upserted_id}"
+                f"MongoDB result: modified_count={result.modified_count}, upserted_count={result.upserted_count}"
             )
             logger.info(f"Document {document_id} synced to MongoDB")
 
             # Check if embedding needs to be generated
-            document_with_embedding = self.collection.find_one(
-                {"document_id": document_id, "vector_embedding": {"$exists": True}}
-            )
+            embedding_query = {
+                "document_id": document_id,
+                "vector_embedding": {"$exists": True},
+            }
+            if self.embeddings:
+                embedding_query["embedding_model"] = self.embeddings.model_id
+            document_with_embedding = self.collection.find_one(embedding_query)
             has_embedding = document_with_embedding is not None
 
+            # A metadata-only change keeps the vector of the unchanged body
             should_generate_embedding = (
-                result.upserted_id is not None
-                or result.modified_count > 0
-                or not has_embedding
+                force or previous_hash != content_hash or not has_embedding
             )
 
             if should_generate_embedding:
                 logger.info(f"Generating embeddings for document {document_id}")
-                # Generate embedding
-                vector_embedding = self.generate_embedding(content)
+                # Generate embedding, or reuse one for identical content
+                vector_embedding = self.embed_content(content, content_hash)
 
                 if vector_embedding:
                     # Update document with embedding
                     embed_result = self.collection.update_one(
                         {"document_id": document_id},
-                        {"$set": {"vector_embedding": vector_embedding}},
+                        {"$set": self.embeddings.vector_fields(vector_embedding)},
                     )
+                    if self.embedding_store:
+                        self.embedding_store.acquire(content_hash, document_id)
+                        previous_hash = (existing_doc or {}).get("content_hash")
+                        if previous_hash and previous_hash != content_hash:
+                            self.embedding_store.release(previous_hash, document_id)
                     logger.info(
                         f"Embedding update result: acknowledged={embed_result.acknowledged}, modified_count={embed_result.modified_count}"
                     )
                     logger.info(f"Embeddings generated for document {document_id}")
+                    self.outbox.resolve([document_id])
                 else:
-                    logger.warning(
-                        f"Failed to generate embeddings for document {document_id}"
+                    if previous_hash != content_hash:
+                        # Drop the vector of the old body until a new one exists
+                        self.collection.update_one(
+                            {"document_id": document_id},
+                            {"$unset": {field: "" for field in VECTOR_FIELDS}},
+                        )
+                        stored_hash = (existing_doc or {}).get("content_hash")
+                        if self.embedding_store and stored_hash:
+                            self.embedding_store.release(stored_hash, document_id)
+                    self.outbox.enqueue(
+                        "upsert",
+                        document_id,
+                        file_path,
+                        "Failed to generate embeddings",
                     )
             else:
                 logger.info(
@@ -142,6 +249,9 @@ class DocumentSyncer:
 
         except Exception as e:
             logger.error(f"Error syncing document {file_path}: {str(e)}")
+            self.outbox.enqueue(
+                "upsert", generate_document_id(file_path), file_path, str(e)
+            )
             return False
 
     def delete_document(self, file_path: str) -> None:
@@ -150,9 +260,178 @@ class DocumentSyncer:
         Args:
             file_path: Path to the markdown file
         """
+        document_id = generate_document_id(file_path)
         try:
-            document_id = generate_document_id(file_path)
-            self.collection.delete_one({"document_id": document_id})
+            existing_doc = self.collection.find_one(
+                {"document_id": document_id}, {"content_hash": 1}
+            )
+            self.storage.write([], [document_id])
+            if (
+                self.embedding_store
+                and existing_doc
+                and existing_doc.get("content_hash")
+            ):
+                self.embedding_store.release(existing_doc["content_hash"], document_id)
             logger.info(f"Document {document_id} deleted from MongoDB")
         except Exception as e:
             logger.error(f"Error deleting document {file_path}: {str(e)}")
+            self.outbox.enqueue("delete", document_id, file_path, str(e))
+
+    def get_content_hash(self, document_id: str) -> Optional[str]:
+        """
+        Return the stored content hash of a document, if it exists. A document
+        embedded by another backend or model has no usable hash, so it is
+        embedded again.
+        """
+        existing_doc = self.collection.find_one(
+            {"document_id": document_id}, {"content_hash": 1, "embedding_model": 1}
+        )
+        return self._usable_hash(existing_doc) if existing_doc else None
+
+    def get_stored_hashes(self, document_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the usable content hash (see get_content_hash) and the metadata
+        hash of a stored document, or None if it does not exist.
+        """
+        existing_doc = self.collection.find_one(
+            {"document_id": document_id},
+            {"content_hash": 1, "metadata_hash": 1, "embedding_model": 1},
+        )
+        if not existing_doc:
+            return None
+        return {
+            "content_hash": self._usable_hash(existing_doc),
+            "metadata_hash": existing_doc.get("metadata_hash"),
+        }
+
+    def _usable_hash(self, existing_doc: Dict[str, Any]) -> Optional[str]:
+        if self.embeddings and (
+            existing_doc.get("embedding_model") != self.embeddings.model_id
+        ):
+            return None
+        return existing_doc.get("content_hash")
+
+    def write_batch(self, items: List[Dict[str, Any]]) -> None:
+        """
+        Apply a batch of upserts and deletes with a single bulk write.
+        Args:
+            items: Pipeline items; upserts carry "document", "vector" and
+                "previous_hash", deletes carry "document_id". Upserts marked
+                "metadata_only" keep their stored vector
+        """
+        deleted_ids = [i["document_id"] for i in items if i["op"] == "delete"]
+        deleted_hashes = {}
+        if deleted_ids and self.embedding_store:
+            for doc in self.collection.find(
+                {"document_id": {"$in": deleted_ids}},
+                {"document_id": 1, "content_hash": 1},
+            ):
+                deleted_hashes[doc["document_id"]] = doc.get("content_hash")
+
+        upserts = []
+        unset = {}
+        for item in items:
+            if item["op"] == "delete":
+                continue
+            document = dict(item["document"])
+            if item.get("vector"):
+                document.update(self.embeddings.vector_fields(item["vector"]))
+            elif item.get("metadata_only"):
+                # The stored body and its chunks are already current
+                document.pop("content", None)
+            else:
+                # Drop the vector of the old body, so it neither matches the
+                # new text nor makes the document look embedded after a restart
+                unset[document["document_id"]] = VECTOR_FIELDS
+                self.outbox.enqueue(
+                    "upsert",
+                    document["document_id"],
+                    item["path"],
+                    "Failed to generate embeddings",
+                )
+            upserts.append(document)
+
+        if not upserts and not deleted_ids:
+            return
+        try:
+            result = self.storage.write(upserts, deleted_ids, unset)
+        except Exception as e:
+            # Replays are idempotent, so queue the whole batch
+            for item in items:
+                document_id = item.get("document_id") or item["document"]["document_id"]
+                self.outbox.enqueue(item["op"], document_id, item["path"], str(e))
+            raise
+        logger.info(
+            f"Bulk write: upserted={result.upserted_count}, modified={result.modified_count}, deleted={result.deleted_count}"
+        )
+        self.outbox.resolve(
+            [
+                item.get("document_id") or item["document"]["document_id"]
+                for item in items
+                if item["op"] == "delete"
+                or item.get("vector")
+                or item.get("metadata_only")
+            ]
+        )
+
+        if not self.embedding_store:
+            return
+        for item in items:
+            if item["op"] == "delete":
+                content_hash = deleted_hashes.get(item["document_id"])
+                if content_hash:
+                    self.embedding_store.release(content_hash, item["document_id"])
+            elif item.get("vector"):
+                document = item["document"]
+                self.embedding_store.acquire(
+                    document["content_hash"], document["document_id"]
+                )
+                previous_hash = item.get("previous_hash")
+                if previous_hash and previous_hash != document["content_hash"]:
+                    self.embedding_store.release(previous_hash, document["document_id"])
+            elif not item.get("metadata_only") and item.get("previous_hash"):
+                # The old vector was dropped with the failed embedding
+                self.embedding_store.release(
+                    item["previous_hash"], item["document"]["document_id"]
+                )
+
+    def retry_entry(self, entry: Dict[str, Any]) -> None:
+        """
+        Retry the sync work recorded in an outbox entry.
+        Args:
+            entry: Outbox entry with "op", "_id" (the document ID) and "filepath"
+        Raises:
+            RuntimeError: If the embedding still cannot be generated
+        """
+        if entry["op"] == "delete":
+            self.write_batch(
+                [
+                    {
+                        "op": "delete",
+                        "path": entry["filepath"],
+                        "document_id": entry["_id"],
+                    }
+                ]
+            )
+            return
+
+        if not os.path.exists(entry["filepath"]):
+            # The file is gone; its deletion is synced separately
+            logger.info(f"Skipping retry of {entry['_id']}, file no longer exists")
+            return
+
+        document = prepare_document(entry["filepath"])
+        vector = self.embed_content(document["content"], document["content_hash"])
+        if not vector:
+            raise RuntimeError("Failed to generate embeddings")
+        self.write_batch(
+            [
+                {
+                    "op": "upsert",
+                    "path": entry["filepath"],
+                    "document": document,
+                    "vector": vector,
+                    "previous_hash": self.get_content_hash(document["document_id"]),
+                }
+            ]
+        )
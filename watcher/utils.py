@@ -1,8 +1,11 @@
 import os
 import frontmatter
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, Optional
 import hashlib
 
+from utils.document_ids import compute_metadata_hash, generate_document_id
+from utils.tenants import document_tenant
+
 
 def read_markdown_file(file_path: str) -> tuple[Dict[str, Any], str, str]:
     """
@@ -22,6 +25,24 @@ def read_markdown_file(file_path: str) -> tuple[Dict[str, Any], str, str]:
     return metadata, content, file_name
 
 
+def iter_markdown_files(directory: str) -> Iterator[str]:
+    """
+    Recursively yield the markdown files under directory. Uses os.scandir,
+    which reads entry types from the directory listing without opening or
+    stat-ing the files.
+    Args:
+        directory: Directory to scan
+    Returns:
+        Iterator over markdown file paths
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_markdown_files(entry.path)
+            elif entry.is_file() and entry.name.endswith((".md", ".markdown")):
+                yield entry.path
+
+
 def get_document_id(file_path: str) -> str:
     """
     Generate a unique document ID based on the file path.
@@ -58,8 +79,11 @@ def enrich_metadata(metadata: Dict[str, Any], file_path: str) -> Dict[str, Any]:
         file_path: Path to the markdown file
     Returns:
         Enriched metadata
+    Raises:
+        ValueError: If the document names an invalid tenant
     """
     enriched_metadata = metadata.copy()
+    enriched_metadata["tenant"] = document_tenant(metadata, file_path)
 
     if "department" not in enriched_metadata:
         department = extract_department_from_path(file_path)
@@ -73,3 +97,26 @@ def enrich_metadata(metadata: Dict[str, Any], file_path: str) -> Dict[str, Any]:
         enriched_metadata["author"] = "unknown"
 
     return enriched_metadata
+
+
+def prepare_document(file_path: str) -> Dict[str, Any]:
+    """
+    Parse a markdown file into the document stored in MongoDB (without embedding).
+    This is pure CPU work and safe to run in a separate process.
+    Args:
+        file_path: Path to the markdown file
+    Returns:
+        Document with id, file info, enriched metadata, content, the content
+        hash of the body (the embedding store key) and the metadata hash
+    """
+    metadata, content, file_name = read_markdown_file(file_path)
+    document = {
+        "document_id": generate_document_id(file_path),
+        "filename": file_name,
+        "filepath": file_path,
+        "metadata": enrich_metadata(metadata, file_path),
+        "content": content,
+        "content_hash": hashlib.md5(content.encode()).hexdigest(),
+    }
+    document["metadata_hash"] = compute_metadata_hash(document)
+    return document